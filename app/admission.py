@@ -0,0 +1,133 @@
+# Per-stage admission control: bounded concurrency, bounded wait queues and deadline-aware rejection
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional
+
+from prometheus_client import Gauge, Counter
+
+REQUEST_DEADLINE_SECONDS = float(os.environ.get("REQUEST_DEADLINE_SECONDS", "90"))
+
+STAGE_IN_FLIGHT = Gauge("slideai_stage_in_flight", "Work items currently running in a stage", ["stage"])
+STAGE_QUEUE_DEPTH = Gauge("slideai_stage_queue_depth", "Work items waiting for a stage", ["stage"])
+STAGE_REJECTIONS = Counter("slideai_stage_rejections_total", "Work items rejected by admission control",
+                           ["stage", "reason"])
+
+_deadline: ContextVar[Optional[float]] = ContextVar("deadline", default=None)
+
+
+class OverloadedError(Exception):
+    """Raised when a stage cannot take more work, the request should be answered with 429."""
+
+    def __init__(self, stage: str, reason: str, retry_after_seconds: float):
+        super().__init__(f"Stage '{stage}' is overloaded ({reason})")
+        self.stage = stage
+        self.reason = reason
+        self.retry_after_seconds = max(1, math.ceil(retry_after_seconds))
+
+
+class StageLimiter:
+
+    def __init__(self, name: str, max_concurrency: int, max_queue: int, initial_duration_seconds: float):
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        # Moving average of how long one work item holds the stage, used to estimate waiting times
+        self.average_duration_seconds = initial_duration_seconds
+
+        self._semaphore = threading.BoundedSemaphore(max_concurrency)
+        self._lock = threading.Lock()
+        self._waiting = 0
+        self._in_flight = 0
+
+    def estimated_wait_seconds(self, queue_position: int) -> float:
+        if self._in_flight < self.max_concurrency and queue_position == 0:
+            return 0
+        return (queue_position + 1) / self.max_concurrency * self.average_duration_seconds
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "max_concurrency": self.max_concurrency,
+                "max_queue": self.max_queue,
+                "in_flight": self._in_flight,
+                "waiting": self._waiting,
+                "average_duration_seconds": round(self.average_duration_seconds, 3),
+            }
+
+    @contextmanager
+    def acquire(self):
+        remaining_seconds = remaining_deadline_seconds()
+
+        with self._lock:
+            estimated_wait = self.estimated_wait_seconds(self._waiting)
+            if self._in_flight >= self.max_concurrency and self._waiting >= self.max_queue:
+                self._reject("queue_full", estimated_wait)
+            if remaining_seconds is not None and estimated_wait > remaining_seconds:
+                self._reject("deadline", estimated_wait)
+            self._waiting += 1
+            STAGE_QUEUE_DEPTH.labels(stage=self.name).set(self._waiting)
+
+        acquired = self._semaphore.acquire(timeout=remaining_seconds)
+
+        with self._lock:
+            self._waiting -= 1
+            STAGE_QUEUE_DEPTH.labels(stage=self.name).set(self._waiting)
+            if not acquired:
+                self._reject("deadline", self.estimated_wait_seconds(self._waiting))
+            self._in_flight += 1
+            STAGE_IN_FLIGHT.labels(stage=self.name).set(self._in_flight)
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            duration = time.perf_counter() - start
+            with self._lock:
+                self._in_flight -= 1
+                STAGE_IN_FLIGHT.labels(stage=self.name).set(self._in_flight)
+                self.average_duration_seconds = 0.8 * self.average_duration_seconds + 0.2 * duration
+            self._semaphore.release()
+
+    def _reject(self, reason: str, retry_after_seconds: float):
+        STAGE_REJECTIONS.labels(stage=self.name, reason=reason).inc()
+        raise OverloadedError(self.name, reason, retry_after_seconds)
+
+
+def _limiter_from_environment(name: str, max_concurrency: int, max_queue: int, initial_duration_seconds: float):
+    prefix = f"ADMISSION_{name.upper()}"
+    return StageLimiter(
+        name,
+        max_concurrency=int(os.environ.get(f"{prefix}_CONCURRENCY", max_concurrency)),
+        max_queue=int(os.environ.get(f"{prefix}_QUEUE", max_queue)),
+        initial_duration_seconds=initial_duration_seconds
+    )
+
+
+# Defaults sized for one shared CPU and 1 GB of memory: LLM calls mostly wait on the network,
+# rendering and LibreOffice need CPU and memory
+LIMITERS = {
+    "llm": _limiter_from_environment("llm", max_concurrency=8, max_queue=32, initial_duration_seconds=3),
+    "render": _limiter_from_environment("render", max_concurrency=2, max_queue=8, initial_duration_seconds=0.5),
+    "pdf": _limiter_from_environment("pdf", max_concurrency=1, max_queue=4, initial_duration_seconds=3),
+}
+
+
+def start_deadline(seconds: float = REQUEST_DEADLINE_SECONDS):
+    _deadline.set(time.monotonic() + seconds)
+
+
+def remaining_deadline_seconds() -> Optional[float]:
+    deadline = _deadline.get()
+    return None if deadline is None else max(deadline - time.monotonic(), 0)
+
+
+def limit(stage: str):
+    return LIMITERS[stage].acquire()
+
+
+def snapshot() -> dict:
+    return {name: limiter.snapshot() for name, limiter in LIMITERS.items()}
@@ -0,0 +1,206 @@
+# Serving and retention of the generated pptx and pdf files. Presentation names carry a timestamp and are never
+# reused, so their files can be cached by clients forever and are removed by age instead of after the first read.
+import asyncio
+import gzip
+import hashlib
+import os
+import re
+import shutil
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from prometheus_client import Counter, Gauge
+from starlette.concurrency import run_in_threadpool
+from starlette.requests import Request
+from starlette.responses import FileResponse, Response
+
+ARTIFACT_RETENTION_SECONDS = float(os.environ.get("ARTIFACT_RETENTION_SECONDS", "86400"))
+# Oldest artifacts are removed first once all of them together take more than this, 0 turns the limit off
+ARTIFACT_RETENTION_MAX_BYTES = int(os.environ.get("ARTIFACT_RETENTION_MAX_BYTES", str(500 * 1024 * 1024)))
+ARTIFACT_SWEEP_INTERVAL_SECONDS = float(os.environ.get("ARTIFACT_SWEEP_INTERVAL", "300"))
+# gzip: serve PDFs and profiles compressed to clients that accept it, pptx and xlsx files are zip archives already
+ARTIFACT_COMPRESSION = os.environ.get("ARTIFACT_COMPRESSION", "off")
+COMPRESSIBLE_MEDIA_TYPES = {"application/pdf", "text/plain"}
+# A compressed copy is only kept when it saves at least this share of the bytes
+MIN_COMPRESSION_SAVING = 0.1
+
+IMMUTABLE_CACHE_CONTROL = "private, max-age=31536000, immutable"
+
+# Only files named like render_presentation names them are ever removed, e.g. <uuid>_2025-01-31_12-00-00.pptx,
+# and the profiles stored with them
+ARTIFACT_NAME = re.compile(r"_\d{4}-\d{2}-\d{2}_\d{2}-\d{2}-\d{2}\.(pptx|pdf|profile\.txt)(\.gz)?$")
+# The inputs a deck is made from expire the same way: <uuid>_data.csv data files, which streamed tables read again
+# on re-renders, <uuid>.json copies of the data field and <uuid>_<upload name>.xlsx workbooks
+INPUT_NAME = re.compile(r"^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}"
+                        r"(_data\.(json|csv|parquet|arrows)|\.(json|csv)|_.+\.xlsx)$")
+
+ARTIFACT_RESPONSES = Counter("slideai_artifact_responses_total", "Artifact downloads by response kind",
+                             ["media_type", "kind"])
+ARTIFACTS_REMOVED = Counter("slideai_artifacts_removed_total", "Artifacts removed by the retention policy",
+                            ["reason"])
+ARTIFACT_BYTES = Gauge("slideai_artifact_bytes", "Bytes taken by the retained artifacts")
+
+MAX_CACHED_ETAGS = 512
+
+# {path: (mtime_ns, size, etag)}, hashing is only repeated when the file changes
+_etags = OrderedDict()
+_archived = set()
+_lock = threading.Lock()
+
+
+def cached_etag(path: str, stat_result: os.stat_result) -> Optional[str]:
+    """The ETag hashed before for this version of the file, or None."""
+    path = os.path.abspath(path)
+    with _lock:
+        cached = _etags.get(path)
+        if cached is not None and cached[:2] == (stat_result.st_mtime_ns, stat_result.st_size):
+            _etags.move_to_end(path)
+            return cached[2]
+    return None
+
+
+def etag(path: str, stat_result: os.stat_result) -> str:
+    """Strong ETag from the file's content."""
+    tag = cached_etag(path, stat_result)
+    if tag is not None:
+        return tag
+
+    path = os.path.abspath(path)
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(1024 * 1024), b""):
+            digest.update(chunk)
+    tag = f'"{digest.hexdigest()[:32]}"'
+
+    with _lock:
+        _etags[path] = (stat_result.st_mtime_ns, stat_result.st_size, tag)
+        _etags.move_to_end(path)
+        while len(_etags) > MAX_CACHED_ETAGS:
+            _etags.popitem(last=False)
+    return tag
+
+
+def _matches(if_none_match: Optional[str], tag: str) -> bool:
+    # If-None-Match uses the weak comparison, a W/ prefix does not matter
+    if not if_none_match:
+        return False
+    candidates = [candidate.strip().removeprefix("W/") for candidate in if_none_match.split(",")]
+    return "*" in candidates or tag in candidates
+
+
+async def file_response(request: Request, path: str, media_type: str, filename: str,
+                        content_disposition_type: str = "attachment",
+                        cache_control: str = IMMUTABLE_CACHE_CONTROL) -> Response:
+    """Serves a file with ETag, 304 for a matching If-None-Match, Range support and optional compression.
+
+    Raises FileNotFoundError if the file does not exist. Only hashing a file not seen before and compressing it take a
+    worker thread.
+    """
+    stat_result = os.stat(path)
+    tag = cached_etag(path, stat_result) or await run_in_threadpool(etag, path, stat_result)
+    headers = {"ETag": tag, "Cache-Control": cache_control}
+
+    compressed_path = None
+    if ARTIFACT_COMPRESSION == "gzip" and media_type in COMPRESSIBLE_MEDIA_TYPES:
+        headers["Vary"] = "Accept-Encoding"
+        # Ranges refer to the bytes of the file itself, range requests are answered uncompressed
+        if "gzip" in request.headers.get("accept-encoding", "") and "range" not in request.headers:
+            compressed_path = await run_in_threadpool(_compressed_copy, path, stat_result)
+            if compressed_path is not None:
+                # The compressed variant has other bytes and needs an ETag of its own
+                headers["ETag"] = f'{tag[:-1]}-gzip"'
+                headers["Content-Encoding"] = "gzip"
+
+    if _matches(request.headers.get("if-none-match"), headers["ETag"]):
+        ARTIFACT_RESPONSES.labels(media_type=media_type, kind="not_modified").inc()
+        return Response(status_code=304, headers=headers)
+
+    kind = "partial" if "range" in request.headers and compressed_path is None else "full"
+    ARTIFACT_RESPONSES.labels(media_type=media_type, kind=kind).inc()
+    if compressed_path is not None:
+        return FileResponse(compressed_path, headers=headers, media_type=media_type, filename=filename,
+                            content_disposition_type=content_disposition_type)
+    return FileResponse(path, headers=headers, media_type=media_type, filename=filename, stat_result=stat_result,
+                        content_disposition_type=content_disposition_type)
+
+
+def _compressed_copy(path: str, stat_result: os.stat_result) -> Optional[str]:
+    # Compressed once next to the file, an empty marker file records that compression did not pay off
+    compressed_path = f"{path}.gz"
+    skip_path = f"{path}.gz.skip"
+    if os.path.exists(skip_path):
+        return None
+    if os.path.exists(compressed_path) and os.stat(compressed_path).st_mtime_ns >= stat_result.st_mtime_ns:
+        return compressed_path
+
+    partial_path = f"{compressed_path}.{threading.get_ident()}.part"
+    with open(path, "rb") as source, gzip.open(partial_path, "wb", compresslevel=6) as target:
+        shutil.copyfileobj(source, target)
+
+    if os.path.getsize(partial_path) > stat_result.st_size * (1 - MIN_COMPRESSION_SAVING):
+        os.remove(partial_path)
+        open(skip_path, "wb").close()
+        return None
+    os.replace(partial_path, compressed_path)
+    return compressed_path
+
+
+def mark_archived(path: str) -> bool:
+    """Returns True the first time it is called for a path, so an artifact is archived once."""
+    path = os.path.abspath(path)
+    with _lock:
+        if path in _archived:
+            return False
+        _archived.add(path)
+        return True
+
+
+def sweep(directory: str = ".") -> int:
+    """Removes artifacts and input files older than ARTIFACT_RETENTION_SECONDS, then the oldest ones over the size
+    limit.
+
+    Returns the number of removed files.
+    """
+    now = time.time()
+    artifacts = []
+    for entry in os.scandir(directory):
+        base_name = entry.name.removesuffix(".skip")
+        if entry.is_file() and (ARTIFACT_NAME.search(base_name) or INPUT_NAME.match(entry.name)):
+            stat_result = entry.stat()
+            artifacts.append((stat_result.st_mtime, stat_result.st_size, os.path.abspath(entry.path)))
+
+    removed = 0
+    retained_bytes = sum(size for _, size, _ in artifacts)
+    for modified_at, size, path in sorted(artifacts):
+        if now - modified_at > ARTIFACT_RETENTION_SECONDS:
+            reason = "expired"
+        elif ARTIFACT_RETENTION_MAX_BYTES and retained_bytes > ARTIFACT_RETENTION_MAX_BYTES:
+            reason = "size_limit"
+        else:
+            continue
+
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        retained_bytes -= size
+        removed += 1
+        ARTIFACTS_REMOVED.labels(reason=reason).inc()
+        with _lock:
+            _etags.pop(path, None)
+            _archived.discard(path)
+
+    ARTIFACT_BYTES.set(retained_bytes)
+    return removed
+
+
+async def sweep_periodically(directory: str = "."):
+    """Runs sweep every ARTIFACT_SWEEP_INTERVAL_SECONDS until cancelled."""
+    while True:
+        try:
+            await run_in_threadpool(sweep, directory)
+        except Exception as e:
+            print(f"Error removing expired artifacts: {e}")
+        await asyncio.sleep(ARTIFACT_SWEEP_INTERVAL_SECONDS)
@@ -610,7 +610,7 @@ def create_pie_chart(presentation, dataframe, chart_information: TwoColumnDataSt
         slide = presentation.slides.add_slide(presentation.slide_layouts[1])
 
         # Convert all column headers to strings to avoid errors when matching with selected columns from openai prompt
-        dataframe.columns = dataframe.columns.astype(str)
+        dataframe = dataframe.rename(columns=str, copy=False)
 
         # Create a CategoryChartData object
         chart_data = CategoryChartData()
@@ -652,7 +652,7 @@ def create_doughnut_chart(presentation, dataframe, chart_information: TwoColumnD
         slide = presentation.slides.add_slide(presentation.slide_layouts[1])
 
         # Convert all column headers to strings to avoid errors when matching with selected columns from openai prompt
-        dataframe.columns = dataframe.columns.astype(str)
+        dataframe = dataframe.rename(columns=str, copy=False)
 
         # Create a CategoryChartData object
         chart_data = CategoryChartData()
@@ -0,0 +1,65 @@
+# Local chart decisions from column types, used instead of the LLM while the upstream is unhealthy
+import pandas as pd
+
+from models import ChartDecisions, SelectedChartType, ChartType, TwoColumnDataStructure, MultiColumnDataStructure
+
+SUM_ROW_LABELS = {"total", "sum", "summe", "gesamt", "grand total"}
+
+MAX_PIE_CATEGORIES = 5
+MIN_LINE_CATEGORIES = 10
+
+
+def decide_charts(df) -> ChartDecisions:
+    """Takes the first text column as category and the numeric columns as values."""
+    df = df.rename(columns=str, copy=False)
+
+    numeric_columns = [column for column in df.columns if pd.api.types.is_numeric_dtype(df[column])]
+    text_columns = [column for column in df.columns if column not in numeric_columns]
+
+    category = text_columns[0] if text_columns else df.columns[0]
+    value_columns = [column for column in numeric_columns if column != category]
+    if not value_columns:
+        raise ValueError("No numeric columns to chart")
+
+    last_line_includes_sum = str(df[category].iloc[-1]).strip().lower() in SUM_ROW_LABELS
+    category_count = df[category].nunique() - (1 if last_line_includes_sum else 0)
+    # Numbers and dates as categories (e.g. years) have an order of their own
+    categories = df[category].iloc[:-1] if last_line_includes_sum else df[category]
+    has_natural_sorting_order = category not in text_columns or pd.to_numeric(categories, errors="coerce").notna().all()
+
+    decisions = ChartDecisions(
+        selected_chart_type=SelectedChartType(
+            reason_for_selected_chart_types="Chosen from the column types, the AI service was unavailable",
+            chart_types=[],
+            is_in_long_format=False,
+            last_line_includes_sum=last_line_includes_sum
+        ),
+        chart_types=[],
+        last_line_includes_sum=last_line_includes_sum
+    )
+
+    if len(value_columns) == 1:
+        decisions.chart_types = [ChartType.COLUMN.value]
+        if category_count <= MAX_PIE_CATEGORIES and (df[value_columns[0]] >= 0).all():
+            decisions.chart_types.append(ChartType.PIE.value)
+        decisions.two_column_data = TwoColumnDataStructure(
+            category=category,
+            value=value_columns[0],
+            axis_label=value_columns[0],
+            axis_unit="",
+            has_natural_sorting_order=has_natural_sorting_order
+        )
+    else:
+        decisions.chart_types = [ChartType.COLUMN_CLUSTERED.value]
+        if has_natural_sorting_order and category_count > MIN_LINE_CATEGORIES:
+            decisions.chart_types.append(ChartType.LINE.value)
+        decisions.multi_column_data = MultiColumnDataStructure(
+            category=category,
+            series=value_columns,
+            axis_label="",
+            axis_unit="",
+            has_natural_sorting_order=has_natural_sorting_order
+        )
+
+    decisions.selected_chart_type.chart_types = list(decisions.chart_types)
+    return decisions
@@ -0,0 +1,337 @@
+# Parses tabular data sent as JSON, CSV, Parquet or Arrow IPC (stream or file) into the DataFrame create_chart expects
+import os
+from collections import deque
+from dataclasses import dataclass
+from io import BytesIO
+from typing import Iterator, Optional
+
+import numpy as np
+import pandas as pd
+import pyarrow
+import pyarrow.csv
+import pyarrow.ipc
+import pyarrow.parquet
+from prometheus_client import Counter
+
+import profiling
+
+# on: shrink the dtypes of every ingested table, see compact_dataframe
+COMPACT_DTYPES = os.environ.get("COMPACT_DTYPES", "on")
+# Text columns with at most this share of distinct values become categoricals, the others Arrow-backed strings
+CATEGORY_MAX_UNIQUE_RATIO = float(os.environ.get("CATEGORY_MAX_UNIQUE_RATIO", "0.5"))
+
+# Data files from this size on are aggregated chunk by chunk instead of being read as a whole, 0 turns this off.
+# Parquet and Arrow files hold several times their size in memory once read.
+STREAMING_AGGREGATION_MIN_BYTES = int(os.environ.get("STREAMING_AGGREGATION_MIN_BYTES", str(16 * 1024 * 1024)))
+# Rows per Parquet chunk, CSV is read in blocks of CSV_BLOCK_BYTES and Arrow streams in the batches they were sent in
+STREAMING_CHUNK_ROWS = int(os.environ.get("STREAMING_CHUNK_ROWS", "250000"))
+# The CSV reader keeps several blocks ahead of the one being parsed, so blocks are kept small
+CSV_BLOCK_BYTES = 2 * 1024 * 1024
+# The charts of a streamed file are decided on this many of its first rows and STREAMING_TAIL_ROWS of its last ones
+STREAMING_SAMPLE_ROWS = int(os.environ.get("STREAMING_SAMPLE_ROWS", "1000"))
+STREAMING_TAIL_ROWS = 10
+# The last rows of a CSV file are parsed from this many bytes at its end
+CSV_TAIL_BYTES = 64 * 1024
+STREAMABLE_FORMATS = ("csv", "parquet", "arrow")
+
+INGESTED_BYTES = Counter("slideai_ingested_bytes_total", "In-memory size of ingested tables after compaction")
+COMPACTION_SAVED_BYTES = Counter("slideai_compaction_saved_bytes_total",
+                                 "Bytes saved by compacting the dtypes of ingested tables")
+
+CONTENT_TYPES = {
+    "application/json": "json",
+    "text/csv": "csv",
+    "application/csv": "csv",
+    "application/vnd.apache.parquet": "parquet",
+    "application/x-parquet": "parquet",
+    "application/vnd.apache.arrow.stream": "arrow",
+    "application/vnd.apache.arrow.file": "arrow",
+}
+
+FILE_EXTENSIONS = {
+    "json": "json",
+    "csv": "csv",
+    "parquet": "parquet",
+    "arrow": "arrows",
+}
+
+PARQUET_MAGIC = b"PAR1"
+ARROW_STREAM_CONTINUATION = b"\xff\xff\xff\xff"
+# Arrow IPC files wrap the stream in this magic and a footer that indexes the record batches
+ARROW_FILE_MAGIC = b"ARROW1"
+
+
+@dataclass
+class ChunkedTable:
+    """A data file too large to read as a whole, read again in chunks of the needed columns for every aggregation."""
+    path: str
+    data_format: str
+    # The first rows followed by the last ones, for the chart decisions
+    sample: pd.DataFrame
+    # False when the last rows could not be read, the sample then does not end with the file's last row
+    includes_last_rows: bool = True
+
+    def iter_chunks(self, columns: list[str], drop_last_row: bool = False,
+                    value_columns: tuple = ()) -> Iterator[pd.DataFrame]:
+        """Yields the columns chunk by chunk, drop_last_row leaves out the last row of the file, e.g. a sum row.
+
+        The sum row is only dropped when the sample, which it was detected on, ends with the file's last row.
+        """
+        drop_last_row = drop_last_row and self.includes_last_rows
+        column_types = None
+        if self.data_format == "csv":
+            # Types are inferred per file from its first block, a later decimal in a column of integers would fail
+            column_types = {column: pyarrow.float64() for column in value_columns
+                            if pd.api.types.is_numeric_dtype(self.sample[column])
+                            and not pd.api.types.is_bool_dtype(self.sample[column])}
+
+        # One batch is held back, the last row is only known once the file has been read to the end
+        previous = None
+        for batch in _iter_record_batches(self.path, self.data_format, list(dict.fromkeys(columns)), column_types):
+            if batch.num_rows == 0:
+                continue
+            if previous is not None:
+                yield self._to_pandas(previous, column_types)
+            previous = batch
+
+        if previous is not None:
+            yield self._to_pandas(previous.slice(0, previous.num_rows - 1) if drop_last_row else previous,
+                                  column_types)
+
+    def _to_pandas(self, batch, column_types: Optional[dict]) -> pd.DataFrame:
+        chunk = batch.to_pandas()
+        # Integer columns read as floats are integers again where the chunk holds whole numbers only, like in a
+        # table read as a whole
+        for column in column_types or ():
+            values = chunk[column]
+            if pd.api.types.is_integer_dtype(self.sample[column]) and values.notna().all() \
+                    and (values % 1 == 0).all():
+                chunk[column] = values.astype(np.int64)
+        return chunk
+
+
+def resolve_format(data_format: str = None, content_type: str = None, head: bytes = b"") -> str:
+    """Picks the data format from an explicit name, else the content type, else the first bytes of the data."""
+    if data_format:
+        data_format = data_format.strip().lower()
+        if data_format not in FILE_EXTENSIONS:
+            raise ValueError(f"Unsupported data format '{data_format}', expected one of {', '.join(FILE_EXTENSIONS)}")
+        return data_format
+
+    media_type = (content_type or "").split(";")[0].strip().lower()
+    if media_type in CONTENT_TYPES:
+        return CONTENT_TYPES[media_type]
+
+    if head.startswith(PARQUET_MAGIC):
+        return "parquet"
+    if head.startswith(ARROW_STREAM_CONTINUATION) or head.startswith(ARROW_FILE_MAGIC):
+        return "arrow"
+    if head.lstrip()[:1] in (b"{", b"["):
+        return "json"
+    return "csv"
+
+
+@profiling.profiled
+def read_dataframe(source, data_format: str) -> pd.DataFrame:
+    """Reads a DataFrame from a file path, bytes or file object, wrap str contents in a StringIO."""
+    if isinstance(source, bytes):
+        source = BytesIO(source)
+
+    match data_format:
+        case "json":
+            return pd.read_json(source)
+        case "csv":
+            return pd.read_csv(source, engine="pyarrow")
+        case "parquet":
+            return pd.read_parquet(source, engine="pyarrow")
+        case "arrow":
+            if isinstance(source, str):
+                source = pyarrow.memory_map(source)
+            with _open_arrow(source) as reader:
+                return reader.read_all().to_pandas()
+        case _:
+            raise ValueError(f"Unsupported data format '{data_format}'")
+
+
+@profiling.profiled
+def open_chunked_table(path: str, data_format: str) -> Optional[ChunkedTable]:
+    """Returns a ChunkedTable for CSV, Parquet and Arrow files of at least STREAMING_AGGREGATION_MIN_BYTES, else None."""
+    if (not STREAMING_AGGREGATION_MIN_BYTES or data_format not in STREAMABLE_FORMATS
+            or os.path.getsize(path) < STREAMING_AGGREGATION_MIN_BYTES):
+        return None
+
+    batches = []
+    sample_rows = 0
+    read_to_end = True
+    for batch in _iter_record_batches(path, data_format, None):
+        batches.append(batch)
+        sample_rows += batch.num_rows
+        if sample_rows >= STREAMING_SAMPLE_ROWS:
+            read_to_end = False
+            break
+    if not batches:
+        raise ValueError("The data file contains no rows")
+
+    head = pyarrow.Table.from_batches(batches)
+    if read_to_end:
+        return ChunkedTable(path, data_format, head.to_pandas())
+
+    head = head.slice(0, STREAMING_SAMPLE_ROWS)
+    # A sum row is only ever found at the end of the file, the decisions need to see it
+    try:
+        tail = _read_last_rows(path, data_format, head)
+        sample = pyarrow.concat_tables([head, tail], promote_options="permissive")
+    except pyarrow.ArrowException as e:
+        print(f"Error reading the last rows of {path}: {e}")
+        return ChunkedTable(path, data_format, head.to_pandas(), includes_last_rows=False)
+    return ChunkedTable(path, data_format, sample.to_pandas())
+
+
+def _read_last_rows(path: str, data_format: str, head: pyarrow.Table) -> pyarrow.Table:
+    # Rows also in the head are left out where the number of rows is known
+    match data_format:
+        case "csv":
+            return _read_csv_tail(path, head)
+        case "parquet":
+            with pyarrow.parquet.ParquetFile(path) as parquet_file:
+                metadata = parquet_file.metadata
+                rows = min(STREAMING_TAIL_ROWS, metadata.num_rows - head.num_rows)
+                # Only the last row groups holding these rows are read
+                row_groups = []
+                group_rows = 0
+                for index in reversed(range(metadata.num_row_groups)):
+                    if group_rows >= rows:
+                        break
+                    row_groups.insert(0, index)
+                    group_rows += metadata.row_group(index).num_rows
+                return _last_rows(parquet_file.iter_batches(batch_size=STREAMING_CHUNK_ROWS, row_groups=row_groups),
+                                  rows, head.schema)
+        case "arrow":
+            # The batches of the memory-mapped stream are not copied, skipping to the end is cheap
+            total_rows = 0
+            kept = deque()
+            for batch in _iter_record_batches(path, data_format, None):
+                if not batch.num_rows:
+                    continue
+                total_rows += batch.num_rows
+                kept.append(batch)
+                if len(kept) > 2:
+                    kept.popleft()
+            return _last_rows(kept, min(STREAMING_TAIL_ROWS, total_rows - head.num_rows), head.schema)
+        case _:
+            raise ValueError(f"Unsupported data format '{data_format}'")
+
+
+def _last_rows(batches, rows: int, schema: pyarrow.Schema) -> pyarrow.Table:
+    kept = deque()
+    kept_rows = 0
+    for batch in batches:
+        kept.append(batch)
+        kept_rows += batch.num_rows
+        while kept and kept_rows - kept[0].num_rows >= rows:
+            kept_rows -= kept.popleft().num_rows
+    table = pyarrow.Table.from_batches(kept, schema=kept[0].schema if kept else schema)
+    return table.slice(max(table.num_rows - max(rows, 0), 0))
+
+
+def _read_csv_tail(path: str, head: pyarrow.Table) -> pyarrow.Table:
+    with open(path, "rb") as csv_file:
+        csv_file.seek(max(os.path.getsize(path) - CSV_TAIL_BYTES, 0))
+        tail = csv_file.read()
+    # The first line is cut off, or it is the header
+    tail = tail[tail.find(b"\n") + 1:]
+
+    read_options = pyarrow.csv.ReadOptions(column_names=head.column_names, use_threads=False)
+    try:
+        table = pyarrow.csv.read_csv(BytesIO(tail), read_options=read_options,
+                                     convert_options=pyarrow.csv.ConvertOptions(column_types=head.schema))
+    except pyarrow.ArrowInvalid:
+        # The last rows hold values the head's types cannot, e.g. decimals in a column of integers
+        table = pyarrow.csv.read_csv(BytesIO(tail), read_options=read_options)
+    return table.slice(max(table.num_rows - STREAMING_TAIL_ROWS, 0))
+
+
+def _iter_record_batches(path: str, data_format: str, columns: Optional[list[str]], column_types: dict = None):
+    # Only the given columns are parsed, None reads all of them. column_types overrides the inferred CSV types.
+    match data_format:
+        case "csv":
+            # The threaded reader parses blocks ahead without a bound, which defeats reading in chunks
+            read_options = pyarrow.csv.ReadOptions(block_size=CSV_BLOCK_BYTES, use_threads=False)
+            convert_options = pyarrow.csv.ConvertOptions(include_columns=columns or [], column_types=column_types)
+            with pyarrow.csv.open_csv(path, read_options=read_options, convert_options=convert_options) as reader:
+                yield from reader
+        case "parquet":
+            with pyarrow.parquet.ParquetFile(path) as parquet_file:
+                yield from parquet_file.iter_batches(batch_size=STREAMING_CHUNK_ROWS, columns=columns)
+        case "arrow":
+            with _open_arrow(pyarrow.memory_map(path)) as reader:
+                for batch in _arrow_batches(reader):
+                    yield batch.select(columns) if columns is not None else batch
+        case _:
+            raise ValueError(f"Unsupported data format '{data_format}'")
+
+
+def _open_arrow(source):
+    # The same data format covers both IPC layouts, the first bytes tell them apart
+    magic = source.read(len(ARROW_FILE_MAGIC))
+    source.seek(0)
+    if magic == ARROW_FILE_MAGIC:
+        return pyarrow.ipc.open_file(source)
+    return pyarrow.ipc.open_stream(source)
+
+
+def _arrow_batches(reader) -> Iterator[pyarrow.RecordBatch]:
+    if isinstance(reader, pyarrow.ipc.RecordBatchFileReader):
+        for index in range(reader.num_record_batches):
+            yield reader.get_batch(index)
+    else:
+        yield from reader
+
+
+@profiling.profiled
+def compact_dataframe(df: pd.DataFrame) -> int:
+    """Shrinks the dtypes of df's columns in place and returns the bytes saved.
+
+    Integers are downcast, floats only when float32 holds the exact values, so charts show the same numbers.
+    Text columns become categoricals when few values repeat often, Arrow-backed strings otherwise.
+    """
+    if COMPACT_DTYPES != "on":
+        return 0
+
+    raw_bytes = 0
+    compacted_bytes = 0
+    for position, column in enumerate(df.columns):
+        values = df.iloc[:, position]
+        column_bytes = values.memory_usage(deep=True, index=False)
+        compacted = _compact_column(values)
+        compacted_column_bytes = compacted.memory_usage(deep=True, index=False) if compacted is not None else 0
+
+        raw_bytes += column_bytes
+        if compacted is not None and compacted_column_bytes < column_bytes:
+            # Positional assignment replaces the column without copying the rest of the frame
+            df.isetitem(position, compacted)
+            compacted_bytes += compacted_column_bytes
+        else:
+            compacted_bytes += column_bytes
+
+    INGESTED_BYTES.inc(compacted_bytes)
+    COMPACTION_SAVED_BYTES.inc(raw_bytes - compacted_bytes)
+    return raw_bytes - compacted_bytes
+
+
+def _compact_column(values: pd.Series):
+    dtype = values.dtype
+    if pd.api.types.is_bool_dtype(dtype) or isinstance(dtype, pd.CategoricalDtype):
+        return None
+    if pd.api.types.is_integer_dtype(dtype) and isinstance(dtype, np.dtype):
+        return pd.to_numeric(values, downcast="integer")
+    if pd.api.types.is_float_dtype(dtype) and dtype == np.float64:
+        narrowed = values.astype(np.float32)
+        # NaN never equals itself, missing values have to match separately
+        is_exact = ((narrowed == values) | (values.isna() & narrowed.isna())).all()
+        return narrowed if is_exact else None
+    if dtype == object and len(values) > 0 and pd.api.types.infer_dtype(values, skipna=True) == "string":
+        if values.nunique() <= len(values) * CATEGORY_MAX_UNIQUE_RATIO:
+            return values.astype("category")
+        return values.astype("string[pyarrow]")
+    return None
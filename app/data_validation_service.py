@@ -1,11 +1,14 @@
-from models import DataValidationResponse
+import pandas as pd
+
+from models import DataValidationResponse, MultiColumnDataStructure, TwoColumnDataStructure, LongFormatDataStructure, \
+    BubbleChartDataStructure
 
 
 def fun_validate(df) -> DataValidationResponse:
     is_valid = True
     validation_hints = []
 
-    df.columns = df.columns.astype(str)
+    df = df.rename(columns=str, copy=False)
     headers = df.columns.tolist()
 
     # Check for null or empty headers
@@ -58,3 +61,49 @@ def fun_validate(df) -> DataValidationResponse:
         is_valid=is_valid,
         validation_hints=validation_hints
     )
+
+
+def validate_data_selection(df, selection) -> list[str]:
+    """Checks an LLM data selection against the real columns, returns the problems found (empty if usable)."""
+    # Headers are compared as strings, the selection refers to them by name
+    columns = {str(column): column for column in df.columns}
+    problems = []
+
+    def check(name, numeric):
+        if name not in columns:
+            problems.append(f"Unknown column '{name}'")
+        elif numeric and not _is_numeric_column(df[columns[name]]):
+            problems.append(f"Column '{name}' is not numeric")
+
+    if isinstance(selection, MultiColumnDataStructure):
+        check(selection.category, numeric=False)
+        if not selection.series:
+            problems.append("No series selected")
+        for series in selection.series:
+            check(series, numeric=True)
+        if selection.category in selection.series:
+            problems.append(f"Column '{selection.category}' is both category and series")
+    elif isinstance(selection, TwoColumnDataStructure):
+        check(selection.category, numeric=False)
+        check(selection.value, numeric=True)
+    elif isinstance(selection, LongFormatDataStructure):
+        check(selection.index, numeric=False)
+        check(selection.columns, numeric=False)
+        check(selection.values, numeric=True)
+    elif isinstance(selection, BubbleChartDataStructure):
+        check(selection.labels_column, numeric=False)
+        check(selection.x_axis_column, numeric=True)
+        check(selection.y_axis_column, numeric=True)
+        check(selection.bubble_size_column, numeric=True)
+
+    return problems
+
+
+def _is_numeric_column(column) -> bool:
+    if pd.api.types.is_numeric_dtype(column):
+        return True
+    try:
+        pd.to_numeric(column)
+        return True
+    except (ValueError, TypeError):
+        return False
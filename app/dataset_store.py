@@ -0,0 +1,143 @@
+# Uploaded datasets, parsed and profiled once and then referenced by id.
+# Recently used datasets stay in memory, evicted ones are spilled to Parquet and loaded again on the next use.
+import json
+import os
+import threading
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional, Any
+
+import pandas as pd
+
+from models import DataValidationResponse
+
+MAX_CACHED_DATASET_BYTES = int(os.environ.get("DATASET_CACHE_BYTES", 200 * 1024 * 1024))
+MAX_SPILLED_DATASETS = int(os.environ.get("DATASET_SPILL_MAX", "100"))
+DATASET_SPILL_DIR = os.environ.get("DATASET_SPILL_DIR",
+                                   os.path.join(os.path.dirname(os.path.abspath(__file__)), "datasets"))
+
+
+@dataclass
+class Dataset:
+    dataset_id: str
+    dataframe: Any
+    header_cell_formats: dict
+    validation: DataValidationResponse
+    memory_bytes: int
+
+
+_datasets = OrderedDict()
+_cached_bytes = 0
+_lock = threading.Lock()
+
+
+def create_dataset(df, header_cell_formats: dict, validation: DataValidationResponse) -> Dataset:
+    """Stores a parsed and validated frame, its columns are turned into strings like the ones the LLM picks."""
+    df = df.rename(columns=str, copy=False)
+    dataset = Dataset(
+        dataset_id=uuid.uuid4().hex,
+        dataframe=df,
+        header_cell_formats=header_cell_formats,
+        validation=validation,
+        memory_bytes=int(df.memory_usage(deep=True).sum())
+    )
+    _cache(dataset)
+    return dataset
+
+
+def get_dataset(dataset_id: str) -> Optional[Dataset]:
+    """Returns the dataset from memory or from its spill file, None if it is unknown or expired."""
+    with _lock:
+        dataset = _datasets.get(dataset_id)
+        if dataset is not None:
+            _datasets.move_to_end(dataset_id)
+            return dataset
+
+    dataset = _load_spilled(dataset_id)
+    if dataset is not None:
+        _cache(dataset)
+    return dataset
+
+
+def _cache(dataset: Dataset):
+    global _cached_bytes
+    evicted = []
+
+    with _lock:
+        if dataset.dataset_id not in _datasets:
+            _cached_bytes += dataset.memory_bytes
+        _datasets[dataset.dataset_id] = dataset
+        _datasets.move_to_end(dataset.dataset_id)
+
+        # The newest dataset always stays, even when it alone is larger than the budget
+        while _cached_bytes > MAX_CACHED_DATASET_BYTES and len(_datasets) > 1:
+            _, evicted_dataset = _datasets.popitem(last=False)
+            _cached_bytes -= evicted_dataset.memory_bytes
+            evicted.append(evicted_dataset)
+
+    for evicted_dataset in evicted:
+        _spill(evicted_dataset)
+
+
+def _spill_paths(dataset_id: str) -> tuple[str, str]:
+    # Ids are generated hex strings, anything else never reaches the file system
+    if not dataset_id.isalnum():
+        raise KeyError(dataset_id)
+    base_path = os.path.join(DATASET_SPILL_DIR, dataset_id)
+    return f"{base_path}.parquet", f"{base_path}.json"
+
+
+def _spill(dataset: Dataset):
+    parquet_path, metadata_path = _spill_paths(dataset.dataset_id)
+    os.makedirs(DATASET_SPILL_DIR, exist_ok=True)
+
+    try:
+        dataset.dataframe.to_parquet(parquet_path, engine="pyarrow")
+        with open(metadata_path, "w") as metadata_file:
+            json.dump({
+                "header_cell_formats": dataset.header_cell_formats,
+                "validation": dataset.validation.model_dump(),
+                "memory_bytes": dataset.memory_bytes,
+            }, metadata_file)
+    except Exception as e:
+        # Mixed-type columns cannot be stored as Parquet, such datasets expire with the eviction
+        print(f"Could not spill dataset {dataset.dataset_id}: {e}")
+        for path in (parquet_path, metadata_path):
+            if os.path.exists(path):
+                os.remove(path)
+        return
+
+    _remove_oldest_spills()
+
+
+def _remove_oldest_spills():
+    spilled = sorted(
+        (entry for entry in os.scandir(DATASET_SPILL_DIR) if entry.name.endswith(".parquet")),
+        key=lambda entry: entry.stat().st_mtime
+    )
+    for entry in spilled[:max(len(spilled) - MAX_SPILLED_DATASETS, 0)]:
+        for path in _spill_paths(entry.name.removesuffix(".parquet")):
+            if os.path.exists(path):
+                os.remove(path)
+
+
+def _load_spilled(dataset_id: str) -> Optional[Dataset]:
+    try:
+        parquet_path, metadata_path = _spill_paths(dataset_id)
+        with open(metadata_path) as metadata_file:
+            metadata = json.load(metadata_file)
+        df = pd.read_parquet(parquet_path, engine="pyarrow")
+    except (KeyError, FileNotFoundError):
+        return None
+
+    # Touch the spill file so the retention keeps recently used datasets
+    os.utime(parquet_path)
+
+    return Dataset(
+        dataset_id=dataset_id,
+        dataframe=df,
+        header_cell_formats=metadata["header_cell_formats"],
+        validation=DataValidationResponse.model_validate(metadata["validation"]),
+        memory_bytes=metadata["memory_bytes"]
+    )
@@ -0,0 +1,58 @@
+# Keeps the LLM decisions and prepared data of recent presentations, so edits re-render without new LLM calls
+import os
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+import data_ingestion
+from models import DeckSource
+
+MAX_CACHED_DECKS = int(os.environ.get("DECISION_CACHE_PRESENTATIONS", "20"))
+# The input tables are kept with the decisions, the oldest decks are evicted once all of them take more than this
+MAX_CACHED_DECK_BYTES = int(os.environ.get("DECISION_CACHE_BYTES", 100 * 1024 * 1024))
+
+# {presentation name: (chart_core_message, sources, memory bytes)}
+_decks = OrderedDict()
+_cached_bytes = 0
+_lock = threading.Lock()
+
+
+def register_deck(presentation_name: str, chart_core_message: str, sources: list[DeckSource]):
+    global _cached_bytes
+    memory_bytes = _deck_bytes(sources)
+
+    with _lock:
+        previous = _decks.pop(presentation_name, None)
+        if previous is not None:
+            _cached_bytes -= previous[2]
+        _decks[presentation_name] = (chart_core_message, sources, memory_bytes)
+        _cached_bytes += memory_bytes
+
+        # The newest deck always stays, even when it alone is larger than the budget
+        while len(_decks) > 1 and (len(_decks) > MAX_CACHED_DECKS or _cached_bytes > MAX_CACHED_DECK_BYTES):
+            _, evicted = _decks.popitem(last=False)
+            _cached_bytes -= evicted[2]
+
+
+def get_deck(presentation_name: str) -> Optional[tuple[str, list[DeckSource]]]:
+    """Returns (chart_core_message, sources) or None if the presentation is unknown or evicted."""
+    with _lock:
+        deck = _decks.get(presentation_name)
+        if deck is None:
+            return None
+        _decks.move_to_end(presentation_name)
+        return deck[0], deck[1]
+
+
+def _deck_bytes(sources: list[DeckSource]) -> int:
+    # Frames shared by several sources, e.g. the sheets of one upload, are counted once. Streamed tables stay on disk,
+    # only their sample is in memory.
+    frames = {}
+    for source in sources:
+        frame = source.dataframe
+        if isinstance(frame, data_ingestion.ChunkedTable):
+            frame = frame.sample
+        frames[id(frame)] = frame
+        for slide_spec in source.slide_specs:
+            frames[id(slide_spec.dataframe)] = slide_spec.dataframe
+    return int(sum(frame.memory_usage(deep=True).sum() for frame in frames.values() if frame is not None))
@@ -0,0 +1,70 @@
+# Merges single-slide packages, rendered independently from the same template, into one presentation
+import re
+from io import BytesIO
+
+from pptx import Presentation
+from pptx.opc.constants import RELATIONSHIP_TYPE as RT
+from pptx.opc.packuri import PackURI
+from pptx.oxml.ns import qn
+
+RELATIONSHIP_NAMESPACE = qn("r:id")[:qn("r:id").index("}") + 1]
+PARTNAME_NUMBER = re.compile(r"\d+(?=\.\w+$)")
+
+
+def append_slide(presentation, package: bytes):
+    """Appends the last slide of the package, with its charts and their embedded workbooks, to the presentation.
+
+    The package must come from the presentation's template, layouts and masters are taken from the presentation.
+    """
+    source = Presentation(BytesIO(package))
+    source_slide = source.slides[-1]
+    layout_index = source.slide_layouts.index(source_slide.slide_layout)
+    slide = presentation.slides.add_slide(presentation.slide_layouts[layout_index])
+
+    used_partnames = {part.partname for part in presentation.part.package.iter_parts()}
+    relationship_ids = {}
+    for relationship_id, relationship in source_slide.part.rels.items():
+        if relationship.reltype == RT.SLIDE_LAYOUT:
+            continue
+        if relationship.is_external:
+            relationship_ids[relationship_id] = slide.part.relate_to(relationship.target_ref, relationship.reltype,
+                                                                     is_external=True)
+            continue
+        # Every single-slide package numbers its parts from 1, e.g. /ppt/charts/chart1.xml
+        _rename_parts(relationship.target_part, used_partnames)
+        relationship_ids[relationship_id] = slide.part.relate_to(relationship.target_part, relationship.reltype)
+
+    # The shapes created from the layout are replaced by the rendered ones, the first two children are the tree's
+    # own properties
+    shape_tree = slide.shapes._spTree
+    for element in list(shape_tree)[2:]:
+        shape_tree.remove(element)
+    for element in list(source_slide.shapes._spTree)[2:]:
+        shape_tree.append(element)
+
+    for element in shape_tree.iter():
+        for attribute, value in element.attrib.items():
+            if attribute.startswith(RELATIONSHIP_NAMESPACE) and value in relationship_ids:
+                element.set(attribute, relationship_ids[value])
+
+    return slide
+
+
+def _rename_parts(part, used_partnames: set, visited: set = None):
+    # Gives the part and the parts it relates to (e.g. a chart's embedded workbook) names not used in the target
+    visited = visited if visited is not None else set()
+    if id(part) in visited:
+        return
+    visited.add(id(part))
+
+    template = PARTNAME_NUMBER.sub("%d", part.partname, count=1)
+    if "%d" in template:
+        number = 1
+        while template % number in used_partnames:
+            number += 1
+        part.partname = PackURI(template % number)
+    used_partnames.add(part.partname)
+
+    for relationship in part.rels.values():
+        if not relationship.is_external:
+            _rename_parts(relationship.target_part, used_partnames, visited)
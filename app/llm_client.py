@@ -0,0 +1,165 @@
+# One async OpenAI client with a shared HTTP connection pool, running on the app's event loop.
+# Started and stopped by the FastAPI lifespan, worker threads hand their LLM calls to it instead of opening
+# connections of their own.
+import asyncio
+import os
+import time
+from concurrent.futures import Future
+from typing import Optional
+
+import httpx
+import openai
+from prometheus_client import Histogram, Gauge
+
+import admission
+import metrics
+
+LLM_POOL_MAX_CONNECTIONS = int(os.environ.get("LLM_POOL_MAX_CONNECTIONS", "20"))
+LLM_POOL_MAX_KEEPALIVE = int(os.environ.get("LLM_POOL_MAX_KEEPALIVE", "10"))
+LLM_POOL_KEEPALIVE_EXPIRY_SECONDS = float(os.environ.get("LLM_POOL_KEEPALIVE_EXPIRY", "60"))
+LLM_WARMUP_CONNECTIONS = int(os.environ.get("LLM_WARMUP_CONNECTIONS", "2"))
+# on: negotiate HTTP/2 when the h2 package is installed, several calls then share one connection
+LLM_HTTP2 = os.environ.get("LLM_HTTP2", "on")
+# Longest a worker thread waits for a call that has neither a timeout nor a request deadline
+LLM_CALL_MAX_WAIT_SECONDS = float(os.environ.get("LLM_CALL_MAX_WAIT", "120"))
+
+POOL_WAIT = Histogram(
+    "slideai_llm_pool_wait_seconds",
+    "Time an LLM request waited for a pooled connection, including connecting when none was idle",
+    buckets=metrics.STAGE_BUCKETS
+)
+POOL_REQUESTS_IN_FLIGHT = Gauge("slideai_llm_pool_requests_in_flight", "LLM HTTP requests currently running")
+POOL_CONNECTIONS = Gauge("slideai_llm_pool_connections", "Open connections of the LLM pool")
+POOL_IDLE_CONNECTIONS = Gauge("slideai_llm_pool_idle_connections", "Idle keep-alive connections of the LLM pool")
+
+_http_client: Optional[httpx.AsyncClient] = None
+_async_client = None
+_loop: Optional[asyncio.AbstractEventLoop] = None
+
+
+def _http2_available() -> bool:
+    if LLM_HTTP2 != "on":
+        return False
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+async def _attach_pool_trace(request: httpx.Request):
+    # httpcore reports when the request got a connection, the time until then is the pool wait
+    start = time.perf_counter()
+    waiting = True
+
+    async def trace(event_name: str, info: dict):
+        nonlocal waiting
+        if waiting and event_name.endswith(("send_request_headers.started", "connect_tcp.started")):
+            waiting = False
+            POOL_WAIT.observe(time.perf_counter() - start)
+
+    request.extensions["trace"] = trace
+
+
+def _pool():
+    # httpx does not expose its pool, the gauges are left alone if the private attribute moves
+    return getattr(getattr(_http_client, "_transport", None), "_pool", None)
+
+
+def _collect_pool_connections():
+    pool = _pool()
+    connections = getattr(pool, "connections", None)
+    if connections is None:
+        return
+    POOL_CONNECTIONS.set(len(connections))
+    POOL_IDLE_CONNECTIONS.set(sum(1 for connection in connections if connection.is_idle()))
+
+
+async def start():
+    """Creates the client on the running loop and opens LLM_WARMUP_CONNECTIONS connections ahead of traffic."""
+    global _http_client, _async_client, _loop
+
+    _http_client = httpx.AsyncClient(
+        limits=httpx.Limits(
+            max_connections=LLM_POOL_MAX_CONNECTIONS,
+            max_keepalive_connections=LLM_POOL_MAX_KEEPALIVE,
+            keepalive_expiry=LLM_POOL_KEEPALIVE_EXPIRY_SECONDS
+        ),
+        http2=_http2_available(),
+        timeout=httpx.Timeout(60, connect=5),
+        event_hooks={"request": [_attach_pool_trace]}
+    )
+    # Retries are done by openai_adapter.ResilientTransport
+    _async_client = openai.AsyncOpenAI(http_client=_http_client, max_retries=0)
+    _loop = asyncio.get_running_loop()
+
+    await _warm_up()
+
+
+async def _warm_up():
+    # Concurrent requests each open their own connection, TLS is then done before the first deck needs it
+    url = f"{str(_async_client.base_url).rstrip('/')}/models"
+    headers = {"Authorization": f"Bearer {_async_client.api_key}"}
+    results = await asyncio.gather(
+        *(_http_client.get(url, headers=headers) for _ in range(LLM_WARMUP_CONNECTIONS)),
+        return_exceptions=True
+    )
+    failures = [result for result in results if isinstance(result, Exception)]
+    if failures:
+        print(f"LLM connection warm-up failed: {failures[0]}")
+    _collect_pool_connections()
+
+
+async def stop():
+    global _http_client, _async_client, _loop
+    if _http_client is not None:
+        await _http_client.aclose()
+    _http_client = None
+    _async_client = None
+    _loop = None
+
+
+def is_running() -> bool:
+    return _loop is not None and _loop.is_running()
+
+
+def parse(model: str, messages: list, response_format, **kwargs):
+    """Runs the call on the app's event loop and blocks the calling worker thread until it is answered.
+
+    The wait ends with TimeoutError after the call's timeout, else the request's remaining deadline, and the call is
+    cancelled then.
+    """
+    wait_seconds = kwargs.get("timeout")
+    if wait_seconds is None:
+        wait_seconds = admission.remaining_deadline_seconds()
+    if wait_seconds is None:
+        wait_seconds = LLM_CALL_MAX_WAIT_SECONDS
+
+    future = submit(model, messages, response_format, **kwargs)
+    try:
+        return future.result(timeout=wait_seconds)
+    except TimeoutError:
+        future.cancel()
+        raise TimeoutError(f"LLM call took longer than {wait_seconds:.1f}s")
+
+
+def submit(model: str, messages: list, response_format, **kwargs) -> Future:
+    """Starts the call on the app's event loop and returns its future, no thread is held while it runs.
+
+    Cancelling the future cancels the call.
+    """
+
+    async def call():
+        POOL_REQUESTS_IN_FLIGHT.inc()
+        try:
+            return await _async_client.beta.chat.completions.parse(
+                model=model,
+                messages=messages,
+                response_format=response_format,
+                **kwargs
+            )
+        finally:
+            POOL_REQUESTS_IN_FLIGHT.dec()
+            _collect_pool_connections()
+
+    return asyncio.run_coroutine_threadsafe(call(), _loop)
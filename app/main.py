@@ -1,32 +1,130 @@
+import asyncio
 import os
+import shutil
+import time
 import uuid
-from io import BytesIO, StringIO
+from contextlib import asynccontextmanager
+from io import StringIO
 
 import pandas as pd
 import uvicorn
-from fastapi import FastAPI, UploadFile, HTTPException, Form, BackgroundTasks
+from fastapi import FastAPI, UploadFile, HTTPException, Form, BackgroundTasks, Request
 from fastapi.middleware.cors import CORSMiddleware
 from google.oauth2.service_account import Credentials
 from googleapiclient.discovery import build
 from googleapiclient.http import MediaFileUpload
 from openpyxl.reader.excel import load_workbook
-from starlette.responses import FileResponse
-
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import Headers
+from starlette.responses import Response, JSONResponse
+
+import admission
+import artifact_store
+import data_ingestion
+import dataset_store
+import llm_client
+import metrics
+import openai_adapter
 import ppt_service
+import preview_service
+import profiling
+import tracing
 import aiofiles
 
 from data_validation_service import fun_validate
-from models import DataValidationRequest, PowerpointCreationResponse
+from models import DataValidationRequest, PowerpointCreationResponse, RerenderRequest, DatasetResponse, \
+    ChartSpecRequest, ChartDecisionResponse
 
-app = FastAPI()
 
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"]
-)
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Replayed answers need no connections
+    if openai_adapter.LLM_TRANSPORT != "replay":
+        await llm_client.start()
+    tracing.start()
+    await run_in_threadpool(ppt_service.start_render_workers)
+    artifact_sweeper = asyncio.create_task(artifact_store.sweep_periodically())
+    yield
+    artifact_sweeper.cancel()
+    await llm_client.stop()
+    ppt_service.stop_render_workers()
+    # Sends the events still queued before the process exits
+    await run_in_threadpool(tracing.stop)
+
+
+app = FastAPI(lifespan=lifespan)
+
+
+class UploadSizeLimit:
+    """Answers 413 for bodies over the upload limit. A too large Content-Length is rejected before the body is
+    received. Bodies without one, e.g. chunked uploads, are stopped as soon as more bytes arrived than allowed, before
+    the multipart parser has spooled them."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "POST" or scope["path"] not in UPLOAD_PATHS:
+            await self.app(scope, receive, send)
+            return
+
+        limit = MAX_UPLOAD_BYTES + MAX_FORM_OVERHEAD_BYTES
+        content_length = Headers(scope=scope).get("content-length")
+        if content_length and content_length.isdigit() and int(content_length) > limit:
+            response = JSONResponse(status_code=413, content={"detail": f"Upload exceeds {MAX_UPLOAD_BYTES} bytes"})
+            await response(scope, receive, send)
+            return
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    # FastAPI passes HTTPExceptions raised while the body is read on unchanged
+                    raise HTTPException(status_code=413, detail=f"Upload exceeds {MAX_UPLOAD_BYTES} bytes")
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+
+# Added first, which makes it the innermost middleware. The HTTPException raised while the body is read then reaches
+# FastAPI's exception handlers, the other middlewares read the body in tasks of their own.
+app.add_middleware(UploadSizeLimit)
+
+
+@app.middleware("http")
+async def record_stage_timings(request: Request, call_next):
+    trace_id = metrics.start_request(request.headers.get(metrics.TRACE_ID_HEADER))
+    profile = profiling.start(request.method, request.url.path, request.headers)
+    start = time.perf_counter()
+
+    try:
+        response = await call_next(request)
+    finally:
+        profile_path = await run_in_threadpool(profiling.stop, profile) if profile is not None else None
+
+    route = request.scope.get("route")
+    route_path = route.path if route else "unmatched"
+    metrics.REQUEST_DURATION.labels(
+        method=request.method,
+        route=route_path,
+        status=response.status_code
+    ).observe(time.perf_counter() - start)
+
+    peak_rss = metrics.sample_rss()
+    metrics.REQUEST_PEAK_RSS.labels(route=route_path).observe(peak_rss)
+
+    stage_timings = metrics.get_stage_timings()
+    if stage_timings:
+        response.headers["Server-Timing"] = metrics.server_timing_header(stage_timings, peak_rss)
+    response.headers[metrics.TRACE_ID_HEADER] = trace_id
+    if profile_path is not None:
+        response.headers[profiling.PROFILE_URL_HEADER] = \
+            f"/powerpoint/{os.path.basename(profile_path).removesuffix(profiling.PROFILE_SUFFIX)}/profile"
+    return response
 
 current_dir = os.path.dirname(os.path.abspath(__file__))
 
@@ -34,29 +132,72 @@ SERVICE_ACCOUNT_FILE = os.path.join(current_dir, "google-drive-api-key.json")
 
 SCOPES = ['https://www.googleapis.com/auth/drive.file']
 
-credentials = Credentials.from_service_account_file(SERVICE_ACCOUNT_FILE, scopes=SCOPES)
-drive_service = build('drive', 'v3', credentials=credentials)
+MAX_UPLOAD_BYTES = int(os.environ.get("MAX_UPLOAD_BYTES", 25 * 1024 * 1024))
+UPLOAD_CHUNK_BYTES = 1024 * 1024
+# Room for the other form fields and multipart boundaries on top of the file itself
+MAX_FORM_OVERHEAD_BYTES = 1024 * 1024
+# Endpoints taking data in their body
+UPLOAD_PATHS = {"/powerpoint", "/datasets", "/chart-decisions", "/powerpoint/from-spec", "/validate-data"}
+
+# drive: archive artifacts in Google Drive, local: copy them to LOCAL_STORAGE_DIR (for load tests and development)
+ARTIFACT_STORAGE = os.environ.get("ARTIFACT_STORAGE", "drive")
+LOCAL_STORAGE_DIR = os.environ.get("LOCAL_STORAGE_DIR", os.path.join(current_dir, "local_storage"))
+
+if ARTIFACT_STORAGE == "drive":
+    credentials = Credentials.from_service_account_file(SERVICE_ACCOUNT_FILE, scopes=SCOPES)
+    drive_service = build('drive', 'v3', credentials=credentials)
 
 
 def upload_to_google_drive(file_path: str, mime_type: str, file_name: str):
     """Uploads a file to Google Drive."""
+    if ARTIFACT_STORAGE == "local":
+        os.makedirs(LOCAL_STORAGE_DIR, exist_ok=True)
+        with metrics.stage("drive_upload"):
+            shutil.copyfile(file_path, os.path.join(LOCAL_STORAGE_DIR, os.path.basename(file_name)))
+        return file_name
+
     file_metadata = {'name': file_name}
     media = MediaFileUpload(file_path, mimetype=mime_type)
-    file = drive_service.files().create(body=file_metadata, media_body=media, fields='id').execute()
+    with metrics.stage("drive_upload"):
+        file = drive_service.files().create(body=file_metadata, media_body=media, fields='id').execute()
     return file.get('id')
 
 
+# Added after the other middlewares, which makes it the outermost one, so every response carries the CORS headers.
+# Browsers report responses without them, e.g. a 413 from above, as a CORS error.
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=["*"],
+    allow_credentials=True,
+    allow_methods=["*"],
+    allow_headers=["*"],
+    expose_headers=["Server-Timing", metrics.TRACE_ID_HEADER, profiling.PROFILE_URL_HEADER]
+)
+
+
+@app.exception_handler(admission.OverloadedError)
+async def handle_overloaded(request: Request, exception: admission.OverloadedError):
+    return JSONResponse(
+        status_code=429,
+        content={"detail": str(exception)},
+        headers={"Retry-After": str(exception.retry_after_seconds)}
+    )
+
+
 @app.get("/example-excel")
-async def get_example_excel():
+async def get_example_excel(request: Request):
     excel_path = os.path.join(current_dir, "example_excel.xlsx")
 
     try:
-        return FileResponse(
-            path=excel_path,
+        # Not immutable, the example can change with a deployment
+        return await artifact_store.file_response(
+            request,
+            excel_path,
             media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-            filename="example_excel.xlsx"
+            filename="example_excel.xlsx",
+            cache_control="public, max-age=86400"
         )
-    except Exception as e:
+    except FileNotFoundError:
         raise HTTPException(status_code=404, detail="Example Excel file not found")
 
 
@@ -65,13 +206,42 @@ def read_root():
     return {"status": "ok"}
 
 
+@app.get("/metrics")
+def get_metrics():
+    content, media_type = metrics.export_metrics()
+    return Response(content=content, media_type=media_type)
+
+
 @app.post("/validate-data")
 async def validate_data(
-        request: DataValidationRequest,
+        request: Request,
 ):
+    """Validates JSON ({"data": ..., "data_format": ...} or {"dataset_id": ...}) or a raw CSV, Parquet or
+    Arrow IPC stream body."""
+    try:
+        content_type = request.headers.get("content-type", "")
+        body = await request.body()
+
+        if content_type.split(";")[0].strip().lower() == "application/json":
+            validation_request = DataValidationRequest.model_validate_json(body)
+            if validation_request.dataset_id:
+                # Validated once on upload
+                return (await _get_dataset(validation_request.dataset_id)).validation
+            if validation_request.data is None:
+                raise ValueError("Either 'data' or 'dataset_id' must be provided.")
+            data = StringIO(validation_request.data)
+            data_format = data_ingestion.resolve_format(validation_request.data_format)
+        else:
+            data = body
+            data_format = data_ingestion.resolve_format(content_type=content_type, head=body[:8])
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
     try:
-        df = pd.read_json(request.data)
-        validation_response = fun_validate(df)
+        with metrics.stage(f"read_{data_format}"):
+            df = await run_in_threadpool(data_ingestion.read_dataframe, data, data_format)
+        with metrics.stage("validate"):
+            validation_response = await run_in_threadpool(fun_validate, df)
 
         return validation_response
 
@@ -80,101 +250,481 @@ async def validate_data(
         raise HTTPException(status_code=500, detail=f"An error occurred while processing the file: {str(e)}")
 
 
+@app.post("/datasets")
+async def create_dataset(
+        file: UploadFile = None,
+        data: str = Form(None),
+        data_format: str = Form(None),
+        data_file: UploadFile = None
+) -> DatasetResponse:
+    """Uploads, parses and validates data once, the returned dataset_id can be passed to /validate-data and
+    /powerpoint instead of the data. Takes the same inputs as /powerpoint, workbooks are read from the first sheet."""
+    data_format = await _resolve_data_format(file, data, data_file, data_format)
+
+    try:
+        uuid_string = str(uuid.uuid4())
+        df, header_cell_formats = await _read_input(file, data, data_file, data_format, uuid_string)
+
+        with metrics.stage("validate"):
+            validation_response = await run_in_threadpool(fun_validate, df)
+        # Measures the frame and may spill other datasets to disk
+        dataset = await run_in_threadpool(dataset_store.create_dataset, df, header_cell_formats, validation_response)
+        return _dataset_response(dataset)
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(str(e))
+        raise HTTPException(status_code=500, detail=f"An error occurred while processing the file: {str(e)}")
+    finally:
+        if file:
+            await file.close()
+        if data_file:
+            await data_file.close()
+
+
+@app.get("/datasets/{dataset_id}")
+async def get_dataset(dataset_id: str) -> DatasetResponse:
+    return _dataset_response(await _get_dataset(dataset_id))
+
+
+async def _get_dataset(dataset_id: str):
+    # Spilled datasets are read back from disk, off the event loop
+    with metrics.stage("dataset_load"):
+        dataset = await run_in_threadpool(dataset_store.get_dataset, dataset_id)
+    if dataset is None:
+        raise HTTPException(status_code=404, detail=f"Dataset '{dataset_id}' not found or expired")
+    return dataset
+
+
+def _dataset_response(dataset) -> DatasetResponse:
+    return DatasetResponse(
+        dataset_id=dataset.dataset_id,
+        row_count=len(dataset.dataframe),
+        columns=dataset.dataframe.columns.tolist(),
+        memory_bytes=dataset.memory_bytes,
+        validation=dataset.validation
+    )
+
+
 @app.post("/powerpoint")
 async def convert_excel_to_pptx(
         file: UploadFile = None,
         data: str = Form(None),
-        chart_core_message: str = Form(...)
+        chart_core_message: str = Form(...),
+        sheets: str = Form(None),
+        data_format: str = Form(None),
+        data_file: UploadFile = None,
+        dataset_id: str = Form(None)
 ) -> PowerpointCreationResponse:
-    if not file and not data:
-        raise HTTPException(status_code=400, detail="Either 'file' or 'data' must be provided.")
+    """Creates a deck from an Excel upload, JSON or CSV data, a data file (JSON, CSV, Parquet or Arrow IPC) or an
+    uploaded dataset.
+
+    By default only the first sheet of a workbook is used. Pass sheets="all" or a comma separated list of sheet
+    names to chart several sheets into one deck.
+
+    The format of data_file is taken from data_format, its content type or its first bytes. The data field
+    is JSON unless data_format says csv.
+    """
+    if dataset_id:
+        dataset = await _get_dataset(dataset_id)
+        admission.start_deadline()
+        return await _create_chart(dataset.dataframe, dataset.header_cell_formats, chart_core_message,
+                                   str(uuid.uuid4()))
+
+    data_format = await _resolve_data_format(file, data, data_file, data_format)
+
+    admission.start_deadline()
 
     try:
         uuid_string = str(uuid.uuid4())
 
+        if file and sheets:
+            excel_file_path = f"{uuid_string}_{os.path.basename(file.filename or 'upload')}.xlsx"
+            with metrics.stage("upload_read"):
+                await _spool_upload(file, excel_file_path)
+            return await _convert_sheets_to_pptx(excel_file_path, sheets, chart_core_message, uuid_string)
+
+        df, header_cell_formats = await _read_input(file, data, data_file, data_format, uuid_string,
+                                                    allow_streaming=True)
+        return await _create_chart(df, header_cell_formats, chart_core_message, uuid_string)
+
+    except (admission.OverloadedError, HTTPException):
+        raise
+    except Exception as e:
+        print(str(e))
+        raise HTTPException(status_code=500, detail=f"An error occurred while processing the file: {str(e)}")
+    finally:
         if file:
-            content = await file.read()
-            excel_bytes_content = BytesIO(content)
-            excel_file_path = f"{uuid_string}_{file.filename}.xlsx"
-            async with aiofiles.open(excel_file_path, "wb") as output_file:
-                await output_file.write(content)
-            # background_tasks.add_task(save_excel, excel_file_path)
-            df = pd.read_excel(excel_bytes_content)
-            header_cell_formats = _extract_header_cell_formats(excel_bytes_content)
-        else:
-            json_file_path = f"{uuid_string}.json"
-            with open(json_file_path, "w") as json_file:
-                json_file.write(data)
+            await file.close()
+        if data_file:
+            await data_file.close()
 
-            df = pd.read_json(StringIO(data))
-            header_cell_formats = {}
 
-        return ppt_service.create_chart(
+async def _create_chart(df, header_cell_formats: dict, chart_core_message: str, uuid_string: str):
+    try:
+        # Runs in the thread pool so the event loop keeps serving other requests while this deck is built
+        return await run_in_threadpool(
+            ppt_service.create_chart,
             df=df,
             header_cell_formats=header_cell_formats,
             chart_core_message=chart_core_message,
             uuid=uuid_string
         )
+    except admission.OverloadedError:
+        raise
+    except Exception as e:
+        print(str(e))
+        raise HTTPException(status_code=500, detail=f"An error occurred while processing the file: {str(e)}")
+
+
+async def _resolve_data_format(file: UploadFile, data: str, data_file: UploadFile, data_format: str):
+    """Returns the format of data_file or data, None for Excel uploads."""
+    if not file and not data and not data_file:
+        raise HTTPException(status_code=400, detail="Either 'file', 'data' or 'data_file' must be provided.")
+
+    try:
+        if file:
+            return None
+        if data_file:
+            head = await data_file.read(8)
+            await data_file.seek(0)
+            return data_ingestion.resolve_format(data_format, data_file.content_type, head)
+
+        data_format = data_ingestion.resolve_format(data_format or "json")
+        if data_format not in ("json", "csv"):
+            raise ValueError(f"The data field only takes json or csv, send {data_format} as data_file")
+        return data_format
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+async def _read_input(file: UploadFile, data: str, data_file: UploadFile, data_format: str, uuid_string: str,
+                      allow_streaming: bool = False):
+    """Parses the first sheet of the workbook, the data file or the data field into (df, header_cell_formats).
+
+    With allow_streaming, large data files are returned as a ChunkedTable instead of a DataFrame.
+    """
+    if file:
+        excel_file_path = f"{uuid_string}_{os.path.basename(file.filename or 'upload')}.xlsx"
+        with metrics.stage("upload_read"):
+            await _spool_upload(file, excel_file_path)
+        # background_tasks.add_task(save_excel, excel_file_path)
+
+        # Both parsers read the spooled file directly, the upload is never held in memory as a whole
+        with metrics.stage("read_excel"):
+            df = await run_in_threadpool(profiling.profiled(pd.read_excel), excel_file_path)
+        with metrics.stage("extract_header_cell_formats"):
+            header_cell_formats = await run_in_threadpool(_extract_header_cell_formats, excel_file_path)
+        await _compact(df)
+        return df, header_cell_formats
+
+    if data_file:
+        data_file_path = f"{uuid_string}_data.{data_ingestion.FILE_EXTENSIONS[data_format]}"
+        with metrics.stage("upload_read"):
+            await _spool_upload(data_file, data_file_path)
+
+        if allow_streaming:
+            with metrics.stage(f"read_{data_format}_sample"):
+                table = await run_in_threadpool(data_ingestion.open_chunked_table, data_file_path, data_format)
+            if table is not None:
+                await _compact(table.sample)
+                return table, {}
+
+        with metrics.stage(f"read_{data_format}"):
+            df = await run_in_threadpool(data_ingestion.read_dataframe, data_file_path, data_format)
+        await _compact(df)
+        return df, {}
+
+    data_file_path = f"{uuid_string}.{data_ingestion.FILE_EXTENSIONS[data_format]}"
+    with open(data_file_path, "w") as json_file:
+        json_file.write(data)
+
+    with metrics.stage(f"read_{data_format}"):
+        df = await run_in_threadpool(data_ingestion.read_dataframe, StringIO(data), data_format)
+    await _compact(df)
+    return df, {}
+
+
+async def _compact(df: pd.DataFrame):
+    with metrics.stage("compact"):
+        await run_in_threadpool(data_ingestion.compact_dataframe, df)
+
+
+@app.post("/powerpoint/{filename}/rerender")
+async def rerender_pptx(filename: str, overrides: RerenderRequest) -> PowerpointCreationResponse:
+    """Creates a new deck from the cached decisions of an earlier one, with a new title, chart types or sum row.
+
+    No LLM calls are made. Returns 404 once the earlier presentation has been evicted from the cache.
+    """
+    admission.start_deadline()
+
+    try:
+        return await run_in_threadpool(
+            ppt_service.rerender_chart,
+            presentation_name=filename,
+            overrides=overrides,
+            uuid=str(uuid.uuid4())
+        )
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=str(e.args[0]))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except admission.OverloadedError:
+        raise
+    except Exception as e:
+        print(str(e))
+        raise HTTPException(status_code=500, detail=f"An error occurred while rendering the presentation: {str(e)}")
+
+
+@app.post("/chart-decisions")
+async def decide_charts(
+        file: UploadFile = None,
+        data: str = Form(None),
+        chart_core_message: str = Form(...),
+        data_format: str = Form(None),
+        data_file: UploadFile = None,
+        dataset_id: str = Form(None)
+) -> ChartDecisionResponse:
+    """Returns the chart and data decisions of /powerpoint with the prepared data of every chart, for clients that
+    draw the charts themselves. Takes the same inputs as /powerpoint, workbooks are read from the first sheet."""
+    try:
+        if dataset_id:
+            df, header_cell_formats = await _read_request_data(None, dataset_id, None)
+        else:
+            data_format = await _resolve_data_format(file, data, data_file, data_format)
+            df, header_cell_formats = await _read_input(file, data, data_file, data_format, str(uuid.uuid4()),
+                                                        allow_streaming=True)
 
+        admission.start_deadline()
+        return await run_in_threadpool(
+            ppt_service.decide_chart_data,
+            df=df,
+            header_cell_formats=header_cell_formats,
+            chart_core_message=chart_core_message
+        )
+    except (admission.OverloadedError, HTTPException):
+        raise
     except Exception as e:
         print(str(e))
         raise HTTPException(status_code=500, detail=f"An error occurred while processing the file: {str(e)}")
     finally:
         if file:
             await file.close()
+        if data_file:
+            await data_file.close()
+
+
+@app.post("/powerpoint/from-spec")
+async def create_pptx_from_spec(spec: ChartSpecRequest) -> PowerpointCreationResponse:
+    """Creates a deck from chart types and data mappings chosen by the caller, without any LLM calls.
+
+    The data is given inline as JSON or CSV, or as a dataset_id from /datasets.
+    """
+    df, _ = await _read_request_data(spec.data, spec.dataset_id, spec.data_format)
+    admission.start_deadline()
+
+    try:
+        return await run_in_threadpool(
+            ppt_service.create_chart_from_spec,
+            df=df,
+            spec=spec,
+            uuid=str(uuid.uuid4())
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except admission.OverloadedError:
+        raise
+    except Exception as e:
+        print(str(e))
+        raise HTTPException(status_code=500, detail=f"An error occurred while rendering the presentation: {str(e)}")
+
+
+async def _read_request_data(data: str, dataset_id: str, data_format: str):
+    """Returns (df, header_cell_formats) of inline JSON or CSV data or of an uploaded dataset."""
+    if dataset_id:
+        dataset = await _get_dataset(dataset_id)
+        return dataset.dataframe, dataset.header_cell_formats
+    if data is None:
+        raise HTTPException(status_code=400, detail="Either 'data' or 'dataset_id' must be provided.")
+
+    try:
+        data_format = data_ingestion.resolve_format(data_format)
+        if data_format not in ("json", "csv"):
+            raise ValueError(f"Inline data must be json or csv, upload {data_format} as a dataset")
+        with metrics.stage(f"read_{data_format}"):
+            df = await run_in_threadpool(data_ingestion.read_dataframe, StringIO(data), data_format)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    await _compact(df)
+    return df, {}
+
+
+async def _convert_sheets_to_pptx(excel_file_path: str, sheets: str, chart_core_message: str, uuid_string: str):
+    with metrics.stage("extract_header_cell_formats"):
+        try:
+            header_cell_formats_by_sheet = await run_in_threadpool(
+                _extract_header_cell_formats_by_sheet, excel_file_path, sheets
+            )
+        except KeyError as e:
+            raise HTTPException(status_code=400, detail=str(e.args[0]))
+
+    with metrics.stage("read_excel"):
+        dataframes = await run_in_threadpool(
+            profiling.profiled(pd.read_excel), excel_file_path, sheet_name=list(header_cell_formats_by_sheet)
+        )
+
+    sheet_inputs = {
+        sheet_name: (dataframes[sheet_name], header_cell_formats)
+        for sheet_name, header_cell_formats in header_cell_formats_by_sheet.items()
+        if not dataframes[sheet_name].empty
+    }
+    if not sheet_inputs:
+        raise HTTPException(status_code=400, detail="The selected sheets contain no data")
+    for df, _ in sheet_inputs.values():
+        await _compact(df)
+
+    return await run_in_threadpool(
+        ppt_service.create_multi_sheet_chart,
+        sheets=sheet_inputs,
+        chart_core_message=chart_core_message,
+        uuid=uuid_string
+    )
+
+
+async def _spool_upload(file: UploadFile, destination_path: str) -> int:
+    """Copies the upload to destination_path in fixed-size chunks and rejects it once it exceeds the limit.
+
+    Starlette has already spooled file parts over 1 MB to an unnamed temporary file, so these bytes are written twice.
+    """
+    partial_path = f"{destination_path}.part"
+    size = 0
+
+    try:
+        async with aiofiles.open(partial_path, "wb") as output_file:
+            while chunk := await file.read(UPLOAD_CHUNK_BYTES):
+                size += len(chunk)
+                if size > MAX_UPLOAD_BYTES:
+                    raise HTTPException(status_code=413, detail=f"Upload exceeds {MAX_UPLOAD_BYTES} bytes")
+                await output_file.write(chunk)
+
+        # The spool becomes the archived copy by renaming, not by writing it a second time
+        os.replace(partial_path, destination_path)
+    finally:
+        remove_file(partial_path)
+
+    return size
 
 
 @app.get("/powerpoint/{filename}")
 async def get_powerpoint(filename: str,
+                         request: Request,
                          background_tasks: BackgroundTasks = None,
                          ):
-    """Serves a PowerPoint file by filename."""
+    """Serves a PowerPoint file by filename, it is archived on the first download."""
+    ppt_file_path = f"{filename}.pptx"
     try:
-        ppt_file_path = f"{filename}.pptx"
-        background_tasks.add_task(save_ppt, ppt_file_path)
-
-        if not os.path.exists(ppt_file_path):
-            raise HTTPException(status_code=404, detail="PPT file not found")
-
-        return FileResponse(
-            path=ppt_file_path,
+        response = await artifact_store.file_response(
+            request,
+            ppt_file_path,
             media_type="application/vnd.openxmlformats-officedocument.presentationml.presentation",
             filename=ppt_file_path
         )
-    except Exception as e:
-        raise HTTPException(status_code=404, detail=f"PowerPoint file not found: {str(e)}")
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="PPT file not found")
+
+    if artifact_store.mark_archived(ppt_file_path):
+        background_tasks.add_task(save_ppt, ppt_file_path)
+    return response
 
 
 @app.get("/pdf/{filename}")
-async def get_pdf(filename: str,
-                  background_tasks: BackgroundTasks = None
-                  ):
-    """Serves a PowerPoint file by filename."""
+async def get_pdf(filename: str, request: Request):
+    """Serves the PDF version of a PowerPoint file by filename."""
+    pdf_path = f"{filename}.pdf"
     try:
-        pdf_path = f"{filename}.pdf"
-        background_tasks.add_task(remove_file, pdf_path)
+        return await artifact_store.file_response(
+            request,
+            pdf_path,
+            media_type="application/pdf",
+            filename=pdf_path,
+            content_disposition_type="inline"
+        )
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="PDF file not found")
 
-        if not os.path.exists(pdf_path):
-            raise HTTPException(status_code=404, detail="PDF file not found")
 
-        return FileResponse(
-            path=pdf_path,
-            media_type="application/pdf",
-            headers={"Content-Disposition": "inline"},
-            filename=pdf_path
+@app.get("/powerpoint/{filename}/profile")
+async def get_profile(filename: str, request: Request):
+    """Serves the folded-stack profile of a presentation created by a profiled request, see profiling.py."""
+    profile_path = f"{filename}{profiling.PROFILE_SUFFIX}"
+    try:
+        return await artifact_store.file_response(
+            request,
+            profile_path,
+            media_type="text/plain",
+            filename=profile_path,
+            content_disposition_type="inline"
         )
-    except Exception as e:
-        raise HTTPException(status_code=404, detail=f"PDF file not found: {str(e)}")
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Profile not found")
+
+
+@app.get("/preview/{filename}/{slide_index}")
+def get_preview(filename: str, slide_index: int, format: str = "svg"):
+    """Serves an SVG or PNG preview of a single slide, rendered without LibreOffice."""
+    if format not in preview_service.PREVIEW_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unsupported preview format: {format}")
+
+    content = preview_service.get_preview(filename, slide_index, format)
+    if content is None:
+        raise HTTPException(status_code=404, detail="Preview not found")
 
+    return Response(
+        content=content,
+        media_type=preview_service.PREVIEW_FORMATS[format],
+        headers={"Cache-Control": "private, max-age=3600"}
+    )
+
+
+@profiling.profiled
+def _extract_header_cell_formats(excel_file):
+    # Read-only mode streams the sheet instead of building the whole workbook in memory
+    workbook = load_workbook(excel_file, read_only=True)
+    try:
+        return _read_header_cell_formats(workbook.active)
+    finally:
+        workbook.close()
 
-def _extract_header_cell_formats(excel_bytes_content):
-    workbook = load_workbook(excel_bytes_content)
-    sheet = workbook.active
+
+@profiling.profiled
+def _extract_header_cell_formats_by_sheet(excel_file, sheets: str) -> dict:
+    """Returns the header formats of the selected sheets, sheets is "all" or a comma separated list of names."""
+    workbook = load_workbook(excel_file, read_only=True)
+    try:
+        if sheets.strip().lower() == "all":
+            sheet_names = workbook.sheetnames
+        else:
+            sheet_names = [sheet_name.strip() for sheet_name in sheets.split(",") if sheet_name.strip()]
+            unknown_sheet_names = [sheet_name for sheet_name in sheet_names if sheet_name not in workbook.sheetnames]
+            if unknown_sheet_names:
+                raise KeyError(f"Unknown sheets: {', '.join(unknown_sheet_names)}")
+
+        return {sheet_name: _read_header_cell_formats(workbook[sheet_name]) for sheet_name in sheet_names}
+    finally:
+        workbook.close()
+
+
+def _read_header_cell_formats(sheet):
+    rows = list(sheet.iter_rows(min_row=1, max_row=2))
+
+    if len(rows) < 2:
+        return {}
 
     # Create a dictionary mapping headers to the raw number formats of the second row
     headers_cellformatting_dict = {}
-    for header_cell, data_cell in zip(sheet[1], sheet[2]):  # Row 1 for headers, Row 2 for formats
-        headers_cellformatting_dict[header_cell.value] = data_cell.number_format
+    for header_cell, data_cell in zip(rows[0], rows[1]):  # Row 1 for headers, Row 2 for formats
+        headers_cellformatting_dict[header_cell.value] = data_cell.number_format or "General"
 
     # Output the headers and their raw formats
     return headers_cellformatting_dict
@@ -198,11 +748,11 @@ def save_excel(file_path):
 
 
 def save_ppt(file_path):
+    # The file stays for later downloads, artifact_store removes it once the retention period is over
     upload_to_google_drive(file_path,
                            "application/vnd.openxmlformats-officedocument.presentationml.presentation",
                            file_path
                            )
-    remove_file(file_path)
 
 
 def remove_file(file_path):
@@ -0,0 +1,259 @@
+# Per-stage latency instrumentation exported to Prometheus and the Server-Timing response header
+import os
+import resource
+import sys
+import threading
+import time
+import tracemalloc
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional
+
+from prometheus_client import Histogram, Counter, Gauge, CONTENT_TYPE_LATEST, generate_latest
+
+import profiling
+
+STAGE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60)
+# Up to the 1 GB of the VM
+RSS_BUCKETS = tuple(megabytes * 1024 * 1024 for megabytes in (64, 128, 192, 256, 320, 384, 512, 640, 768, 896, 1024))
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+MEMORY_BUCKETS = tuple(megabytes * 1024 * 1024 for megabytes in (1, 4, 16, 32, 64, 128, 256, 384, 512, 768, 1024))
+
+# Memory accounting per stage. rss: resident memory of the process, sampled every STAGE_MEMORY_SAMPLE_INTERVAL
+# seconds, covers pyarrow and the native libraries. tracemalloc: exact Python and numpy allocations, but slows every
+# allocation down and misses pyarrow's own allocator. off: nothing is measured.
+STAGE_MEMORY = os.environ.get("STAGE_MEMORY", "off")
+STAGE_MEMORY_SAMPLE_INTERVAL_SECONDS = float(os.environ.get("STAGE_MEMORY_SAMPLE_INTERVAL", "0.005"))
+
+STAGE_DURATION = Histogram(
+    "slideai_stage_duration_seconds",
+    "Duration of a single pipeline stage",
+    ["stage"],
+    buckets=STAGE_BUCKETS
+)
+
+REQUEST_DURATION = Histogram(
+    "slideai_request_duration_seconds",
+    "Duration of a whole HTTP request",
+    ["method", "route", "status"],
+    buckets=STAGE_BUCKETS
+)
+
+# Resident memory of the whole process, concurrent requests and the render worker processes are not separated
+REQUEST_PEAK_RSS = Histogram(
+    "slideai_request_peak_rss_bytes",
+    "Highest resident memory of the process sampled at the stage boundaries of a request",
+    ["route"],
+    buckets=RSS_BUCKETS
+)
+
+# used: the answer was needed, discarded: finished but not needed, cancelled: not needed and never sent,
+# failed: the call failed and the regular call was made instead
+SPECULATIVE_CALLS = Counter(
+    "slideai_speculative_llm_calls_total",
+    "Data-selection LLM calls started before the chart selection answer was known",
+    ["response_model", "outcome"]
+)
+
+DEGRADED_DECISIONS = Counter(
+    "slideai_degraded_decisions_total",
+    "Tables whose charts were chosen by the local heuristic because the LLM circuit breaker was open"
+)
+
+# Both are process-wide, stages running at the same time see each other's allocations
+STAGE_PEAK_MEMORY = Histogram(
+    "slideai_stage_peak_memory_bytes",
+    "Highest memory use during a stage above the use at its start",
+    ["stage"],
+    buckets=MEMORY_BUCKETS
+)
+
+STAGE_NET_MEMORY = Gauge(
+    "slideai_stage_net_memory_bytes",
+    "Memory use at the end of the last run of a stage minus the use at its start",
+    ["stage"]
+)
+
+TRACE_ID_HEADER = "X-Trace-Id"
+
+_stage_timings: ContextVar[Optional[list]] = ContextVar("stage_timings", default=None)
+_trace_id: ContextVar[Optional[str]] = ContextVar("trace_id", default=None)
+# A list so worker threads running in a copy of the request's context update the same peak
+_peak_rss: ContextVar[Optional[list]] = ContextVar("peak_rss", default=None)
+_stage_memory: ContextVar[Optional[list]] = ContextVar("stage_memory", default=None)
+
+# {id: [memory at the start, highest memory seen]} of every running stage, the peak of the process is folded into all
+# of them before it is reset. Keyed by id, records of equal values are different stages.
+_memory_records = {}
+_memory_lock = threading.Lock()
+_sampled_rss_peak = 0
+_rss_sampler: Optional[threading.Thread] = None
+
+
+def start_request(trace_id: Optional[str] = None) -> str:
+    """Starts collecting stage timings for the current request and returns its trace id."""
+    trace_id = trace_id or uuid.uuid4().hex
+    _trace_id.set(trace_id)
+    _stage_timings.set([])
+    _peak_rss.set([current_rss_bytes()])
+    _stage_memory.set([])
+    return trace_id
+
+
+def get_trace_id() -> Optional[str]:
+    return _trace_id.get()
+
+
+def get_stage_timings() -> list[tuple[str, float]]:
+    return list(_stage_timings.get() or [])
+
+
+def current_rss_bytes() -> int:
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * PAGE_SIZE
+    except OSError:
+        # Without procfs only the peak of the whole process is known, in kilobytes on Linux and bytes on macOS
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return max_rss if sys.platform == "darwin" else max_rss * 1024
+
+
+def sample_rss() -> Optional[int]:
+    """Samples the resident memory and returns the highest value seen during the current request."""
+    peak_rss = _peak_rss.get()
+    if peak_rss is None:
+        return None
+    peak_rss[0] = max(peak_rss[0], current_rss_bytes())
+    return peak_rss[0]
+
+
+def get_stage_memory() -> list[tuple[str, int, int]]:
+    """Returns (stage, peak bytes, net bytes) of the current request's stages, empty unless STAGE_MEMORY is set."""
+    return list(_stage_memory.get() or [])
+
+
+@contextmanager
+def stage(name: str):
+    start = time.perf_counter()
+    sample_rss()
+    # Stages run in the threads doing the request's work, a profiled request samples them
+    profile = profiling.enter_thread()
+    memory_record = start_memory_record()
+    try:
+        yield
+    finally:
+        memory = finish_memory_record(memory_record)
+        if memory is not None:
+            record_stage_memory(name, *memory)
+        profiling.exit_thread(profile)
+        sample_rss()
+        record_stage(name, time.perf_counter() - start)
+
+
+def start_memory_record() -> Optional[list]:
+    """Starts measuring memory until finish_memory_record, returns None when STAGE_MEMORY is off."""
+    if STAGE_MEMORY == "off":
+        return None
+
+    with _memory_lock:
+        _fold_memory_peak()
+        current = _reset_memory_peak()
+        record = [current, current]
+        _memory_records[id(record)] = record
+    return record
+
+
+def finish_memory_record(record: Optional[list]) -> Optional[tuple[int, int]]:
+    """Returns (peak, net) bytes since start_memory_record."""
+    if record is None:
+        return None
+
+    with _memory_lock:
+        _fold_memory_peak()
+        del _memory_records[id(record)]
+        current = _current_memory()
+    return record[1] - record[0], current - record[0]
+
+
+def record_stage_memory(name: str, peak: int, net: int):
+    """Records the memory of a stage measured elsewhere, e.g. in a worker or a child process."""
+    STAGE_PEAK_MEMORY.labels(stage=name).observe(max(peak, 0))
+    STAGE_NET_MEMORY.labels(stage=name).set(net)
+
+    stage_memory = _stage_memory.get()
+    if stage_memory is not None:
+        stage_memory.append((name, peak, net))
+
+
+def _current_memory() -> int:
+    if STAGE_MEMORY == "tracemalloc":
+        return tracemalloc.get_traced_memory()[0]
+    return current_rss_bytes()
+
+
+def _fold_memory_peak():
+    if STAGE_MEMORY == "tracemalloc":
+        peak = tracemalloc.get_traced_memory()[1]
+    else:
+        peak = max(_sampled_rss_peak, current_rss_bytes())
+    for record in _memory_records.values():
+        record[1] = max(record[1], peak)
+
+
+def _reset_memory_peak() -> int:
+    # Returns the current memory, which the peak starts from again
+    global _sampled_rss_peak, _rss_sampler
+    if STAGE_MEMORY == "tracemalloc":
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+        return tracemalloc.get_traced_memory()[0]
+
+    if _rss_sampler is None:
+        _rss_sampler = threading.Thread(target=_sample_rss_peak, name="rss_sampler", daemon=True)
+        _rss_sampler.start()
+    _sampled_rss_peak = current_rss_bytes()
+    return _sampled_rss_peak
+
+
+def _sample_rss_peak():
+    # Catches peaks between the stage boundaries, e.g. inside pd.read_excel
+    global _sampled_rss_peak
+    while True:
+        time.sleep(STAGE_MEMORY_SAMPLE_INTERVAL_SECONDS)
+        if not _memory_records:
+            continue
+        rss = current_rss_bytes()
+        with _memory_lock:
+            _sampled_rss_peak = max(_sampled_rss_peak, rss)
+
+
+def record_stage(name: str, duration: float):
+    """Records a stage measured elsewhere, e.g. in a worker process."""
+    STAGE_DURATION.labels(stage=name).observe(duration)
+
+    stage_timings = _stage_timings.get()
+    if stage_timings is not None:
+        stage_timings.append((name, duration))
+
+
+def server_timing_header(stage_timings: list[tuple[str, float]], peak_rss: Optional[int] = None) -> str:
+    # Repeated stages (e.g. several LLM calls of the same kind) are reported once with their summed duration
+    durations = {}
+    counts = {}
+    for name, duration in stage_timings:
+        durations[name] = durations.get(name, 0) + duration
+        counts[name] = counts.get(name, 0) + 1
+
+    entries = [
+        f'{name};dur={duration * 1000:.1f}' + (f';desc="{counts[name]} calls"' if counts[name] > 1 else "")
+        for name, duration in durations.items()
+    ]
+    if peak_rss is not None:
+        entries.append(f'peak_rss;desc="{peak_rss / 1024 / 1024:.0f} MB"')
+    return ", ".join(entries)
+
+
+def export_metrics() -> tuple[bytes, str]:
+    return generate_latest(), CONTENT_TYPE_LATEST
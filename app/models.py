@@ -1,4 +1,5 @@
-from typing import List
+from dataclasses import dataclass
+from typing import List, Optional, Any, Union
 
 from pydantic import BaseModel
 
@@ -147,8 +148,44 @@ class LongFormatDataStructure(BaseModel):
     has_natural_sorting_order: bool
 
 
+class ChartDecisions(BaseModel):
+    # Everything the LLM decided for one table, the data structures are None when not selected or not answered
+    selected_chart_type: SelectedChartType
+    chart_types: List[str]
+    last_line_includes_sum: bool
+    multi_column_data: Optional[MultiColumnDataStructure] = None
+    long_format_data: Optional[LongFormatDataStructure] = None
+    two_column_data: Optional[TwoColumnDataStructure] = None
+    bubble_data: Optional[BubbleChartDataStructure] = None
+
+
+class RerenderRequest(BaseModel):
+    # Unset fields keep the value of the original presentation
+    chart_core_message: Optional[str] = None
+    chart_types: Optional[List[str]] = None
+    last_line_includes_sum: Optional[bool] = None
+
+
+class ChartSpecRequest(BaseModel):
+    # A deck whose chart types and data mappings the caller already knows, rendered without LLM calls.
+    # The data is sent inline (json or csv) or referenced by dataset_id.
+    data: Optional[str] = None
+    dataset_id: Optional[str] = None
+    data_format: str = "json"
+    chart_core_message: str
+    chart_types: List[str]
+    last_line_includes_sum: bool = False
+    multi_column_data: Optional[MultiColumnDataStructure] = None
+    long_format_data: Optional[LongFormatDataStructure] = None
+    two_column_data: Optional[TwoColumnDataStructure] = None
+    bubble_data: Optional[BubbleChartDataStructure] = None
+
+
 class DataValidationRequest(BaseModel):
-    data: str
+    data: Optional[str] = None
+    dataset_id: Optional[str] = None
+    # json or csv, binary formats are sent as the raw request body with their content type
+    data_format: str = "json"
 
 
 class DataValidationResponse(BaseModel):
@@ -156,6 +193,14 @@ class DataValidationResponse(BaseModel):
     validation_hints: list[str]
 
 
+class DatasetResponse(BaseModel):
+    dataset_id: str
+    row_count: int
+    columns: List[str]
+    memory_bytes: int
+    validation: DataValidationResponse
+
+
 class RoundingPrecision(BaseModel):
     order_of_magnitude: int
     decimal_place: int
@@ -163,3 +208,36 @@ class RoundingPrecision(BaseModel):
 
 class PowerpointCreationResponse(BaseModel):
     presentation_name: str
+    slide_count: int = 0
+
+
+class PreparedChart(BaseModel):
+    # One slide's chart as chart_factory would draw it, e.g. "clustered_bar", with the prepared data
+    chart_name: str
+    chart_information: Union[MultiColumnDataStructure, TwoColumnDataStructure, BubbleChartDataStructure]
+    rounding_precision: Optional[RoundingPrecision] = None
+    columns: List[str]
+    rows: List[List[Any]]
+
+
+class ChartDecisionResponse(BaseModel):
+    decisions: ChartDecisions
+    charts: List[PreparedChart]
+
+
+@dataclass
+class SlideSpec:
+    # Everything needed to draw one slide: which chart_factory creator, the prepared data and the AI decisions
+    chart_name: str
+    dataframe: Any
+    chart_information: Any
+    rounding_precision: Optional[RoundingPrecision] = None
+
+
+@dataclass
+class DeckSource:
+    # One input table of a deck (a DataFrame or a data_ingestion.ChunkedTable) with its LLM decisions and the slides
+    # prepared from it
+    dataframe: Any
+    decisions: ChartDecisions
+    slide_specs: List[SlideSpec]
@@ -1,24 +1,533 @@
-from typing import TypeVar
-from langfuse.openai import openai
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor, wait, FIRST_COMPLETED
+from datetime import datetime, timezone
+from typing import TypeVar, Callable, Optional
 
-client = openai.OpenAI()
+import openai
+from prometheus_client import Histogram, Counter, Gauge
+
+import admission
+import llm_client
+import metrics
+import tracing
+
+# live: call OpenAI, record: call OpenAI and save the answers to the cassette, replay: answer from the cassette only
+LLM_TRANSPORT = os.environ.get("LLM_TRANSPORT", "live")
+LLM_CASSETTE_PATH = os.environ.get("LLM_CASSETTE_PATH", "llm_cassette.jsonl")
+# Seconds per replayed call, or "recorded" to replay the latency measured while recording
+LLM_REPLAY_LATENCY = os.environ.get("LLM_REPLAY_LATENCY", "0")
+LLM_REPLAY_ERROR_RATE = float(os.environ.get("LLM_REPLAY_ERROR_RATE", "0"))
+LLM_REPLAY_SEED = int(os.environ.get("LLM_REPLAY_SEED", "0"))
+
+# large: every prompt goes to the large model, tiered: data-selection prompts try the small model first and
+# escalate to the large model when the answer does not fit the data
+LLM_ROUTING = os.environ.get("LLM_ROUTING", "tiered")
+SMALL_MODEL = "gpt-4o-mini"
+LARGE_MODEL = "gpt-4o"
+
+# USD per million prompt and completion tokens
+MODEL_PRICES = {
+    "gpt-4o": (2.50, 10.00),
+    "gpt-4o-mini": (0.15, 0.60),
+}
+
+LLM_CALL_DURATION = Histogram(
+    "slideai_llm_call_duration_seconds",
+    "Duration of a single LLM call",
+    ["model", "response_model"],
+    buckets=metrics.STAGE_BUCKETS
+)
+LLM_TOKENS = Counter("slideai_llm_tokens_total", "Tokens used by LLM calls", ["model", "kind"])
+LLM_COST = Counter("slideai_llm_cost_dollars_total", "Estimated cost of LLM calls in USD", ["model"])
+# small/accepted and small/escalated give the escalation rate, large/invalid counts answers no tier got right
+LLM_ROUTED_ANSWERS = Counter(
+    "slideai_llm_routed_answers_total",
+    "Answers of tiered LLM calls by tier and outcome",
+    ["response_model", "tier", "outcome"]
+)
+
+# on: wrap the transport with deadlines, retries, hedging and the circuit breaker, off: call it directly
+LLM_RESILIENCE = os.environ.get("LLM_RESILIENCE", "on")
+# Upper bound per call, the remaining request deadline lowers it further
+LLM_CALL_TIMEOUT_SECONDS = float(os.environ.get("LLM_CALL_TIMEOUT", "30"))
+LLM_MAX_RETRIES = int(os.environ.get("LLM_MAX_RETRIES", "2"))
+LLM_RETRY_BASE_SECONDS = float(os.environ.get("LLM_RETRY_BASE_SECONDS", "0.5"))
+LLM_RETRY_MAX_SECONDS = float(os.environ.get("LLM_RETRY_MAX_SECONDS", "4"))
+# A duplicate request is sent once a call takes longer than this percentile of recent calls of the same kind
+LLM_HEDGING = os.environ.get("LLM_HEDGING", "on")
+LLM_HEDGE_PERCENTILE = float(os.environ.get("LLM_HEDGE_PERCENTILE", "95"))
+LLM_HEDGE_MIN_SAMPLES = int(os.environ.get("LLM_HEDGE_MIN_SAMPLES", "20"))
+LLM_BREAKER_FAILURES = int(os.environ.get("LLM_BREAKER_FAILURES", "5"))
+LLM_BREAKER_COOLDOWN_SECONDS = float(os.environ.get("LLM_BREAKER_COOLDOWN", "30"))
+
+LLM_RETRIES = Counter("slideai_llm_retries_total", "LLM calls retried after a transient error", ["error"])
+LLM_HEDGES = Counter("slideai_llm_hedges_total", "Hedged duplicate LLM requests", ["outcome"])
+LLM_CIRCUIT_OPEN = Gauge("slideai_llm_circuit_open", "1 while the LLM circuit breaker is open")
+LLM_CIRCUIT_TRANSITIONS = Counter("slideai_llm_circuit_transitions_total", "LLM circuit breaker state changes",
+                                  ["state"])
+
+# Retries are done by ResilientTransport, the client must not retry on its own as well
+client = openai.OpenAI(max_retries=0 if LLM_RESILIENCE == "on" else 2) if LLM_TRANSPORT != "replay" else None
 
 T = TypeVar('T')
 
 
+class TransportError(Exception):
+    """Raised for failures of the LLM transport itself, as opposed to unusable answers."""
+
+
+class CassetteMissError(TransportError):
+    pass
+
+
+class CircuitOpenError(TransportError):
+    """Raised without calling upstream while the circuit breaker is open."""
+
+
+class DeadlineExceededError(TransportError):
+    """Raised when the request's own deadline runs out, which says nothing about the upstream's health."""
+
+
+def _is_transient(exception: Exception) -> bool:
+    if isinstance(exception, (openai.APITimeoutError, openai.APIConnectionError, openai.RateLimitError,
+                              openai.InternalServerError, TimeoutError)):
+        return True
+    # Plain transport errors are the replay transport's injected failures
+    return type(exception) is TransportError
+
+
+def _cassette_key(model: str, message: str, response_model) -> str:
+    return hashlib.sha256(f"{model}\n{response_model.__name__}\n{message}".encode("utf-8")).hexdigest()
+
+
+class LiveTransport:
+
+    def parse(self, model: str, message: str, response_model, trace_id: str = None, name: str = None, **kwargs):
+        # The shared async client runs once the app has started, scripts without the app use the sync client
+        parse = llm_client.parse if llm_client.is_running() else client.beta.chat.completions.parse
+        start_time = datetime.now(timezone.utc)
+        try:
+            completion = parse(
+                model=model,
+                messages=_messages(message),
+                temperature=0,
+                response_format=response_model,
+                **kwargs
+            )
+        except Exception as exception:
+            tracing.record_generation(trace_id, name, model, message, None, None, start_time, error=str(exception))
+            raise
+
+        return _finish_completion(completion, model, message, trace_id, name, start_time)
+
+    def submit(self, model: str, message: str, response_model, trace_id: str = None, name: str = None,
+               **kwargs) -> Optional[Future]:
+        """Starts the call on the shared async client and returns a future of the parsed answer, or None while the
+        client does not run. Cancelling the future cancels the call."""
+        if not llm_client.is_running():
+            return None
+
+        start_time = datetime.now(timezone.utc)
+        parsed_future = Future()
+        completion_future = llm_client.submit(
+            model=model,
+            messages=_messages(message),
+            temperature=0,
+            response_format=response_model,
+            **kwargs
+        )
+
+        def finish(done_future: Future):
+            # Runs on the event loop, recording is cheap: counters and a queued trace event
+            if parsed_future.cancelled():
+                return
+            if done_future.cancelled():
+                parsed_future.cancel()
+                return
+            exception = done_future.exception()
+            if exception is not None:
+                tracing.record_generation(trace_id, name, model, message, None, None, start_time,
+                                          error=str(exception))
+                parsed_future.set_exception(exception)
+                return
+            try:
+                parsed_future.set_result(
+                    _finish_completion(done_future.result(), model, message, trace_id, name, start_time))
+            except Exception as finish_exception:
+                parsed_future.set_exception(finish_exception)
+
+        parsed_future.add_done_callback(lambda future: future.cancelled() and completion_future.cancel())
+        completion_future.add_done_callback(finish)
+        return parsed_future
+
+
+def _messages(message: str) -> list:
+    return [
+        {
+            "role": "user",
+            "content": message
+        }
+    ]
+
+
+def _finish_completion(completion, model: str, message: str, trace_id: str, name: str, start_time: datetime):
+    usage = getattr(completion, "usage", None)
+    parsed = completion.choices[0].message.parsed
+    _record_usage(model, usage)
+    tracing.record_generation(trace_id, name, model, message, parsed, usage, start_time)
+    return parsed
+
+
+def _record_usage(model: str, usage):
+    if usage is None:
+        return
+
+    LLM_TOKENS.labels(model=model, kind="prompt").inc(usage.prompt_tokens)
+    LLM_TOKENS.labels(model=model, kind="completion").inc(usage.completion_tokens)
+    if model in MODEL_PRICES:
+        prompt_price, completion_price = MODEL_PRICES[model]
+        LLM_COST.labels(model=model).inc(
+            (usage.prompt_tokens * prompt_price + usage.completion_tokens * completion_price) / 1_000_000
+        )
+
+
+class RecordingTransport:
+
+    def __init__(self, cassette_path: str, transport=None):
+        self.cassette_path = cassette_path
+        self.transport = transport or LiveTransport()
+        self._lock = threading.Lock()
+
+    def parse(self, model: str, message: str, response_model, **kwargs):
+        start = time.perf_counter()
+        parsed = self.transport.parse(model, message, response_model, **kwargs)
+        latency_seconds = time.perf_counter() - start
+
+        entry = {
+            "key": _cassette_key(model, message, response_model),
+            "model": model,
+            "response_model": response_model.__name__,
+            "prompt": message,
+            "response": parsed.model_dump(mode="json"),
+            "latency_seconds": latency_seconds,
+        }
+        with self._lock:
+            with open(self.cassette_path, "a", encoding="utf-8") as cassette:
+                cassette.write(json.dumps(entry) + "\n")
+
+        return parsed
+
+
+class ReplayTransport:
+
+    def __init__(self, cassette_path: str, latency: str = "0", error_rate: float = 0, seed: int = 0):
+        self.entries = {}
+        with open(cassette_path, encoding="utf-8") as cassette:
+            for line in cassette:
+                if line.strip():
+                    entry = json.loads(line)
+                    self.entries[entry["key"]] = entry
+
+        self.latency = latency
+        self.error_rate = error_rate
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def parse(self, model: str, message: str, response_model, **kwargs):
+        entry = self.entries.get(_cassette_key(model, message, response_model))
+
+        if self.latency == "recorded":
+            latency_seconds = entry["latency_seconds"] if entry else 0
+        else:
+            latency_seconds = float(self.latency)
+        if latency_seconds > 0:
+            time.sleep(latency_seconds)
+
+        with self._lock:
+            inject_error = self._random.random() < self.error_rate
+        if inject_error:
+            raise TransportError("Injected replay error")
+
+        if entry is None:
+            raise CassetteMissError(f"No recorded {response_model.__name__} answer for this prompt")
+
+        return response_model.model_validate(entry["response"])
+
+
+class CircuitBreaker:
+    """Opens after consecutive transient failures, lets one probe call through after the cooldown."""
+
+    def __init__(self, failure_threshold: int, cooldown_seconds: float):
+        self.failure_threshold = failure_threshold
+        self.cooldown_seconds = cooldown_seconds
+        self._lock = threading.Lock()
+        self._consecutive_failures = 0
+        self._opened_at = None
+        self._probing = False
+        # The thread running the probe, only it may release the probe without a result
+        self._probe_thread = None
+
+    def is_open(self) -> bool:
+        with self._lock:
+            return self._opened_at is not None and (
+                    self._probing or time.monotonic() - self._opened_at < self.cooldown_seconds
+            )
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if self._probing or time.monotonic() - self._opened_at < self.cooldown_seconds:
+                return False
+            self._probing = True
+            self._probe_thread = threading.get_ident()
+            LLM_CIRCUIT_TRANSITIONS.labels(state="half_open").inc()
+            return True
+
+    def release_probe(self):
+        """Ends the current thread's probe if it recorded no result, e.g. when the request's deadline ran out, so the
+        next call probes again. The state stays as it is."""
+        with self._lock:
+            if self._probing and self._probe_thread == threading.get_ident():
+                self._probing = False
+                self._probe_thread = None
+
+    def record_success(self):
+        with self._lock:
+            if self._opened_at is not None:
+                LLM_CIRCUIT_TRANSITIONS.labels(state="closed").inc()
+                LLM_CIRCUIT_OPEN.set(0)
+            self._consecutive_failures = 0
+            self._opened_at = None
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self._consecutive_failures += 1
+            if self._probing or (self._opened_at is None and self._consecutive_failures >= self.failure_threshold):
+                if self._opened_at is None:
+                    LLM_CIRCUIT_OPEN.set(1)
+                LLM_CIRCUIT_TRANSITIONS.labels(state="open").inc()
+                self._opened_at = time.monotonic()
+                self._probing = False
+
+
+class LatencyTracker:
+    """Recent durations of successful calls per (model, response model), used for the hedging delay."""
+
+    def __init__(self, window: int = 200):
+        self._durations = {}
+        self._window = window
+        self._lock = threading.Lock()
+
+    def record(self, key: tuple, duration_seconds: float):
+        with self._lock:
+            self._durations.setdefault(key, deque(maxlen=self._window)).append(duration_seconds)
+
+    def percentile(self, key: tuple, percentile: float, min_samples: int) -> Optional[float]:
+        with self._lock:
+            durations = sorted(self._durations.get(key, ()))
+        if len(durations) < min_samples:
+            return None
+        return durations[min(int(len(durations) * percentile / 100), len(durations) - 1)]
+
+
+class ResilientTransport:
+    """Adds per-call deadlines, jittered retries, hedged requests and a circuit breaker to another transport."""
+
+    def __init__(self, transport, breaker: CircuitBreaker = None, max_workers: int = 16):
+        self.transport = transport
+        self.breaker = breaker or CircuitBreaker(LLM_BREAKER_FAILURES, LLM_BREAKER_COOLDOWN_SECONDS)
+        self.latencies = LatencyTracker()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="llm_call")
+
+    def parse(self, model: str, message: str, response_model, **kwargs):
+        if not self.breaker.allow():
+            raise CircuitOpenError("LLM circuit breaker is open")
+
+        try:
+            return self._parse_with_retries(model, message, response_model, kwargs)
+        finally:
+            # A probe that ended without a success or failure would keep the breaker open for good
+            self.breaker.release_probe()
+
+    def _parse_with_retries(self, model: str, message: str, response_model, kwargs: dict):
+        attempt = 0
+        while True:
+            timeout = self._call_timeout()
+            try:
+                parsed = self._hedged_call(model, message, response_model, timeout, kwargs)
+            except DeadlineExceededError:
+                raise
+            except Exception as exception:
+                if isinstance(exception, (openai.APITimeoutError, TimeoutError)) \
+                        and timeout < LLM_CALL_TIMEOUT_SECONDS:
+                    # Cut short by the request's deadline, not by a slow upstream, the breaker is left alone
+                    raise DeadlineExceededError("The request deadline ran out during the LLM call") from exception
+                if not _is_transient(exception):
+                    # The upstream answered, e.g. with a refusal or an invalid request
+                    self.breaker.record_success()
+                    raise
+
+                self.breaker.record_failure()
+                attempt += 1
+                # Full jitter: a random wait up to the exponential backoff spreads out retries of concurrent decks
+                backoff_seconds = random.uniform(0, min(LLM_RETRY_MAX_SECONDS, LLM_RETRY_BASE_SECONDS * 2 ** attempt))
+                if self.breaker.is_open():
+                    raise CircuitOpenError("LLM circuit breaker opened") from exception
+                if attempt > LLM_MAX_RETRIES or backoff_seconds >= self._call_timeout():
+                    raise
+
+                LLM_RETRIES.labels(error=type(exception).__name__).inc()
+                time.sleep(backoff_seconds)
+                continue
+
+            self.breaker.record_success()
+            return parsed
+
+    def _call_timeout(self) -> float:
+        remaining_seconds = admission.remaining_deadline_seconds()
+        if remaining_seconds is None:
+            return LLM_CALL_TIMEOUT_SECONDS
+        return min(LLM_CALL_TIMEOUT_SECONDS, remaining_seconds)
+
+    def _hedged_call(self, model: str, message: str, response_model, timeout: float, kwargs: dict):
+        if timeout <= 0:
+            raise DeadlineExceededError("No time left in the request deadline")
+
+        key = (model, response_model.__name__)
+        call_kwargs = {**kwargs, "timeout": timeout}
+        start = time.perf_counter()
+
+        def call() -> Future:
+            # The async client runs the call on the event loop, only the other transports need a thread of their own
+            submit = getattr(self.transport, "submit", None)
+            future = submit(model, message, response_model, **call_kwargs) if submit is not None else None
+            if future is None:
+                future = self._executor.submit(self.transport.parse, model, message, response_model, **call_kwargs)
+            return future
+
+        primary = call()
+        pending = {primary}
+
+        hedge_delay = self.latencies.percentile(key, LLM_HEDGE_PERCENTILE, LLM_HEDGE_MIN_SAMPLES) \
+            if LLM_HEDGING == "on" else None
+        if hedge_delay is not None and hedge_delay < timeout:
+            done, _ = wait(pending, timeout=hedge_delay)
+            if not done:
+                LLM_HEDGES.labels(outcome="sent").inc()
+                pending.add(call())
+
+        first_error = None
+        while pending:
+            done, pending = wait(pending, timeout=max(start + timeout - time.perf_counter(), 0),
+                                 return_when=FIRST_COMPLETED)
+            if not done:
+                for future in pending:
+                    future.cancel()
+                raise TimeoutError(f"LLM call took longer than {timeout:.1f}s")
+
+            for future in done:
+                try:
+                    parsed = future.result()
+                except Exception as exception:
+                    first_error = first_error or exception
+                    continue
+
+                if future is not primary:
+                    LLM_HEDGES.labels(outcome="won").inc()
+                # Only undisturbed primary calls describe the normal latency
+                if future is primary:
+                    self.latencies.record(key, time.perf_counter() - start)
+                # A slower duplicate still running is cancelled, which only stops calls on the event loop. Threads
+                # run their call to the end and the answer is dropped.
+                for duplicate in pending:
+                    duplicate.cancel()
+                return parsed
+
+        raise first_error
+
+
+def _create_transport():
+    match LLM_TRANSPORT:
+        case "live":
+            base_transport = LiveTransport()
+        case "record":
+            base_transport = RecordingTransport(LLM_CASSETTE_PATH)
+        case "replay":
+            base_transport = ReplayTransport(LLM_CASSETTE_PATH, LLM_REPLAY_LATENCY, LLM_REPLAY_ERROR_RATE,
+                                             LLM_REPLAY_SEED)
+        case _:
+            raise ValueError(f"Unknown LLM_TRANSPORT '{LLM_TRANSPORT}', expected live, record or replay")
+
+    return ResilientTransport(base_transport) if LLM_RESILIENCE == "on" else base_transport
+
+
+transport = _create_transport()
+
+
+def set_transport(new_transport):
+    global transport
+    transport = new_transport
+
+
+def circuit_is_open() -> bool:
+    return isinstance(transport, ResilientTransport) and transport.breaker.is_open()
+
+
 def _query_openai(message: str, response_model: T, small_model=False) -> T:
-    model = "gpt-4o-mini" if small_model else "gpt-4o"
-
-    completion = client.beta.chat.completions.parse(
-        model=model,
-        messages=[
-            {
-                "role": "user",
-                "content": message
-            }
-        ],
-        temperature=0,
-        response_format=response_model
-
-    )
-    return completion.choices[0].message.parsed
+    model = SMALL_MODEL if small_model else LARGE_MODEL
+
+    stage_name = f"llm_{response_model.__name__}"
+
+    with admission.limit("llm"), metrics.stage(stage_name):
+        start = time.perf_counter()
+        try:
+            return transport.parse(
+                model,
+                message,
+                response_model,
+                # Groups all LLM calls of one HTTP request under the request's trace, see tracing
+                trace_id=metrics.get_trace_id(),
+                name=stage_name
+            )
+        finally:
+            LLM_CALL_DURATION.labels(model=model, response_model=response_model.__name__).observe(
+                time.perf_counter() - start
+            )
+
+
+def query_tiered(message: str, response_model: T, validate: Callable[[T], list[str]]) -> T:
+    """Asks the small model first and the large model only if validate finds problems in the small model's answer.
+
+    validate returns a list of problems, an empty list accepts the answer. Failed small model calls escalate too.
+    """
+    name = response_model.__name__
+
+    if LLM_ROUTING == "tiered":
+        try:
+            answer = _query_openai(message, response_model, small_model=True)
+            problems = validate(answer)
+        except (admission.OverloadedError, CircuitOpenError):
+            raise
+        except Exception as exception:
+            problems = [str(exception)]
+
+        if not problems:
+            LLM_ROUTED_ANSWERS.labels(response_model=name, tier="small", outcome="accepted").inc()
+            return answer
+
+        LLM_ROUTED_ANSWERS.labels(response_model=name, tier="small", outcome="escalated").inc()
+        print(f"Escalating {name} to {LARGE_MODEL}: {'; '.join(problems)}")
+
+    answer = _query_openai(message, response_model)
+    # The large model's answer is used either way, the outcome only shows how often no tier was right
+    outcome = "invalid" if validate(answer) else "accepted"
+    LLM_ROUTED_ANSWERS.labels(response_model=name, tier="large", outcome=outcome).inc()
+    return answer
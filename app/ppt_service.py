@@ -1,33 +1,97 @@
+import contextvars
 import datetime
+import json
+import multiprocessing
 import os
 import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait
+from io import BytesIO
 from typing import Optional
 
 import numpy as np
+import pandas as pd
 from pptx import Presentation
 
 from chart_factory import create_clustered_column_chart, create_clustered_bar_chart, create_stacked_column_chart, \
     create_100_percent_stacked_column_chart, create_line_chart, create_column_chart, create_bar_chart, \
     create_pie_chart, create_doughnut_chart, create_bubble_chart, create_stacked_bar_chart
-from openai_adapter import _query_openai
+from openai_adapter import _query_openai, query_tiered, circuit_is_open, CircuitOpenError
+from data_validation_service import validate_data_selection
 from prompt_factory import create_two_column_category_chart_data_selection_prompt, \
     create_multicolumn_category_chart_data_selection_prompt, \
     create_long_format_multicolumn_category_chart_data_selection_prompt, create_chart_selection_prompt, \
     create_bubble_chart_data_selection_prompt
 from models import MultiColumnDataStructure, PowerpointCreationResponse, SelectedChartType, ChartType, \
     TwoColumnDataStructure, \
-    LongFormatDataStructure, BubbleChartDataStructure, RoundingPrecision
-
-MOCK_AI_API_CALLS = False
+    LongFormatDataStructure, BubbleChartDataStructure, RoundingPrecision, SlideSpec, ChartDecisions, DeckSource, \
+    RerenderRequest, ChartSpecRequest, ChartDecisionResponse, PreparedChart
+import admission
+import chart_heuristics
+import data_ingestion
+import deck_assembler
+import decision_cache
+import metrics
+import preview_service
+import profiling
 
 current_dir = os.path.dirname(os.path.abspath(__file__))
 
 TEMPLATE_PATH = os.path.join(current_dir, "template.pptx")
 
+MAX_PARALLEL_SHEETS = int(os.environ.get("MAX_PARALLEL_SHEETS", "4"))
+
+# off: ask for the data selection after the chart selection, likely: start the data selections the column count
+# makes likely together with the chart selection, all: also start the bubble chart selection.
+# Speculation saves one LLM round trip per deck and spends tokens on answers that may be discarded.
+SPECULATIVE_DATA_SELECTION = os.environ.get("SPECULATIVE_DATA_SELECTION", "off")
+SPECULATIVE_MAX_WORKERS = int(os.environ.get("SPECULATIVE_MAX_WORKERS", "8"))
+
+_speculation_executor = ThreadPoolExecutor(max_workers=SPECULATIVE_MAX_WORKERS,
+                                           thread_name_prefix="speculative_llm")
+
+# process: render every chart into a single-slide package of its own in RENDER_WORKERS worker processes and merge
+# the packages into the deck, off: render the charts one after another into the deck.
+# Chart rendering holds the GIL and worker processes take memory, so processes only pay off with several cores.
+PARALLEL_RENDERING = os.environ.get("PARALLEL_RENDERING", "process" if (os.cpu_count() or 1) > 1 else "off")
+RENDER_WORKERS = int(os.environ.get("RENDER_WORKERS", str(os.cpu_count() or 1)))
+
+# Forking would copy the app's running threads and event loop into the workers, workers are only started once used
+_render_executor = ProcessPoolExecutor(max_workers=RENDER_WORKERS, mp_context=multiprocessing.get_context("spawn")) \
+    if PARALLEL_RENDERING == "process" else None
+
+# Partial sums of streamed chunks are folded into one once there are this many of them
+MAX_PARTIAL_SUMS = 8
+
+# soffice: convert with LibreOffice, stub: write a placeholder PDF (for load tests without LibreOffice)
+PDF_CONVERTER = os.environ.get("PDF_CONVERTER", "soffice")
+
+PLACEHOLDER_PDF = (
+    b"%PDF-1.4\n1 0 obj<</Type/Catalog/Pages 2 0 R>>endobj\n"
+    b"2 0 obj<</Type/Pages/Kids[3 0 R]/Count 1>>endobj\n"
+    b"3 0 obj<</Type/Page/Parent 2 0 R/MediaBox[0 0 960 540]>>endobj\n"
+    b"trailer<</Root 1 0 R>>\n%%EOF\n"
+)
+
+SLIDE_CREATORS = {
+    "column": create_column_chart,
+    "bar": create_bar_chart,
+    "clustered_column": create_clustered_column_chart,
+    "clustered_bar": create_clustered_bar_chart,
+    "stacked_column": create_stacked_column_chart,
+    "stacked_bar": create_stacked_bar_chart,
+    "100_percent_stacked_column": create_100_percent_stacked_column_chart,
+    "line": create_line_chart,
+    "pie": create_pie_chart,
+    "doughnut": create_doughnut_chart,
+    "bubble": create_bubble_chart,
+}
+
 
 # Data transformation
 def _normalize_values_to_percentages_multi_columns(dataframe, series: list[str]):
-    percentage_dataframe = dataframe.copy()
+    # A shallow copy shares the untouched columns, only the series get new arrays
+    percentage_dataframe = dataframe.copy(deep=False)
     percentage_dataframe[series] = dataframe[series].div(dataframe[series].sum(axis=1),
                                                          axis=0) * 100  # Convert to percentage
     return percentage_dataframe
@@ -35,12 +99,85 @@ def _normalize_values_to_percentages_multi_columns(dataframe, series: list[str])
 
 def _normalize_values_to_percentages_single_column(dataframe, value: str):
     total = dataframe[value].sum()
-    percentage_dataframe = dataframe.copy()
+    percentage_dataframe = dataframe.copy(deep=False)
     percentage_dataframe[value] = (dataframe[value] / total)
 
     return percentage_dataframe
 
 
+def _to_numeric_columns(dataframe, columns: list[str]):
+    """Projects the columns and converts text columns holding numbers, raises ValueError for real text.
+
+    Compacted columns are widened to 64 bits, sums of small integer dtypes would overflow.
+    """
+    projected = dataframe[columns]
+    for column in columns:
+        values = projected[column]
+        if not pd.api.types.is_numeric_dtype(values):
+            # Arrow-backed strings would parse to nullable dtypes, object columns parse to numpy ones
+            values = pd.to_numeric(values.astype(object))
+        if pd.api.types.is_integer_dtype(values) and values.dtype != np.int64:
+            values = values.astype(np.int64)
+        elif pd.api.types.is_float_dtype(values) and values.dtype != np.float64:
+            values = values.astype(np.float64)
+        if values.dtype != projected[column].dtype:
+            projected = projected.assign(**{column: values})
+    return projected
+
+
+def _sum_by_keys(dataframe, keys: list[str], value_columns: list[str]):
+    """Sums the value columns per combination of the key columns, other columns are never touched."""
+    values = _to_numeric_columns(dataframe, value_columns)
+    # Categorical keys group on integer codes, observed=True skips combinations without rows
+    groups = [dataframe[key].astype("category") for key in keys]
+
+    summed = values.groupby(groups, observed=True).sum().reset_index()
+    for key in keys:
+        summed[key] = summed[key].astype(dataframe[key].dtype)
+    return summed
+
+
+def _fold_partial_sums(chunks, keys: list[str], value_columns: list[str]):
+    """Sums chunk by chunk, memory depends on the number of key combinations instead of the number of rows."""
+    partial_sums = []
+    for chunk in chunks:
+        partial_sums.append(_sum_by_keys(chunk, keys, value_columns))
+        if len(partial_sums) >= MAX_PARTIAL_SUMS:
+            partial_sums = [_sum_by_keys(pd.concat(partial_sums, ignore_index=True), keys, value_columns)]
+
+    if not partial_sums:
+        raise ValueError("The data contains no rows")
+    if len(partial_sums) == 1:
+        return partial_sums[0]
+    return _sum_by_keys(pd.concat(partial_sums, ignore_index=True), keys, value_columns)
+
+
+def _aggregate_by_category(chunks, category: str, value_columns: list[str]):
+    """Sums the value columns per category over the chunks, an in-memory table is a single chunk."""
+    aggregated = _fold_partial_sums(chunks, [category], value_columns)
+    aggregated.columns = aggregated.columns.astype(str)
+    return aggregated
+
+
+def _pivot_long_format(chunks, index: str, columns: str, values: str):
+    """Turns long-format data into one column per series, duplicate index/column pairs are summed."""
+    summed = _fold_partial_sums(chunks, [index, columns], [values])
+
+    # The pairs are unique once summed, pairs without rows become NaN like in a pivot table
+    pivoted = summed.pivot(index=index, columns=columns, values=values).astype(np.float64)
+    pivoted = pivoted.reset_index()
+    pivoted.columns = pivoted.columns.astype(str)
+    return pivoted
+
+
+def _table_chunks(df, table: Optional[data_ingestion.ChunkedTable], columns: list[str], drop_last_row: bool,
+                  value_columns: list[str]):
+    # In-memory tables are a single chunk, the sum row has been dropped from them already
+    if table is None:
+        return [df]
+    return table.iter_chunks(columns, drop_last_row, tuple(value_columns))
+
+
 # Data ingestion
 
 def _sort_descending(two_column_dataframe, two_column_chart_information):
@@ -85,7 +222,103 @@ def _determine_rounding_precision(df, columns) -> RoundingPrecision:
     )
 
 
+def _add_slide(presentation, slide_spec: SlideSpec, chart_core_message: str) -> bool:
+    slide_count = len(presentation.slides)
+
+    arguments = dict(
+        presentation=presentation,
+        dataframe=slide_spec.dataframe,
+        chart_information=slide_spec.chart_information,
+        chart_core_message=chart_core_message
+    )
+    if slide_spec.rounding_precision is not None:
+        arguments["rounding_precision"] = slide_spec.rounding_precision
+
+    # The chart creators swallow their own errors and remove the half-built slide
+    with metrics.stage(f"create_{slide_spec.chart_name}_chart"):
+        SLIDE_CREATORS[slide_spec.chart_name](**arguments)
+
+    return len(presentation.slides) > slide_count
+
+
+def _render_single_slide(slide_spec: SlideSpec, chart_core_message: str) \
+        -> tuple[Optional[bytes], float, Optional[tuple[int, int]]]:
+    """Renders one chart into a package of its own, runs in a worker process.
+
+    Returns the package, None if the chart could not be created, the seconds the chart took and its (peak, net)
+    memory, None unless STAGE_MEMORY is set.
+    """
+    presentation = Presentation(TEMPLATE_PATH)
+    start = time.perf_counter()
+    memory_record = metrics.start_memory_record()
+    created = _add_slide(presentation, slide_spec, chart_core_message)
+    memory = metrics.finish_memory_record(memory_record)
+    duration = time.perf_counter() - start
+    if not created:
+        return None, duration, memory
+
+    package = BytesIO()
+    presentation.save(package)
+    return package.getvalue(), duration, memory
+
+
+def _start_render_worker():
+    pass
+
+
+def start_render_workers():
+    """Starts all worker processes, they import the app's modules which takes seconds."""
+    if _render_executor is not None:
+        wait([_render_executor.submit(_start_render_worker) for _ in range(RENDER_WORKERS)])
+
+
+def stop_render_workers():
+    if _render_executor is not None:
+        _render_executor.shutdown(cancel_futures=True)
+
+
+def _render_slides_sequentially(slide_specs: list[SlideSpec], chart_core_message: str):
+    with metrics.stage("template_load"):
+        presentation = Presentation(TEMPLATE_PATH)
+
+    # Keep only the specs whose slide was actually created, so slide and spec indices line up
+    slide_specs = [slide_spec for slide_spec in slide_specs
+                   if _add_slide(presentation, slide_spec, chart_core_message)]
+    return presentation, slide_specs
+
+
+def _render_slides_in_parallel(slide_specs: list[SlideSpec], chart_core_message: str):
+    # The slowest chart bounds the wall-clock time instead of the sum of all charts
+    with metrics.stage("render_slides"):
+        futures = [_render_executor.submit(_render_single_slide, slide_spec, chart_core_message)
+                   for slide_spec in slide_specs]
+        results = [future.result() for future in futures]
+
+    # Worker processes have metrics of their own, the chart durations and memory are recorded here instead
+    for slide_spec, (_, duration, memory) in zip(slide_specs, results):
+        metrics.record_stage(f"create_{slide_spec.chart_name}_chart", duration)
+        if memory is not None:
+            metrics.record_stage_memory(f"create_{slide_spec.chart_name}_chart", *memory)
+
+    with metrics.stage("template_load"):
+        presentation = Presentation(TEMPLATE_PATH)
+
+    rendered_specs = []
+    with metrics.stage("deck_merge"):
+        for slide_spec, (package, _, _) in zip(slide_specs, results):
+            if package is not None:
+                deck_assembler.append_slide(presentation, package)
+                rendered_specs.append(slide_spec)
+    return presentation, rendered_specs
+
+
 def _convert_pptx_to_pdf(pptx_file):
+    if PDF_CONVERTER == "stub":
+        # Same location as soffice uses: the working directory, named after the pptx
+        pdf_file = f"{os.path.splitext(os.path.basename(pptx_file))[0]}.pdf"
+        with open(pdf_file, "wb") as output_file:
+            output_file.write(PLACEHOLDER_PDF)
+        return
 
     command = [
         "soffice",
@@ -94,84 +327,440 @@ def _convert_pptx_to_pdf(pptx_file):
         pptx_file
     ]
 
-    subprocess.run(command, check=True)
+    process = subprocess.Popen(command)
+    # LibreOffice runs out of process, wait4 reports its peak resident memory (in kilobytes) with the exit status
+    _, status, usage = os.wait4(process.pid, 0)
+    process.returncode = os.waitstatus_to_exitcode(status)
+    if metrics.STAGE_MEMORY != "off":
+        metrics.record_stage_memory("pdf_converter_process", usage.ru_maxrss * 1024, 0)
+    if process.returncode:
+        raise subprocess.CalledProcessError(process.returncode, command)
 
 
 # Main function
+@profiling.profiled
 def create_chart(df, header_cell_formats: dict, chart_core_message: str, uuid):
-    selected_two_column_charts = ChartType.get_two_column_charts()
-    selected_multi_column_charts = ChartType.get_multi_column_charts()
-    all_charts = ChartType.get_all()
+    source = _decide_and_prepare(df, header_cell_formats, chart_core_message)
+    response = render_presentation(source.slide_specs, chart_core_message, uuid)
+    decision_cache.register_deck(response.presentation_name, chart_core_message, [source])
+    return response
+
+
+@profiling.profiled
+def create_multi_sheet_chart(sheets: dict, chart_core_message: str, uuid):
+    """Builds one deck from several sheets, given as {sheet name: (df, header_cell_formats)}.
+
+    The LLM decisions and data preparation of all sheets run concurrently, the template is opened once.
+    """
+    with ThreadPoolExecutor(max_workers=min(len(sheets), MAX_PARALLEL_SHEETS)) as executor:
+        # Each worker gets a copy of the request context, so stage timings and the deadline carry over
+        futures = {
+            sheet_name: executor.submit(contextvars.copy_context().run, _decide_and_prepare, df,
+                                        header_cell_formats, chart_core_message)
+            for sheet_name, (df, header_cell_formats) in sheets.items()
+        }
+
+        sources = []
+        for sheet_name, future in futures.items():
+            try:
+                sources.append(future.result())
+            except admission.OverloadedError:
+                raise
+            except Exception as exception:
+                print(f"Sheet '{sheet_name}': {exception}")
+
+    response = render_presentation([slide_spec for source in sources for slide_spec in source.slide_specs],
+                                   chart_core_message, uuid)
+    decision_cache.register_deck(response.presentation_name, chart_core_message, sources)
+    return response
+
+
+@profiling.profiled
+def rerender_chart(presentation_name: str, overrides: RerenderRequest, uuid):
+    """Renders a new deck from the cached decisions of an earlier presentation, without calling the LLM.
+
+    Raises KeyError if the presentation is no longer cached and ValueError for chart types that cannot be drawn
+    from the cached decisions.
+    """
+    deck = decision_cache.get_deck(presentation_name)
+    if deck is None:
+        raise KeyError(f"No cached decisions for presentation '{presentation_name}'")
+
+    cached_chart_core_message, sources = deck
+    chart_core_message = overrides.chart_core_message or cached_chart_core_message
+
+    if overrides.chart_types is not None:
+        _check_chart_types(overrides.chart_types, [source.decisions for source in sources],
+                           "create a new presentation instead")
+
+    updates = {}
+    if overrides.chart_types is not None:
+        updates["chart_types"] = overrides.chart_types
+    if overrides.last_line_includes_sum is not None:
+        updates["last_line_includes_sum"] = overrides.last_line_includes_sum
+
+    # A new title reuses the prepared slides, other overrides only repeat the data preparation
+    if updates:
+        with metrics.stage("prepare_data"):
+            rerendered_sources = []
+            for source in sources:
+                decisions = source.decisions.model_copy(update=updates)
+                rerendered_sources.append(
+                    DeckSource(source.dataframe, decisions, prepare_slide_specs(source.dataframe, decisions))
+                )
+            sources = rerendered_sources
 
-    presentation = Presentation(TEMPLATE_PATH)
+    response = render_presentation([slide_spec for source in sources for slide_spec in source.slide_specs],
+                                   chart_core_message, uuid)
+    decision_cache.register_deck(response.presentation_name, chart_core_message, sources)
+    return response
+
+
+@profiling.profiled
+def decide_chart_data(df, header_cell_formats: dict, chart_core_message: str) -> ChartDecisionResponse:
+    """Makes the chart and data decisions of create_chart and returns them with the prepared data, nothing is
+    rendered. Fails like create_chart when none of the charts can be prepared."""
+    source = _decide_and_prepare(df, header_cell_formats, chart_core_message)
+    if not source.slide_specs:
+        raise Exception("Unable to create chart")
+
+    charts = []
+    with metrics.stage("serialize_data"):
+        for slide_spec in source.slide_specs:
+            # to_json turns numpy values into JSON types and NaN into null
+            prepared_data = json.loads(slide_spec.dataframe.to_json(orient="split", index=False, date_format="iso"))
+            charts.append(PreparedChart(
+                chart_name=slide_spec.chart_name,
+                chart_information=slide_spec.chart_information,
+                rounding_precision=slide_spec.rounding_precision,
+                columns=prepared_data["columns"],
+                rows=prepared_data["data"]
+            ))
+    return ChartDecisionResponse(decisions=source.decisions, charts=charts)
+
+
+@profiling.profiled
+def create_chart_from_spec(df, spec: ChartSpecRequest, uuid):
+    """Renders the chart types of the spec with its data mappings, without calling the LLM.
+
+    Raises ValueError for unknown chart types, missing mappings, mappings that do not fit the columns and when
+    none of the charts can be prepared from the data.
+    """
+    _check_chart_types(spec.chart_types, [spec], "add its data structure to the spec")
+
+    problems = [
+        problem
+        for selection in (spec.multi_column_data, spec.long_format_data, spec.two_column_data, spec.bubble_data)
+        if selection is not None
+        for problem in validate_data_selection(df, selection)
+    ]
+    if problems:
+        raise ValueError("; ".join(problems))
+
+    decisions = ChartDecisions(
+        selected_chart_type=SelectedChartType(
+            reason_for_selected_chart_types="Given by the request",
+            chart_types=spec.chart_types,
+            is_in_long_format=spec.long_format_data is not None,
+            last_line_includes_sum=spec.last_line_includes_sum
+        ),
+        chart_types=spec.chart_types,
+        last_line_includes_sum=spec.last_line_includes_sum,
+        multi_column_data=spec.multi_column_data,
+        long_format_data=spec.long_format_data,
+        two_column_data=spec.two_column_data,
+        bubble_data=spec.bubble_data
+    )
+
+    with metrics.stage("prepare_data"):
+        slide_specs = prepare_slide_specs(df, decisions)
+    if not slide_specs:
+        raise ValueError("None of the charts could be prepared from the data")
+
+    response = render_presentation(slide_specs, spec.chart_core_message, uuid)
+    # Spec decks can be re-rendered like any other deck
+    decision_cache.register_deck(response.presentation_name, spec.chart_core_message,
+                                 [DeckSource(df, decisions, slide_specs)])
+    return response
+
+
+def _check_chart_types(chart_types: list[str], decisions: list, missing_selection_hint: str):
+    # decisions are ChartDecisions or ChartSpecRequests, both carry the data structures under the same names
+    known_chart_types = [chart_type.value for chart_type in ChartType]
+    unknown_chart_types = [chart_type for chart_type in chart_types if chart_type not in known_chart_types]
+    if unknown_chart_types:
+        raise ValueError(f"Unknown chart types: {', '.join(unknown_chart_types)}")
+
+    has_multi_column_data = any(d.multi_column_data or d.long_format_data for d in decisions)
+    has_two_column_data = any(d.two_column_data for d in decisions)
+    has_bubble_data = any(d.bubble_data for d in decisions)
+
+    undecided_chart_types = [
+        chart_type for chart_type in chart_types
+        if (chart_type in ChartType.get_multi_category_chart_names() and not has_multi_column_data)
+        or (chart_type in ChartType.get_category_chart_names() and not has_two_column_data)
+        or (chart_type == ChartType.BUBBLE.value and not has_bubble_data)
+    ]
+    if undecided_chart_types:
+        raise ValueError(f"No data selection for chart types: {', '.join(undecided_chart_types)}, "
+                         f"{missing_selection_hint}")
+
+
+@profiling.profiled
+def _decide_and_prepare(df, header_cell_formats: dict, chart_core_message: str) -> DeckSource:
+    # Streamed tables are decided on their first rows
+    sample = df.sample if isinstance(df, data_ingestion.ChunkedTable) else df
+    decisions = decide_charts(sample, header_cell_formats, chart_core_message)
+    with metrics.stage("prepare_data"):
+        slide_specs = prepare_slide_specs(df, decisions)
+    return DeckSource(df, decisions, slide_specs)
+
+
+def decide_charts(df, header_cell_formats: dict, chart_core_message: str) -> ChartDecisions:
+    """Asks the LLM for the chart types and the columns of every selected chart family.
+
+    Falls back to chart_heuristics while the LLM circuit breaker is open.
+    """
+    if circuit_is_open():
+        return _decide_charts_heuristically(df)
 
     df_headers = df.columns.tolist()
     has_more_than_two_headers = len(df_headers) > 2
 
+    # The data selection prompts only depend on the headers, so they can run while the chart is selected
+    speculative_calls = _start_speculative_data_selection(df, df_headers, has_more_than_two_headers,
+                                                          chart_core_message, header_cell_formats)
+
+    try:
+        decisions = _decide_charts(df, df_headers, has_more_than_two_headers, header_cell_formats,
+                                   chart_core_message, speculative_calls)
+    except CircuitOpenError:
+        return _decide_charts_heuristically(df)
+    finally:
+        _discard_speculative_calls(speculative_calls)
+
+    return decisions
+
+
+def _decide_charts_heuristically(df) -> ChartDecisions:
+    metrics.DEGRADED_DECISIONS.inc()
+    print("LLM circuit breaker is open, choosing charts from the column types")
+    return chart_heuristics.decide_charts(df)
+
+
+def _decide_charts(df, df_headers: list, has_more_than_two_headers: bool, header_cell_formats: dict,
+                   chart_core_message: str, speculative_calls: dict) -> ChartDecisions:
+    selected_two_column_charts = ChartType.get_two_column_charts()
+    all_charts = ChartType.get_all()
+
     # Select chart
-    chart_selection_prompt = create_chart_selection_prompt(
-        df=df,
-        chart_options=all_charts if has_more_than_two_headers else selected_two_column_charts,
-        core_message=chart_core_message,
-        header_cell_formats=header_cell_formats)
+    with metrics.stage("build_prompt"):
+        chart_selection_prompt = create_chart_selection_prompt(
+            df=df,
+            chart_options=all_charts if has_more_than_two_headers else selected_two_column_charts,
+            core_message=chart_core_message,
+            header_cell_formats=header_cell_formats)
 
     selected_chart_type = _query_openai(message=chart_selection_prompt, response_model=SelectedChartType)
-    # MOCK
-    # selected_chart_type = SelectedChartType(
-    #     reason_for_selected_chart_types="some reason",
-    #     chart_types=[ChartType.COLUMN.value],
-    #     is_in_long_format=False,
-    #     last_line_includes_sum=False
-    # )
 
     print(selected_chart_type.reason_for_selected_chart_types)
     selected_charts = selected_chart_type.chart_types
-    is_long_format = selected_chart_type.is_in_long_format
 
-    # Prepare data
-    df.columns = df.columns.astype(str)
+    decisions = ChartDecisions(
+        selected_chart_type=selected_chart_type,
+        chart_types=selected_charts,
+        last_line_includes_sum=selected_chart_type.last_line_includes_sum
+    )
+
+    # Prepare data. The frame may be shared with the dataset store and the decision cache, its columns are renamed
+    # on a shallow copy
+    df = df.rename(columns=str, copy=False)
 
     if selected_chart_type.last_line_includes_sum:
-        df = df.drop(df.index[-1])
+        # A view without the sum row, drop would copy the whole frame
+        df = df.iloc[:-1]
+
+    selected_two_column_charts = list(set(selected_charts).intersection(ChartType.get_category_chart_names()))
+    selected_multi_column_charts = list(set(selected_charts).intersection(ChartType.get_multi_category_chart_names()))
+
+    if selected_multi_column_charts:
+        try:
+            if selected_chart_type.is_in_long_format:
+                with metrics.stage("build_prompt"):
+                    data_selection_prompt = create_long_format_multicolumn_category_chart_data_selection_prompt(
+                        df=df,
+                        core_message=chart_core_message,
+                        header_cell_formats=header_cell_formats
+                    )
+
+                decisions.long_format_data = query_tiered(
+                    message=data_selection_prompt,
+                    response_model=LongFormatDataStructure,
+                    validate=lambda answer: validate_data_selection(df, answer)
+                )
+            else:
+                decisions.multi_column_data = _data_selection(speculative_calls, MultiColumnDataStructure,
+                                                              df, df_headers, chart_core_message, header_cell_formats)
+
+        except (admission.OverloadedError, CircuitOpenError):
+            raise
+        except Exception as exception:
+            selected_charts = list(set(selected_charts) - set(selected_multi_column_charts))
+            print(str(exception))
+
+    if selected_two_column_charts:
+        try:
+            decisions.two_column_data = _data_selection(speculative_calls, TwoColumnDataStructure,
+                                                        df, df_headers, chart_core_message, header_cell_formats)
+
+        except (admission.OverloadedError, CircuitOpenError):
+            raise
+        except Exception as exception:
+            selected_charts = list(set(selected_charts) - set(selected_two_column_charts))
+            print(str(exception))
+
+    if ChartType.BUBBLE.value in selected_charts:
+        try:
+            decisions.bubble_data = _data_selection(speculative_calls, BubbleChartDataStructure,
+                                                    df, df_headers, chart_core_message, header_cell_formats)
+        except (admission.OverloadedError, CircuitOpenError):
+            raise
+        except Exception as exception:
+            selected_charts = list(set(selected_charts) - {ChartType.BUBBLE.value})
+            print(str(exception))
+
+    decisions.chart_types = selected_charts
+    return decisions
+
+
+def _data_selection_prompt(response_model, df_headers: list, chart_core_message: str, header_cell_formats: dict):
+    with metrics.stage("build_prompt"):
+        return _build_data_selection_prompt(response_model, df_headers, chart_core_message, header_cell_formats)
+
+
+def _build_data_selection_prompt(response_model, df_headers: list, chart_core_message: str,
+                                 header_cell_formats: dict):
+    if response_model is MultiColumnDataStructure:
+        return create_multicolumn_category_chart_data_selection_prompt(
+            df_headers,
+            chart_core_message,
+            "clustered column chart",
+            header_cell_formats
+        )
+    if response_model is TwoColumnDataStructure:
+        return create_two_column_category_chart_data_selection_prompt(
+            table_headers=df_headers,
+            chart_message=chart_core_message,
+            chart_type="column chart",
+            header_cell_formats=header_cell_formats)
+    return create_bubble_chart_data_selection_prompt(df_headers, chart_core_message,
+                                                     "bubble chart",
+                                                     header_cell_formats)
+
+
+def _start_speculative_data_selection(df, df_headers: list, has_more_than_two_headers: bool,
+                                      chart_core_message: str, header_cell_formats: dict) -> dict:
+    """Starts the data selections the chart selection will likely ask for, returns {response model: future}."""
+    if SPECULATIVE_DATA_SELECTION == "off":
+        return {}
+
+    # Same rule as the chart options: two headers only allow two column charts
+    response_models = [TwoColumnDataStructure]
+    if has_more_than_two_headers:
+        response_models.append(MultiColumnDataStructure)
+        if SPECULATIVE_DATA_SELECTION == "all":
+            response_models.append(BubbleChartDataStructure)
+
+    return {
+        response_model: _speculation_executor.submit(
+            # The copied context carries the trace id, stage timings and deadline of the request
+            contextvars.copy_context().run,
+            _query_data_selection,
+            df,
+            _data_selection_prompt(response_model, df_headers, chart_core_message, header_cell_formats),
+            response_model
+        )
+        for response_model in response_models
+    }
+
+
+def _data_selection(speculative_calls: dict, response_model, df, df_headers: list, chart_core_message: str,
+                    header_cell_formats: dict):
+    future = speculative_calls.pop(response_model, None)
+    if future is not None:
+        try:
+            result = future.result()
+            metrics.SPECULATIVE_CALLS.labels(response_model=response_model.__name__, outcome="used").inc()
+            return result
+        except Exception as exception:
+            metrics.SPECULATIVE_CALLS.labels(response_model=response_model.__name__, outcome="failed").inc()
+            print(f"Speculative {response_model.__name__} call failed: {exception}")
+
+    return _query_data_selection(
+        df,
+        _data_selection_prompt(response_model, df_headers, chart_core_message, header_cell_formats),
+        response_model
+    )
+
+
+def _query_data_selection(df, message: str, response_model):
+    return query_tiered(
+        message=message,
+        response_model=response_model,
+        validate=lambda answer: validate_data_selection(df, answer)
+    )
+
+
+def _discard_speculative_calls(speculative_calls: dict):
+    # Calls that are already running cannot be stopped, their answers are dropped when they arrive
+    for response_model, future in speculative_calls.items():
+        outcome = "cancelled" if future.cancel() else "discarded"
+        metrics.SPECULATIVE_CALLS.labels(response_model=response_model.__name__, outcome=outcome).inc()
 
-    category_charts = ChartType.get_category_chart_names()
-    multi_category_charts = ChartType.get_multi_category_chart_names()
 
-    selected_two_column_charts = list(set(selected_charts).intersection(category_charts))
-    selected_multi_column_charts = list(set(selected_charts).intersection(multi_category_charts))
+def prepare_slide_specs(df, decisions: ChartDecisions) -> list[SlideSpec]:
+    """Turns the decisions into prepared data per slide, charts whose data cannot be prepared are left out."""
+    selected_charts = decisions.chart_types
+
+    # Streamed tables are aggregated chunk by chunk, their first rows stand in for the table everywhere else
+    table = None
+    if isinstance(df, data_ingestion.ChunkedTable):
+        table, df = df, df.sample
+
+    # Renamed on a shallow copy, the frame may be shared with the dataset store and the decision cache
+    df = df.rename(columns=str, copy=False)
+
+    if decisions.last_line_includes_sum:
+        # A view without the sum row, drop would copy the whole frame
+        df = df.iloc[:-1]
+
+    selected_two_column_charts = list(set(selected_charts).intersection(ChartType.get_category_chart_names()))
+    selected_multi_column_charts = list(set(selected_charts).intersection(ChartType.get_multi_category_chart_names()))
 
     multi_column_dataframe = None
-    multi_column_chart_information: Optional[MultiColumnDataStructure]
-    multi_column_rounding_precision: Optional[RoundingPrecision]
+    multi_column_chart_information: Optional[MultiColumnDataStructure] = decisions.multi_column_data
+    multi_column_rounding_precision: Optional[RoundingPrecision] = None
 
     two_column_dataframe = None
-    two_column_chart_information: Optional[TwoColumnDataStructure]
-    two_column_rounding_precision: Optional[RoundingPrecision]
+    two_column_chart_information: Optional[TwoColumnDataStructure] = decisions.two_column_data
+    two_column_rounding_precision: Optional[RoundingPrecision] = None
 
     bubble_dataframe = None
-    bubble_chart_information: Optional[BubbleChartDataStructure]
+    bubble_chart_information: Optional[BubbleChartDataStructure] = decisions.bubble_data
 
     if selected_multi_column_charts:
         try:
-            if is_long_format:
-                data_selection_prompt = create_long_format_multicolumn_category_chart_data_selection_prompt(df=df,
-                                                                                                            core_message=chart_core_message,
-                                                                                                            header_cell_formats=header_cell_formats
-                                                                                                            )
-
-                selected_data = _query_openai(
-                    message=data_selection_prompt,
-                    response_model=LongFormatDataStructure
-                )
-
-                multi_column_dataframe = df.pivot(
-                    index=selected_data.index,
-                    columns=selected_data.columns,
-                    values=selected_data.values
-                )
-
-                multi_column_dataframe = multi_column_dataframe.reset_index()
-                multi_column_dataframe.columns = multi_column_dataframe.columns.astype(str)
+            if decisions.long_format_data:
+                selected_data = decisions.long_format_data
+
+                with metrics.stage("aggregate"):
+                    multi_column_dataframe = _pivot_long_format(
+                        _table_chunks(df, table, [selected_data.index, selected_data.columns, selected_data.values],
+                                      decisions.last_line_includes_sum, [selected_data.values]),
+                        index=selected_data.index,
+                        columns=selected_data.columns,
+                        values=selected_data.values
+                    )
 
                 column_headers = multi_column_dataframe.columns.tolist()
 
@@ -183,29 +772,18 @@ def create_chart(df, header_cell_formats: dict, chart_core_message: str, uuid):
                     has_natural_sorting_order=selected_data.has_natural_sorting_order
                 )
 
-            else:
-
-                data_selection_prompt = (
-                    create_multicolumn_category_chart_data_selection_prompt(
-                        df_headers,
-                        chart_core_message,
-                        "clustered column chart",
-                        header_cell_formats
+            elif multi_column_chart_information:
+                with metrics.stage("aggregate"):
+                    multi_column_dataframe = _aggregate_by_category(
+                        _table_chunks(df, table,
+                                      [multi_column_chart_information.category, *multi_column_chart_information.series],
+                                      decisions.last_line_includes_sum, multi_column_chart_information.series),
+                        multi_column_chart_information.category,
+                        multi_column_chart_information.series
                     )
-                )
-
-                multi_column_chart_information = _query_openai(
-                    message=data_selection_prompt,
-                    response_model=MultiColumnDataStructure
-                ) if not MOCK_AI_API_CALLS else MultiColumnDataStructure(
-                    category="Year",
-                    series=["USA", "China"],
-                    title="some title",
-                    has_natural_sorting_order=False
-                )
 
-                multi_column_dataframe = df.groupby(multi_column_chart_information.category, as_index=False).sum()
-                multi_column_dataframe.columns = multi_column_dataframe.columns.astype(str)
+            else:
+                raise ValueError("No data selection for multi column charts")
 
             if not multi_column_chart_information.has_natural_sorting_order:
                 row_sums = multi_column_dataframe[multi_column_chart_information.series].sum(axis=1)
@@ -222,27 +800,17 @@ def create_chart(df, header_cell_formats: dict, chart_core_message: str, uuid):
 
     if selected_two_column_charts:
         try:
-            data_selection_prompt = create_two_column_category_chart_data_selection_prompt(
-                table_headers=df_headers,
-                chart_message=chart_core_message,
-                chart_type="column chart",
-                header_cell_formats=header_cell_formats)
-
-            two_column_chart_information = _query_openai(
-                message=data_selection_prompt,
-                response_model=TwoColumnDataStructure
-            ) if not MOCK_AI_API_CALLS else (
-                TwoColumnDataStructure(
-                    category="Market",
-                    value="Units sold",
-                    axis_label="Units sold",
-                    axis_unit="none",
-                    has_natural_sorting_order=False
+            if two_column_chart_information is None:
+                raise ValueError("No data selection for two column charts")
+
+            with metrics.stage("aggregate"):
+                two_column_dataframe = _aggregate_by_category(
+                    _table_chunks(df, table,
+                                  [two_column_chart_information.category, two_column_chart_information.value],
+                                  decisions.last_line_includes_sum, [two_column_chart_information.value]),
+                    two_column_chart_information.category,
+                    [two_column_chart_information.value]
                 )
-            )
-
-            two_column_dataframe = df.groupby(two_column_chart_information.category, as_index=False).sum()
-            two_column_dataframe.columns = two_column_dataframe.columns.astype(str)
 
             if not two_column_chart_information.has_natural_sorting_order:
                 two_column_dataframe = two_column_dataframe.sort_values(by=two_column_chart_information.value)
@@ -258,140 +826,102 @@ def create_chart(df, header_cell_formats: dict, chart_core_message: str, uuid):
 
     if ChartType.BUBBLE.value in selected_charts:
         try:
-            data_selection_prompt = create_bubble_chart_data_selection_prompt(df_headers, chart_core_message,
-                                                                              "bubble chart",
-                                                                              header_cell_formats)
-            bubble_chart_information = _query_openai(
-                message=data_selection_prompt,
-                response_model=BubbleChartDataStructure
-            ) if not MOCK_AI_API_CALLS else (
-                BubbleChartDataStructure(
-                    labels_column="Market",
-                    x_axis_column="Market share",
-                    y_axis_column="Market growth",
-                    x_axis_is_percentage=True,
-                    y_axis_is_percentage=True,
-                    x_axis_title="Market share (%)",
-                    y_axis_title="Market growth (%)",
-                    bubble_size_column="Market size",
-                    bubble_size_title="Some title",
-                    title="Market size in EUR"
-                )
-            )
-
-            bubble_dataframe = df[[bubble_chart_information.labels_column,
-                                   bubble_chart_information.x_axis_column,
-                                   bubble_chart_information.y_axis_column,
-                                   bubble_chart_information.bubble_size_column]].copy()
+            if bubble_chart_information is None:
+                raise ValueError("No data selection for bubble charts")
+
+            bubble_columns = [bubble_chart_information.labels_column,
+                              bubble_chart_information.x_axis_column,
+                              bubble_chart_information.y_axis_column,
+                              bubble_chart_information.bubble_size_column]
+            # Selecting the columns copies them already, only these four columns are ever copied. Bubbles are not
+            # aggregated, a streamed table is read as a whole, but only these columns of it.
+            if table is None:
+                bubble_dataframe = df[bubble_columns]
+            else:
+                bubble_dataframe = pd.concat(
+                    table.iter_chunks(bubble_columns, decisions.last_line_includes_sum, tuple(bubble_columns[1:])),
+                    ignore_index=True
+                )[bubble_columns]
 
+            # Multiplied as floats, compacted integer columns would overflow in their own dtype
             if bubble_chart_information.x_axis_is_percentage:
-                bubble_dataframe[bubble_chart_information.x_axis_column] *= 100
+                bubble_dataframe[bubble_chart_information.x_axis_column] = \
+                    bubble_dataframe[bubble_chart_information.x_axis_column] * 100.0
 
             if bubble_chart_information.y_axis_is_percentage:
-                bubble_dataframe[bubble_chart_information.y_axis_column] *= 100
+                bubble_dataframe[bubble_chart_information.y_axis_column] = \
+                    bubble_dataframe[bubble_chart_information.y_axis_column] * 100.0
 
             bubble_dataframe.columns = bubble_dataframe.columns.astype(str)
         except Exception as exception:
-            selected_charts = list(set(selected_charts) - set(ChartType.BUBBLE.value))
+            selected_charts = list(set(selected_charts) - {ChartType.BUBBLE.value})
             print(str(exception))
 
+    slide_specs = []
     for chart in selected_charts:
         match chart:
             # Multi column charts
             case ChartType.COLUMN_CLUSTERED.value:
-                create_clustered_column_chart(
-                    presentation=presentation,
-                    dataframe=multi_column_dataframe,
-                    chart_information=multi_column_chart_information,
-                    chart_core_message=chart_core_message,
-                    rounding_precision=multi_column_rounding_precision
-                )
-                create_clustered_bar_chart(
-                    presentation=presentation,
-                    dataframe=multi_column_dataframe,
-                    chart_information=multi_column_chart_information,
-                    chart_core_message=chart_core_message,
-                    rounding_precision=multi_column_rounding_precision
-                )
+                slide_specs.append(SlideSpec("clustered_column", multi_column_dataframe,
+                                             multi_column_chart_information, multi_column_rounding_precision))
+                slide_specs.append(SlideSpec("clustered_bar", multi_column_dataframe,
+                                             multi_column_chart_information, multi_column_rounding_precision))
             case ChartType.COLUMN_STACKED.value:
-                create_stacked_column_chart(
-                    presentation=presentation,
-                    dataframe=multi_column_dataframe,
-                    chart_information=multi_column_chart_information,
-                    chart_core_message=chart_core_message,
-                    rounding_precision=multi_column_rounding_precision
-                )
-                create_stacked_bar_chart(
-                    presentation=presentation,
-                    dataframe=multi_column_dataframe,
-                    chart_information=multi_column_chart_information,
-                    chart_core_message=chart_core_message,
-                    rounding_precision=multi_column_rounding_precision
-                )
+                slide_specs.append(SlideSpec("stacked_column", multi_column_dataframe,
+                                             multi_column_chart_information, multi_column_rounding_precision))
+                slide_specs.append(SlideSpec("stacked_bar", multi_column_dataframe,
+                                             multi_column_chart_information, multi_column_rounding_precision))
             case ChartType.COLUMN_STACKED_100.value:
-                create_100_percent_stacked_column_chart(
-                    presentation=presentation,
-                    dataframe=_normalize_values_to_percentages_multi_columns(multi_column_dataframe,
-                                                                             multi_column_chart_information.series),
-                    chart_information=multi_column_chart_information,
-                    chart_core_message=chart_core_message
-                )
+                slide_specs.append(SlideSpec(
+                    "100_percent_stacked_column",
+                    _normalize_values_to_percentages_multi_columns(multi_column_dataframe,
+                                                                   multi_column_chart_information.series),
+                    multi_column_chart_information
+                ))
             case ChartType.LINE.value:
-                create_line_chart(
-                    presentation=presentation,
-                    dataframe=multi_column_dataframe,
-                    chart_information=multi_column_chart_information,
-                    chart_core_message=chart_core_message
-                )
+                slide_specs.append(SlideSpec("line", multi_column_dataframe, multi_column_chart_information))
             # Two column charts
             case ChartType.COLUMN.value:
-                create_column_chart(
-                    presentation=presentation,
-                    dataframe=two_column_dataframe,
-                    chart_information=two_column_chart_information,
-                    chart_core_message=chart_core_message,
-                    rounding_precision=two_column_rounding_precision
-                )
-                create_bar_chart(
-                    presentation=presentation,
-                    dataframe=two_column_dataframe,
-                    chart_information=two_column_chart_information,
-                    chart_core_message=chart_core_message,
-                    rounding_precision=two_column_rounding_precision
-                )
+                slide_specs.append(SlideSpec("column", two_column_dataframe,
+                                             two_column_chart_information, two_column_rounding_precision))
+                slide_specs.append(SlideSpec("bar", two_column_dataframe,
+                                             two_column_chart_information, two_column_rounding_precision))
             case ChartType.PIE.value:
 
                 percentage_dataframe = _normalize_values_to_percentages_single_column(two_column_dataframe,
                                                                                       two_column_chart_information.value)
                 sorted_percentage_dataframe = _sort_descending(percentage_dataframe, two_column_chart_information)
-                create_pie_chart(
-                    presentation=presentation,
-                    dataframe=sorted_percentage_dataframe,
-                    chart_information=two_column_chart_information,
-                    chart_core_message=chart_core_message
-                )
-                create_doughnut_chart(
-                    presentation=presentation,
-                    dataframe=sorted_percentage_dataframe,
-                    chart_information=two_column_chart_information,
-                    chart_core_message=chart_core_message
-                )
+                slide_specs.append(SlideSpec("pie", sorted_percentage_dataframe, two_column_chart_information))
+                slide_specs.append(SlideSpec("doughnut", sorted_percentage_dataframe, two_column_chart_information))
             case ChartType.BUBBLE.value:
-                create_bubble_chart(
-                    presentation=presentation,
-                    dataframe=bubble_dataframe,
-                    chart_information=bubble_chart_information,
-                    chart_core_message=chart_core_message
-                )
-    if len(presentation.slides) < 1:
-        raise Exception("Unable to create chart")
+                slide_specs.append(SlideSpec("bubble", bubble_dataframe, bubble_chart_information))
+
+    return slide_specs
+
 
+def render_presentation(slide_specs: list[SlideSpec], chart_core_message: str, uuid):
     presentation_name = f"{uuid}_{datetime.datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}"
     ppt_path = f"{presentation_name}.pptx"
-    presentation.save(ppt_path)
 
-    _convert_pptx_to_pdf(ppt_path)
+    with admission.limit("render"):
+        if PARALLEL_RENDERING == "off" or len(slide_specs) < 2:
+            presentation, slide_specs = _render_slides_sequentially(slide_specs, chart_core_message)
+        else:
+            presentation, slide_specs = _render_slides_in_parallel(slide_specs, chart_core_message)
+
+        if len(presentation.slides) < 1:
+            raise Exception("Unable to create chart")
+
+        with metrics.stage("presentation_save"):
+            presentation.save(ppt_path)
+
+    with admission.limit("pdf"), metrics.stage("pdf_conversion"):
+        _convert_pptx_to_pdf(ppt_path)
+
+    preview_service.register_presentation(presentation_name, chart_core_message, slide_specs)
+    profiling.link_presentation(presentation_name)
 
     return PowerpointCreationResponse(
         presentation_name=presentation_name,
+        slide_count=len(slide_specs)
     )
@@ -0,0 +1,540 @@
+# Lightweight slide previews drawn straight from the prepared data, without python-pptx or LibreOffice
+import math
+import os
+import threading
+from collections import OrderedDict
+from io import BytesIO
+from xml.sax.saxutils import escape
+
+from PIL import Image, ImageDraw, ImageFont
+
+from chart_factory import AXIS_LABEL_COLOR, DARK_GREEN, DARK_GRAY, MEDIUM_GRAY, GRID_COLOR, WHITE, \
+    _resolve_unit_label
+from models import SlideSpec, TwoColumnDataStructure, RoundingPrecision
+
+PREVIEW_FORMATS = {
+    "svg": "image/svg+xml",
+    "png": "image/png",
+}
+
+MAX_CACHED_PRESENTATIONS = int(os.environ.get("PREVIEW_CACHE_PRESENTATIONS", "50"))
+MAX_CACHED_PREVIEWS = int(os.environ.get("PREVIEW_CACHE_IMAGES", "200"))
+
+# 16:9 canvas, the slide is 12192000 x 6858000 EMU
+WIDTH = 1280
+HEIGHT = 720
+EMU_TO_PX = WIDTH / 12192000
+PT_TO_PX = WIDTH / 960
+
+# Placeholder positions of the "Titel und Inhalt" layout in template.pptx (left, top, width, height in EMU)
+TITLE_BOX = (838200, 365125, 10515600, 725121)
+LABEL_BOX = (838200, 1451670, 10515600, 365125)
+CHART_BOX = (838200, 2113808, 10515599, 3635831)
+
+# Accent colors of the template theme, used by PowerPoint for multi series charts
+SERIES_COLORS = ["047857", "34D399", "022C22", "9CA3AF", "334155", "022C22"]
+
+LEGEND_HEIGHT = 36
+
+_presentations = OrderedDict()
+_previews = OrderedDict()
+_lock = threading.Lock()
+
+
+# Cache
+def register_presentation(presentation_name: str, chart_core_message: str, slide_specs: list[SlideSpec]):
+    with _lock:
+        _presentations[presentation_name] = (chart_core_message, slide_specs)
+        _presentations.move_to_end(presentation_name)
+        while len(_presentations) > MAX_CACHED_PRESENTATIONS:
+            evicted_name, _ = _presentations.popitem(last=False)
+            for key in [key for key in _previews if key[0] == evicted_name]:
+                del _previews[key]
+
+
+def get_slide_count(presentation_name: str):
+    with _lock:
+        presentation = _presentations.get(presentation_name)
+    return len(presentation[1]) if presentation else None
+
+
+def get_preview(presentation_name: str, slide_index: int, image_format: str):
+    """Returns the rendered preview or None if the presentation or slide is unknown."""
+    key = (presentation_name, slide_index, image_format)
+
+    with _lock:
+        if key in _previews:
+            _previews.move_to_end(key)
+            return _previews[key]
+        presentation = _presentations.get(presentation_name)
+
+    if presentation is None:
+        return None
+
+    chart_core_message, slide_specs = presentation
+    if not 0 <= slide_index < len(slide_specs):
+        return None
+
+    content = render_slide(slide_specs[slide_index], chart_core_message, image_format)
+
+    with _lock:
+        _previews[key] = content
+        while len(_previews) > MAX_CACHED_PREVIEWS:
+            _previews.popitem(last=False)
+
+    return content
+
+
+# Rendering
+def render_slide(slide_spec: SlideSpec, chart_core_message: str, image_format: str) -> bytes:
+    canvas = _SvgCanvas() if image_format == "svg" else _PngCanvas()
+
+    title_left, title_top, title_width, title_height = _to_px(TITLE_BOX)
+    title_size = 24 * PT_TO_PX
+    for line_number, line in enumerate(_wrap_text(chart_core_message, title_width, title_size)):
+        canvas.text(title_left, title_top + title_height / 2 + (line_number - 0.5) * title_size * 1.2, line,
+                    title_size, DARK_GRAY, bold=True, anchor="start")
+
+    if slide_spec.rounding_precision is not None:
+        _draw_label(canvas, slide_spec.chart_information, slide_spec.rounding_precision)
+
+    box = _to_px(CHART_BOX)
+    match slide_spec.chart_name:
+        case "column" | "clustered_column":
+            _draw_category_chart(canvas, box, slide_spec, horizontal=False, stacked=False)
+        case "bar" | "clustered_bar":
+            _draw_category_chart(canvas, box, slide_spec, horizontal=True, stacked=False)
+        case "stacked_column" | "100_percent_stacked_column":
+            _draw_category_chart(canvas, box, slide_spec, horizontal=False, stacked=True)
+        case "stacked_bar":
+            _draw_category_chart(canvas, box, slide_spec, horizontal=True, stacked=True)
+        case "line":
+            _draw_line_chart(canvas, box, slide_spec)
+        case "pie":
+            _draw_pie_chart(canvas, box, slide_spec, hole_ratio=0)
+        case "doughnut":
+            _draw_pie_chart(canvas, box, slide_spec, hole_ratio=0.5)
+        case "bubble":
+            _draw_bubble_chart(canvas, box, slide_spec)
+        case _:
+            raise ValueError(f"No preview available for chart '{slide_spec.chart_name}'")
+
+    return canvas.to_bytes()
+
+
+def _draw_label(canvas, chart_information, rounding_precision: RoundingPrecision):
+    left, top, _, height = _to_px(LABEL_BOX)
+    size = 14 * PT_TO_PX
+    canvas.text(left, top + size, chart_information.axis_label, size, DARK_GRAY, bold=True, anchor="start")
+    unit_label = _resolve_unit_label(chart_information.axis_unit, rounding_precision.order_of_magnitude)
+    if unit_label:
+        canvas.text(left, top + 2.2 * size, unit_label, size, MEDIUM_GRAY, anchor="start")
+
+
+def _draw_category_chart(canvas, box, slide_spec: SlideSpec, horizontal: bool, stacked: bool):
+    dataframe = slide_spec.dataframe
+    chart_information = slide_spec.chart_information
+    is_single_series = isinstance(chart_information, TwoColumnDataStructure)
+    series = [chart_information.value] if is_single_series else list(chart_information.series)
+    is_percentage = slide_spec.chart_name == "100_percent_stacked_column"
+
+    categories = [str(category) for category in dataframe[chart_information.category].tolist()]
+    values = [[_to_number(value) for value in dataframe[column].tolist()] for column in series]
+
+    left, top, width, height = box
+    if not is_single_series:
+        _draw_legend(canvas, box, series)
+        height -= LEGEND_HEIGHT
+
+    # Horizontal bar charts list the first category at the bottom, like PowerPoint does
+    if horizontal:
+        categories = categories[::-1]
+        values = [column_values[::-1] for column_values in values]
+
+    label_space = 160 if horizontal else 30
+    if horizontal:
+        plot_left, plot_top, plot_width, plot_height = left + label_space, top, width - label_space - 60, height
+    else:
+        plot_left, plot_top, plot_width, plot_height = left, top + 20, width, height - label_space - 20
+
+    if stacked:
+        totals = [sum(column[index] for column in values) for index in range(len(categories))]
+        maximum = max(totals + [0])
+        minimum = 0
+    else:
+        maximum = max([value for column in values for value in column] + [0])
+        minimum = min([value for column in values for value in column] + [0])
+
+    no_of_entries = len(series) * len(categories)
+    show_data_labels = stacked or is_single_series or no_of_entries < (11 if horizontal else 20)
+
+    if not show_data_labels:
+        minimum, maximum = _draw_value_gridlines(canvas, plot_left, plot_top, plot_width, plot_height, minimum,
+                                                 maximum, horizontal, slide_spec.rounding_precision)
+    value_range = (maximum - minimum) or 1
+
+    category_size = max(len(categories), 1)
+    slot = (plot_height if horizontal else plot_width) / category_size
+    # Gap widths of the chart_factory charts: 100% for stacked, PowerPoint's default 150% otherwise
+    bar_group = slot / (2 if stacked else 2.5)
+    bar_thickness = bar_group if stacked else bar_group / len(series)
+
+    label_font = (16 if len(categories) < 11 else 12) * PT_TO_PX
+    category_font = (14 if len(categories) < 11 else 12) * PT_TO_PX
+
+    def position(value):
+        return (value - minimum) / value_range * (plot_width if horizontal else plot_height)
+
+    zero = position(0)
+
+    for category_index, category in enumerate(categories):
+        slot_start = (plot_top if horizontal else plot_left) + category_index * slot
+        group_start = slot_start + (slot - bar_group) / 2
+        offset = 0
+
+        for series_index, column_values in enumerate(values):
+            value = column_values[category_index]
+            color = DARK_GREEN if is_single_series else _series_color(series_index)
+            bar_start = group_start if stacked else group_start + series_index * bar_thickness
+            start = position(offset) if stacked else zero
+            end = position(offset + value) if stacked else position(value)
+            offset = offset + value if stacked else offset
+
+            low, high = min(start, end), max(start, end)
+            if horizontal:
+                canvas.rect(plot_left + low, bar_start, high - low, bar_thickness, color)
+            else:
+                canvas.rect(bar_start, plot_top + plot_height - high, bar_thickness, high - low, color)
+
+            if not show_data_labels:
+                continue
+
+            text = f"{value:.0f}" if is_percentage else _format_value(value, slide_spec.rounding_precision)
+            center = bar_start + bar_thickness / 2
+            if stacked:
+                middle = (low + high) / 2
+                x, y = (plot_left + middle, center) if horizontal else (center, plot_top + plot_height - middle)
+                canvas.text(x, y + label_font * 0.35, text, label_font * 0.85, WHITE, bold=True)
+            elif horizontal:
+                canvas.text(plot_left + high + 6, center + label_font * 0.35, text, label_font, DARK_GREEN,
+                            bold=True, anchor="start")
+            else:
+                canvas.text(center, plot_top + plot_height - high - 6, text, label_font, DARK_GREEN, bold=True)
+
+        category_center = slot_start + slot / 2
+        if horizontal:
+            canvas.text(plot_left - 8, category_center + category_font * 0.35, category, category_font, DARK_GRAY,
+                        bold=True, anchor="end")
+        else:
+            canvas.text(category_center, plot_top + plot_height + category_font * 1.3, category, category_font,
+                        DARK_GRAY, bold=True)
+
+    if horizontal:
+        canvas.line(plot_left + zero, plot_top, plot_left + zero, plot_top + plot_height, GRID_COLOR)
+    else:
+        axis_y = plot_top + plot_height - zero
+        canvas.line(plot_left, axis_y, plot_left + plot_width, axis_y, GRID_COLOR)
+
+
+def _draw_line_chart(canvas, box, slide_spec: SlideSpec):
+    dataframe = slide_spec.dataframe
+    chart_information = slide_spec.chart_information
+    series = list(chart_information.series)
+
+    left, top, width, height = box
+    _draw_legend(canvas, box, series)
+    canvas.text(left + width / 2, top + 16, chart_information.axis_label, 14 * PT_TO_PX, AXIS_LABEL_COLOR)
+
+    plot_left, plot_top = left + 70, top + 40
+    plot_width, plot_height = width - 80, height - LEGEND_HEIGHT - 40 - 30
+
+    categories = [str(category) for category in dataframe[chart_information.category].tolist()]
+    values = [[_to_number(value) for value in dataframe[column].tolist()] for column in series]
+    maximum = max([value for column in values for value in column] + [0])
+    minimum = min([value for column in values for value in column] + [0])
+
+    minimum, maximum = _draw_value_gridlines(canvas, plot_left, plot_top, plot_width, plot_height, minimum, maximum,
+                                             False, slide_spec.rounding_precision)
+    value_range = (maximum - minimum) or 1
+
+    slot = plot_width / max(len(categories), 1)
+    label_every = max(1, math.ceil(len(categories) / 20))
+    for index, category in enumerate(categories):
+        if index % label_every == 0:
+            canvas.text(plot_left + (index + 0.5) * slot, plot_top + plot_height + 20, category, 12 * PT_TO_PX,
+                        AXIS_LABEL_COLOR)
+
+    for series_index, column_values in enumerate(values):
+        points = [(plot_left + (index + 0.5) * slot, plot_top + plot_height - (value - minimum) / value_range * plot_height)
+                  for index, value in enumerate(column_values)]
+        canvas.polyline(points, _series_color(series_index), width=3)
+
+    canvas.line(plot_left, plot_top + plot_height, plot_left + plot_width, plot_top + plot_height, GRID_COLOR)
+
+
+def _draw_pie_chart(canvas, box, slide_spec: SlideSpec, hole_ratio: float):
+    dataframe = slide_spec.dataframe
+    chart_information = slide_spec.chart_information
+
+    categories = [str(category) for category in dataframe[chart_information.category].tolist()]
+    values = [max(_to_number(value), 0) for value in dataframe[chart_information.value].tolist()]
+    total = sum(values) or 1
+
+    left, top, width, height = box
+    _draw_legend(canvas, box, categories, font_size=10 * PT_TO_PX)
+    radius = (height - LEGEND_HEIGHT - 20) / 2
+    center_x, center_y = left + width / 2, top + 10 + radius
+
+    # PowerPoint starts the first slice at twelve o'clock and continues clockwise
+    angle = -90.0
+    for index, value in enumerate(values):
+        sweep = value / total * 360
+        canvas.wedge(center_x, center_y, radius, radius * hole_ratio, angle, angle + sweep, _series_color(index))
+
+        middle = math.radians(angle + sweep / 2)
+        label_radius = radius * (0.65 if hole_ratio == 0 else (1 + hole_ratio) / 2)
+        if sweep > 8:
+            canvas.text(center_x + label_radius * math.cos(middle),
+                        center_y + label_radius * math.sin(middle) + 8,
+                        f"{value * 100:.0f}%", 16 * PT_TO_PX, WHITE, bold=True)
+        angle += sweep
+
+
+def _draw_bubble_chart(canvas, box, slide_spec: SlideSpec):
+    dataframe = slide_spec.dataframe
+    chart_information = slide_spec.chart_information
+
+    left, top, width, height = box
+    plot_left, plot_top, plot_width, plot_height = left + 70, top + 10, width - 90, height - 50
+
+    points = []
+    for _, row in dataframe.iterrows():
+        # Same scaling as chart_factory.create_bubble_chart, so preview and slide show the same numbers
+        x_value = row[chart_information.x_axis_column] \
+            if chart_information.x_axis_is_percentage else row[chart_information.x_axis_column] * 100
+        y_value = row[chart_information.y_axis_column] \
+            if chart_information.y_axis_is_percentage else row[chart_information.y_axis_column] * 100
+        points.append((str(row[chart_information.labels_column]), _to_number(x_value), _to_number(y_value),
+                       abs(_to_number(row[chart_information.bubble_size_column]))))
+
+    if not points:
+        return
+
+    max_size = max(point[3] for point in points) or 1
+    max_radius = min(plot_width, plot_height) / 8
+
+    x_values = [point[1] for point in points]
+    y_values = [point[2] for point in points]
+    x_padding = (max(x_values) - min(x_values)) * 0.15 or 1
+    x_minimum, x_maximum = min(x_values) - x_padding, max(x_values) + x_padding
+    y_minimum, y_maximum = _draw_value_gridlines(canvas, plot_left, plot_top, plot_width, plot_height,
+                                                 min(y_values + [0]), max(y_values) * 1.15, False, None)
+
+    for tick in _nice_ticks(x_minimum, x_maximum):
+        x = plot_left + (tick - x_minimum) / ((x_maximum - x_minimum) or 1) * plot_width
+        if plot_left <= x <= plot_left + plot_width:
+            canvas.text(x, plot_top + plot_height + 20, _format_value(tick, None), 12 * PT_TO_PX, AXIS_LABEL_COLOR)
+
+    canvas.line(plot_left, plot_top + plot_height, plot_left + plot_width, plot_top + plot_height, AXIS_LABEL_COLOR)
+    canvas.line(plot_left, plot_top, plot_left, plot_top + plot_height, AXIS_LABEL_COLOR)
+
+    for index, (label, x_value, y_value, size) in enumerate(points):
+        x = plot_left + (x_value - x_minimum) / ((x_maximum - x_minimum) or 1) * plot_width
+        y = plot_top + plot_height - (y_value - y_minimum) / ((y_maximum - y_minimum) or 1) * plot_height
+        radius = max(math.sqrt(size / max_size) * max_radius, 3)
+        canvas.circle(x, y, radius, _series_color(index))
+        canvas.text(x, y - radius - 6, label, 12 * PT_TO_PX, DARK_GRAY)
+
+
+def _draw_value_gridlines(canvas, plot_left, plot_top, plot_width, plot_height, minimum, maximum, horizontal,
+                          rounding_precision):
+    ticks = _nice_ticks(minimum, maximum)
+    minimum, maximum = ticks[0], ticks[-1]
+    value_range = (maximum - minimum) or 1
+
+    for tick in ticks:
+        text = _format_value(tick, rounding_precision)
+        if horizontal:
+            x = plot_left + (tick - minimum) / value_range * plot_width
+            canvas.line(x, plot_top, x, plot_top + plot_height, GRID_COLOR)
+            canvas.text(x, plot_top + plot_height + 20, text, 12 * PT_TO_PX, AXIS_LABEL_COLOR)
+        else:
+            y = plot_top + plot_height - (tick - minimum) / value_range * plot_height
+            canvas.line(plot_left, y, plot_left + plot_width, y, GRID_COLOR)
+            canvas.text(plot_left - 8, y + 5, text, 12 * PT_TO_PX, AXIS_LABEL_COLOR, anchor="end")
+
+    return minimum, maximum
+
+
+def _draw_legend(canvas, box, entries, font_size=12 * PT_TO_PX):
+    left, top, width, height = box
+    entry_width = min(180, width / max(len(entries), 1))
+    start = left + (width - entry_width * len(entries)) / 2
+    y = top + height - LEGEND_HEIGHT / 2
+
+    for index, entry in enumerate(entries):
+        x = start + index * entry_width
+        canvas.rect(x, y - 6, 12, 12, _series_color(index))
+        canvas.text(x + 18, y + 5, str(entry), font_size, AXIS_LABEL_COLOR, anchor="start")
+
+
+# Helpers
+def _to_px(emu_box):
+    return tuple(value * EMU_TO_PX for value in emu_box)
+
+
+def _to_number(value) -> float:
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return 0.0
+    return 0.0 if math.isnan(number) else number
+
+
+def _series_color(index: int) -> str:
+    return SERIES_COLORS[index % len(SERIES_COLORS)]
+
+
+def _format_value(value: float, rounding_precision) -> str:
+    # Mirrors chart_factory._resolve_number_format
+    if rounding_precision is None:
+        return f"{value:.0f}" if float(value).is_integer() else f"{value:.1f}"
+
+    order_of_magnitude = rounding_precision.order_of_magnitude
+    divisor = 1 if order_of_magnitude < 3 else 1e3 if order_of_magnitude < 6 else 1e6 if order_of_magnitude < 9 \
+        else 1e9
+    decimals = 1 if rounding_precision.decimal_place != 0 else 0
+    return f"{value / divisor:.{decimals}f}"
+
+
+def _nice_ticks(minimum: float, maximum: float, count: int = 5) -> list[float]:
+    if maximum <= minimum:
+        maximum = minimum + 1
+    raw_step = (maximum - minimum) / count
+    magnitude = 10 ** math.floor(math.log10(raw_step))
+    step = next(multiple * magnitude for multiple in (1, 2, 2.5, 5, 10) if multiple * magnitude >= raw_step)
+    start = math.floor(minimum / step) * step
+    end = math.ceil(maximum / step) * step
+    return [start + index * step for index in range(int(round((end - start) / step)) + 1)]
+
+
+def _wrap_text(text: str, width: float, font_size: float) -> list[str]:
+    max_characters = max(int(width / (font_size * 0.55)), 1)
+    lines, line = [], ""
+    for word in text.split():
+        if line and len(line) + 1 + len(word) > max_characters:
+            lines.append(line)
+            line = word
+        else:
+            line = f"{line} {word}".strip()
+    return (lines + [line])[:2]
+
+
+def _hex(color) -> str:
+    return f"#{color}"
+
+
+# Output formats
+class _SvgCanvas:
+
+    def __init__(self):
+        self.elements = [f'<rect width="{WIDTH}" height="{HEIGHT}" fill="#FFFFFF"/>']
+
+    def rect(self, x, y, width, height, color):
+        self.elements.append(
+            f'<rect x="{x:.1f}" y="{y:.1f}" width="{max(width, 0):.1f}" height="{max(height, 0):.1f}" '
+            f'fill="{_hex(color)}"/>')
+
+    def line(self, x1, y1, x2, y2, color, width=1):
+        self.elements.append(
+            f'<line x1="{x1:.1f}" y1="{y1:.1f}" x2="{x2:.1f}" y2="{y2:.1f}" stroke="{_hex(color)}" '
+            f'stroke-width="{width}"/>')
+
+    def polyline(self, points, color, width=1):
+        coordinates = " ".join(f"{x:.1f},{y:.1f}" for x, y in points)
+        self.elements.append(
+            f'<polyline points="{coordinates}" fill="none" stroke="{_hex(color)}" stroke-width="{width}"/>')
+
+    def circle(self, x, y, radius, color):
+        self.elements.append(
+            f'<circle cx="{x:.1f}" cy="{y:.1f}" r="{radius:.1f}" fill="{_hex(color)}" fill-opacity="0.85"/>')
+
+    def wedge(self, x, y, radius, inner_radius, start_angle, end_angle, color):
+        if end_angle - start_angle >= 359.99:
+            self.circle(x, y, radius, color)
+            if inner_radius:
+                self.circle(x, y, inner_radius, WHITE)
+            return
+
+        def point(angle, distance):
+            return x + distance * math.cos(math.radians(angle)), y + distance * math.sin(math.radians(angle))
+
+        large_arc = 1 if end_angle - start_angle > 180 else 0
+        outer_start, outer_end = point(start_angle, radius), point(end_angle, radius)
+        inner_start, inner_end = point(end_angle, inner_radius), point(start_angle, inner_radius)
+        path = (f"M {outer_start[0]:.1f} {outer_start[1]:.1f} "
+                f"A {radius:.1f} {radius:.1f} 0 {large_arc} 1 {outer_end[0]:.1f} {outer_end[1]:.1f} "
+                f"L {inner_start[0]:.1f} {inner_start[1]:.1f} ")
+        if inner_radius:
+            path += f"A {inner_radius:.1f} {inner_radius:.1f} 0 {large_arc} 0 {inner_end[0]:.1f} {inner_end[1]:.1f} "
+        self.elements.append(f'<path d="{path}Z" fill="{_hex(color)}" stroke="#FFFFFF" stroke-width="1"/>')
+
+    def text(self, x, y, text, size, color, bold=False, anchor="middle"):
+        weight = ' font-weight="bold"' if bold else ""
+        self.elements.append(
+            f'<text x="{x:.1f}" y="{y:.1f}" font-family="Arial, DejaVu Sans, sans-serif" font-size="{size:.1f}" '
+            f'fill="{_hex(color)}" text-anchor="{anchor}"{weight}>{escape(str(text))}</text>')
+
+    def to_bytes(self) -> bytes:
+        return (f'<svg xmlns="http://www.w3.org/2000/svg" width="{WIDTH}" height="{HEIGHT}" '
+                f'viewBox="0 0 {WIDTH} {HEIGHT}">' + "".join(self.elements) + "</svg>").encode("utf-8")
+
+
+class _PngCanvas:
+    ANCHORS = {"start": "ls", "middle": "ms", "end": "rs"}
+
+    def __init__(self):
+        self.image = Image.new("RGB", (WIDTH, HEIGHT), "white")
+        self.draw = ImageDraw.Draw(self.image)
+
+    def rect(self, x, y, width, height, color):
+        if width > 0 and height > 0:
+            self.draw.rectangle([x, y, x + width, y + height], fill=_hex(color))
+
+    def line(self, x1, y1, x2, y2, color, width=1):
+        self.draw.line([x1, y1, x2, y2], fill=_hex(color), width=width)
+
+    def polyline(self, points, color, width=1):
+        if len(points) > 1:
+            self.draw.line(points, fill=_hex(color), width=width, joint="curve")
+
+    def circle(self, x, y, radius, color):
+        self.draw.ellipse([x - radius, y - radius, x + radius, y + radius], fill=_hex(color))
+
+    def wedge(self, x, y, radius, inner_radius, start_angle, end_angle, color):
+        self.draw.pieslice([x - radius, y - radius, x + radius, y + radius], start_angle, end_angle,
+                           fill=_hex(color), outline="white")
+        if inner_radius:
+            self.circle(x, y, inner_radius, WHITE)
+
+    def text(self, x, y, text, size, color, bold=False, anchor="middle"):
+        self.draw.text((x, y), str(text), fill=_hex(color), font=_font(round(size), bold),
+                       anchor=self.ANCHORS[anchor])
+
+    def to_bytes(self) -> bytes:
+        buffer = BytesIO()
+        self.image.save(buffer, format="PNG", optimize=False)
+        return buffer.getvalue()
+
+
+_fonts = {}
+
+
+def _font(size: int, bold: bool):
+    key = (size, bold)
+    if key not in _fonts:
+        try:
+            _fonts[key] = ImageFont.truetype("DejaVuSans-Bold.ttf" if bold else "DejaVuSans.ttf", size)
+        except OSError:
+            _fonts[key] = ImageFont.load_default(size=size)
+    return _fonts[key]
@@ -0,0 +1,130 @@
+# Opt-in sampling profiler for single requests. A background thread samples the stacks of the threads working for the
+# request and writes them as folded stacks (one "frame;frame;frame count" line per stack), the input format of
+# flamegraph.pl, speedscope and most other flame graph viewers.
+import functools
+import itertools
+import os
+import sys
+import threading
+from collections import Counter as StackCounter
+from contextvars import ContextVar
+from typing import Optional
+
+from prometheus_client import Counter
+
+# on: requests sending PROFILE_HEADER are profiled
+PROFILE_ON_HEADER = os.environ.get("PROFILE_ON_HEADER", "off")
+# Profiles every n-th deck request, 0 turns sampling off
+PROFILE_EVERY_N_REQUESTS = int(os.environ.get("PROFILE_EVERY_N_REQUESTS", "0"))
+PROFILE_INTERVAL_SECONDS = float(os.environ.get("PROFILE_INTERVAL_SECONDS", "0.005"))
+
+PROFILE_HEADER = "X-Profile"
+PROFILE_URL_HEADER = "X-Profile-Url"
+# Only requests that create a presentation are profiled, the profile is stored under its name
+PROFILED_PATH_PREFIX = "/powerpoint"
+PROFILE_SUFFIX = ".profile.txt"
+
+PROFILES = Counter("slideai_profiles_total", "Requests profiled", ["trigger"])
+
+
+class Profile:
+    def __init__(self):
+        # {thread id: number of profiled scopes the thread is in}
+        self.threads = {}
+        self.stacks = StackCounter()
+        self.presentation_name: Optional[str] = None
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.sampler = threading.Thread(target=self._sample, name="profiler", daemon=True)
+
+    def _sample(self):
+        while not self.stopped.wait(PROFILE_INTERVAL_SECONDS):
+            with self.lock:
+                thread_ids = list(self.threads)
+            frames = sys._current_frames()
+            for thread_id in thread_ids:
+                frame = frames.get(thread_id)
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                if stack:
+                    self.stacks[";".join(reversed(stack))] += 1
+
+
+_profile: ContextVar[Optional[Profile]] = ContextVar("profile", default=None)
+_request_counter = itertools.count(1)
+
+
+def start(method: str, path: str, headers) -> Optional[Profile]:
+    """Starts profiling the current request if the header asks for it or it is sampled, else returns None."""
+    if method != "POST" or not path.startswith(PROFILED_PATH_PREFIX):
+        return None
+
+    if PROFILE_ON_HEADER == "on" and headers.get(PROFILE_HEADER, "").lower() in ("1", "true", "on"):
+        trigger = "header"
+    elif PROFILE_EVERY_N_REQUESTS and next(_request_counter) % PROFILE_EVERY_N_REQUESTS == 0:
+        trigger = "sampled"
+    else:
+        return None
+
+    PROFILES.labels(trigger=trigger).inc()
+    profile = Profile()
+    _profile.set(profile)
+    profile.sampler.start()
+    return profile
+
+
+def stop(profile: Profile, directory: str = ".") -> Optional[str]:
+    """Stops sampling and writes the profile next to the presentation, returns its path or None if the request
+    created no presentation."""
+    profile.stopped.set()
+    profile.sampler.join()
+    if profile.presentation_name is None or not profile.stacks:
+        return None
+
+    path = os.path.join(directory, f"{profile.presentation_name}{PROFILE_SUFFIX}")
+    with open(path, "w") as profile_file:
+        for stack, count in profile.stacks.most_common():
+            profile_file.write(f"{stack} {count}\n")
+    return path
+
+
+def link_presentation(presentation_name: str):
+    """Stores the profile of the current request, if any, under the presentation's name."""
+    profile = _profile.get()
+    if profile is not None:
+        profile.presentation_name = presentation_name
+
+
+def enter_thread() -> Optional[Profile]:
+    """Samples the current thread until exit_thread, for work the request runs in worker threads."""
+    profile = _profile.get()
+    if profile is not None:
+        thread_id = threading.get_ident()
+        with profile.lock:
+            profile.threads[thread_id] = profile.threads.get(thread_id, 0) + 1
+    return profile
+
+
+def exit_thread(profile: Optional[Profile]):
+    if profile is not None:
+        thread_id = threading.get_ident()
+        with profile.lock:
+            profile.threads[thread_id] -= 1
+            if not profile.threads[thread_id]:
+                del profile.threads[thread_id]
+
+
+def profiled(function):
+    """Samples the threads running the function while the request calling it is profiled."""
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        profile = enter_thread()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            exit_thread(profile)
+
+    return wrapper
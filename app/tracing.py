@@ -0,0 +1,204 @@
+# Sampled LLM call tracing. Calls only put a small event on a bounded queue, a background thread serializes the
+# events and sends them to Langfuse in batches, so the tracer neither blocks nor grows with a slow Langfuse.
+import os
+import queue
+import threading
+import time
+import zlib
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Optional, Callable
+
+from prometheus_client import Counter, Gauge, Histogram
+
+import metrics
+
+# on by default once Langfuse is configured
+LLM_TRACING = os.environ.get("LLM_TRACING", "on" if os.environ.get("LANGFUSE_PUBLIC_KEY") else "off")
+# Share of requests whose LLM calls are traced, all calls of one request are sampled together
+LLM_TRACE_SAMPLE_RATE = float(os.environ.get("LLM_TRACE_SAMPLE_RATE", "1"))
+# Events hold the prompt, which includes the table, the queue bounds the memory they take while Langfuse is slow
+LLM_TRACE_QUEUE_SIZE = int(os.environ.get("LLM_TRACE_QUEUE_SIZE", "200"))
+LLM_TRACE_BATCH_SIZE = int(os.environ.get("LLM_TRACE_BATCH_SIZE", "50"))
+LLM_TRACE_FLUSH_INTERVAL_SECONDS = float(os.environ.get("LLM_TRACE_FLUSH_INTERVAL", "2"))
+
+# sampled_out: not traced, queued: handed to the exporter, dropped: the queue was full,
+# exported: sent to Langfuse, failed: the export raised
+TRACE_EVENTS = Counter("slideai_trace_events_total", "LLM trace events by outcome", ["outcome"])
+TRACE_QUEUE_DEPTH = Gauge("slideai_trace_queue_depth", "LLM trace events waiting for export")
+TRACE_EXPORT_DURATION = Histogram(
+    "slideai_trace_export_duration_seconds",
+    "Duration of exporting one batch of LLM trace events",
+    buckets=metrics.STAGE_BUCKETS
+)
+
+
+@dataclass
+class GenerationEvent:
+    trace_id: Optional[str]
+    name: Optional[str]
+    model: str
+    message: str
+    # The parsed answer, it is only serialized by the exporter
+    output: object
+    prompt_tokens: Optional[int]
+    completion_tokens: Optional[int]
+    start_time: datetime
+    end_time: datetime
+    error: Optional[str] = None
+
+
+_queue: Optional[queue.Queue] = None
+_exporter: Optional[Callable[[list[GenerationEvent]], None]] = None
+_thread: Optional[threading.Thread] = None
+_stopping = threading.Event()
+_lock = threading.Lock()
+
+
+def is_enabled() -> bool:
+    return LLM_TRACING == "on"
+
+
+def is_sampled(trace_id: Optional[str]) -> bool:
+    if LLM_TRACE_SAMPLE_RATE >= 1:
+        return True
+    if LLM_TRACE_SAMPLE_RATE <= 0:
+        return False
+    # Hashing the trace id instead of drawing per call keeps a request's calls together in one trace
+    return zlib.crc32((trace_id or "").encode("utf-8")) / 2 ** 32 < LLM_TRACE_SAMPLE_RATE
+
+
+def record_generation(trace_id: Optional[str], name: Optional[str], model: str, message: str, output, usage,
+                      start_time: datetime, error: Optional[str] = None):
+    """Queues one LLM call for export, never blocks the calling thread."""
+    if not is_enabled():
+        return
+    if not is_sampled(trace_id):
+        TRACE_EVENTS.labels(outcome="sampled_out").inc()
+        return
+
+    if _thread is None:
+        start()
+
+    event = GenerationEvent(
+        trace_id=trace_id,
+        name=name,
+        model=model,
+        message=message,
+        output=output,
+        prompt_tokens=getattr(usage, "prompt_tokens", None),
+        completion_tokens=getattr(usage, "completion_tokens", None),
+        start_time=start_time,
+        end_time=datetime.now(timezone.utc),
+        error=error
+    )
+    try:
+        _queue.put_nowait(event)
+    except queue.Full:
+        TRACE_EVENTS.labels(outcome="dropped").inc()
+        return
+    TRACE_EVENTS.labels(outcome="queued").inc()
+    TRACE_QUEUE_DEPTH.set(_queue.qsize())
+
+
+def start(exporter: Callable[[list[GenerationEvent]], None] = None, queue_size: int = None):
+    """Starts the export thread, by default exporting to Langfuse. Does nothing while tracing is off."""
+    global _queue, _exporter, _thread
+    if not is_enabled():
+        return
+
+    with _lock:
+        if _thread is not None:
+            return
+        _queue = queue.Queue(maxsize=queue_size or LLM_TRACE_QUEUE_SIZE)
+        _exporter = exporter or _langfuse_exporter()
+        _stopping.clear()
+        _thread = threading.Thread(target=_export_loop, name="trace_export", daemon=True)
+        _thread.start()
+
+
+def stop(timeout_seconds: float = 10):
+    """Exports the queued events and stops the export thread."""
+    global _thread
+    with _lock:
+        thread = _thread
+        _thread = None
+    if thread is None:
+        return
+    _stopping.set()
+    thread.join(timeout_seconds)
+    if thread.is_alive():
+        print(f"Trace export did not finish within {timeout_seconds}s, {_queue.qsize()} events were lost")
+
+
+def _next_batch() -> list[GenerationEvent]:
+    # Waits until a batch is full or the flush interval has passed since its first event
+    batch = []
+    deadline = None
+    while len(batch) < LLM_TRACE_BATCH_SIZE:
+        timeout = LLM_TRACE_FLUSH_INTERVAL_SECONDS if deadline is None else deadline - time.monotonic()
+        if _stopping.is_set():
+            timeout = 0
+        try:
+            batch.append(_queue.get(timeout=max(timeout, 0)) if timeout > 0 else _queue.get_nowait())
+        except queue.Empty:
+            if batch or _stopping.is_set():
+                break
+            continue
+        if deadline is None:
+            deadline = time.monotonic() + LLM_TRACE_FLUSH_INTERVAL_SECONDS
+    return batch
+
+
+def _export_loop():
+    while True:
+        batch = _next_batch()
+        TRACE_QUEUE_DEPTH.set(_queue.qsize())
+        if not batch:
+            if _stopping.is_set():
+                return
+            continue
+
+        start_time = time.perf_counter()
+        try:
+            _exporter(batch)
+            TRACE_EVENTS.labels(outcome="exported").inc(len(batch))
+        except Exception as e:
+            TRACE_EVENTS.labels(outcome="failed").inc(len(batch))
+            print(f"Error exporting {len(batch)} trace events: {e}")
+        TRACE_EXPORT_DURATION.observe(time.perf_counter() - start_time)
+
+
+def _langfuse_exporter() -> Callable[[list[GenerationEvent]], None]:
+    from langfuse import Langfuse
+
+    # The SDK's own batching is replaced by flushing once per batch of ours
+    langfuse = Langfuse(flush_at=LLM_TRACE_BATCH_SIZE, flush_interval=LLM_TRACE_FLUSH_INTERVAL_SECONDS)
+
+    def export(batch: list[GenerationEvent]):
+        for event in batch:
+            langfuse.generation(
+                trace_id=event.trace_id,
+                name=event.name,
+                model=event.model,
+                input=[{"role": "user", "content": event.message}],
+                output=_serialize_output(event.output),
+                usage_details=_usage_details(event),
+                start_time=event.start_time,
+                end_time=event.end_time,
+                level="ERROR" if event.error else "DEFAULT",
+                status_message=event.error
+            )
+        langfuse.flush()
+
+    return export
+
+
+def _serialize_output(output):
+    return output.model_dump(mode="json") if hasattr(output, "model_dump") else output
+
+
+def _usage_details(event: GenerationEvent) -> Optional[dict]:
+    if event.prompt_tokens is None:
+        return None
+    return {"input": event.prompt_tokens, "output": event.completion_tokens or 0}
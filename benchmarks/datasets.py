@@ -0,0 +1,150 @@
+# Synthetic datasets for the pipeline benchmark, each paired with the answers a well-behaved LLM would give
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+from models import SelectedChartType, TwoColumnDataStructure, MultiColumnDataStructure, LongFormatDataStructure, \
+    BubbleChartDataStructure, ChartType
+
+SHAPES = ["two_column", "wide", "long", "bubble"]
+
+NUMBER_OF_CATEGORIES = 12
+NUMBER_OF_SERIES = 6
+
+
+@dataclass
+class Dataset:
+    shape: str
+    rows: int
+    dataframe: pd.DataFrame
+    chart_core_message: str
+    answers: dict
+
+
+def generate_dataset(shape: str, rows: int, seed: int = 0) -> Dataset:
+    random = np.random.default_rng(seed)
+
+    match shape:
+        case "two_column":
+            return _two_column(rows, random)
+        case "wide":
+            return _wide(rows, random)
+        case "long":
+            return _long(rows, random)
+        case "bubble":
+            return _bubble(rows, random)
+        case _:
+            raise ValueError(f"Unknown dataset shape '{shape}'")
+
+
+def _categories(rows: int, count: int = NUMBER_OF_CATEGORIES) -> np.ndarray:
+    names = np.array([f"Market {index + 1}" for index in range(count)])
+    return names[np.arange(rows) % count]
+
+
+def _two_column(rows, random) -> Dataset:
+    dataframe = pd.DataFrame({
+        "Market": _categories(rows),
+        "Units sold": random.integers(100, 10_000, rows),
+    })
+
+    return Dataset("two_column", rows, dataframe, "Market 3 sells the most units", {
+        SelectedChartType: SelectedChartType(
+            reason_for_selected_chart_types="benchmark",
+            chart_types=[ChartType.COLUMN.value, ChartType.PIE.value],
+            is_in_long_format=False,
+            last_line_includes_sum=False
+        ),
+        TwoColumnDataStructure: TwoColumnDataStructure(
+            category="Market",
+            value="Units sold",
+            axis_label="Units sold",
+            axis_unit="none",
+            has_natural_sorting_order=False
+        ),
+    })
+
+
+def _wide(rows, random) -> Dataset:
+    series = [f"Product {index + 1}" for index in range(NUMBER_OF_SERIES)]
+    dataframe = pd.DataFrame({"Region": _categories(rows)})
+    for column in series:
+        dataframe[column] = random.uniform(1_000, 1_000_000, rows).round(2)
+
+    return Dataset("wide", rows, dataframe, "Product 1 leads in every region", {
+        SelectedChartType: SelectedChartType(
+            reason_for_selected_chart_types="benchmark",
+            chart_types=[ChartType.COLUMN_CLUSTERED.value, ChartType.COLUMN_STACKED.value,
+                         ChartType.COLUMN_STACKED_100.value, ChartType.LINE.value],
+            is_in_long_format=False,
+            last_line_includes_sum=False
+        ),
+        MultiColumnDataStructure: MultiColumnDataStructure(
+            category="Region",
+            series=series,
+            axis_label="Revenue",
+            axis_unit="EUR",
+            has_natural_sorting_order=False
+        ),
+    })
+
+
+def _long(rows, random) -> Dataset:
+    # One row per (period, country) pair so that df.pivot finds unique keys, and only complete periods
+    # because missing pairs would turn into NaN values that the chart workbook cannot store
+    countries = np.array([f"Country {index + 1}" for index in range(NUMBER_OF_SERIES)])
+    rows = max(rows // len(countries), 1) * len(countries)
+    dataframe = pd.DataFrame({
+        "Period": np.arange(rows) // len(countries) + 2000,
+        "Country": countries[np.arange(rows) % len(countries)],
+        "GDP": random.uniform(1e9, 5e12, rows),
+    })
+
+    return Dataset("long", rows, dataframe, "Country 1 grows fastest", {
+        SelectedChartType: SelectedChartType(
+            reason_for_selected_chart_types="benchmark",
+            chart_types=[ChartType.COLUMN_CLUSTERED.value, ChartType.LINE.value],
+            is_in_long_format=True,
+            last_line_includes_sum=False
+        ),
+        LongFormatDataStructure: LongFormatDataStructure(
+            explain_column_selection="benchmark",
+            index="Period",
+            columns="Country",
+            values="GDP",
+            title="GDP",
+            unit="USD",
+            has_natural_sorting_order=True
+        ),
+    })
+
+
+def _bubble(rows, random) -> Dataset:
+    dataframe = pd.DataFrame({
+        "Market": [f"Market {index + 1}" for index in range(rows)],
+        "Market share": random.uniform(0, 0.5, rows),
+        "Market growth": random.uniform(-0.1, 0.3, rows),
+        "Market size": random.uniform(1e6, 1e9, rows),
+    })
+
+    return Dataset("bubble", rows, dataframe, "Our biggest markets grow fastest", {
+        SelectedChartType: SelectedChartType(
+            reason_for_selected_chart_types="benchmark",
+            chart_types=[ChartType.BUBBLE.value],
+            is_in_long_format=False,
+            last_line_includes_sum=False
+        ),
+        BubbleChartDataStructure: BubbleChartDataStructure(
+            labels_column="Market",
+            x_axis_column="Market share",
+            x_axis_title="Market share (%)",
+            x_axis_is_percentage=True,
+            y_axis_column="Market growth",
+            y_axis_title="Market growth (%)",
+            y_axis_is_percentage=True,
+            bubble_size_column="Market size",
+            bubble_size_title="Market size in EUR",
+            title="Market portfolio"
+        ),
+    })
@@ -0,0 +1,29 @@
+# Deterministic stand-in for the OpenAI client used by openai_adapter
+import random
+import time
+from types import SimpleNamespace
+
+
+class FakeOpenAIClient:
+    """Mimics client.beta.chat.completions.parse and answers from a {response_model: answer} mapping."""
+
+    def __init__(self, latency_seconds: float = 0.0, jitter_seconds: float = 0.0, seed: int = 0):
+        self.latency_seconds = latency_seconds
+        self.jitter_seconds = jitter_seconds
+        self.answers = {}
+        self.calls = 0
+        self._random = random.Random(seed)
+        self.beta = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(parse=self.parse)))
+
+    def parse(self, model, messages, response_format, **kwargs):
+        self.calls += 1
+
+        latency = self.latency_seconds + self._random.uniform(0, self.jitter_seconds)
+        if latency > 0:
+            time.sleep(latency)
+
+        if response_format not in self.answers:
+            raise Exception(f"No fake answer configured for {response_format.__name__}")
+
+        parsed = self.answers[response_format].model_copy(deep=True)
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(parsed=parsed))])
@@ -0,0 +1,150 @@
+"""
+Local HTTP stand-in for the OpenAI chat completions API with configurable latency, tail latency and errors.
+
+Answers come from a {response model name: answer} mapping and are picked by the json_schema name of the request's
+response_format, so the real openai client (and its parsing) runs unchanged against it:
+
+    python benchmarks/fake_openai_server.py --port 8100 --latency 0.5 --tail-rate 0.05 --tail-latency 8
+    OPENAI_BASE_URL=http://localhost:8100/v1 OPENAI_API_KEY=fake fastapi run app/main.py
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from dataclasses import dataclass
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+
+@dataclass
+class FakeServerSettings:
+    latency_seconds: float = 0.0
+    # Share of requests that take tail_latency_seconds instead
+    tail_rate: float = 0.0
+    tail_latency_seconds: float = 0.0
+    # Share of requests answered with error_status
+    error_rate: float = 0.0
+    error_status: int = 503
+    seed: int = 0
+
+
+class FakeOpenAIServer:
+
+    def __init__(self, answers: dict, settings: FakeServerSettings = None, port: int = 0):
+        self.answers = answers
+        self.settings = settings or FakeServerSettings()
+        self.requests = 0
+        self._random = random.Random(self.settings.seed)
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", port), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self._server.server_address[1]}/v1"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _next_behaviour(self) -> tuple[float, bool]:
+        with self._lock:
+            self.requests += 1
+            is_error = self._random.random() < self.settings.error_rate
+            is_tail = self._random.random() < self.settings.tail_rate
+        latency = self.settings.tail_latency_seconds if is_tail else self.settings.latency_seconds
+        return latency, is_error
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                # GET /v1/models, used by the connection warm-up
+                self._send(200, {"object": "list", "data": []})
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers.get("content-length", 0))))
+                latency, is_error = server._next_behaviour()
+                if latency > 0:
+                    time.sleep(latency)
+
+                if is_error:
+                    self._send(server.settings.error_status, {"error": {"message": "Injected error", "type": "fake"}})
+                    return
+
+                schema_name = body.get("response_format", {}).get("json_schema", {}).get("name")
+                if schema_name not in server.answers:
+                    self._send(400, {"error": {"message": f"No fake answer for {schema_name}", "type": "fake"}})
+                    return
+
+                content = json.dumps(server.answers[schema_name])
+                prompt_tokens = sum(len(message.get("content", "")) for message in body.get("messages", [])) // 4
+                self._send(200, {
+                    "id": f"chatcmpl-fake-{server.requests}",
+                    "object": "chat.completion",
+                    "created": int(time.time()),
+                    "model": body.get("model"),
+                    "choices": [{
+                        "index": 0,
+                        "message": {"role": "assistant", "content": content, "refusal": None},
+                        "finish_reason": "stop",
+                        "logprobs": None,
+                    }],
+                    "usage": {
+                        "prompt_tokens": prompt_tokens,
+                        "completion_tokens": len(content) // 4,
+                        "total_tokens": prompt_tokens + len(content) // 4,
+                    },
+                })
+
+            def _send(self, status: int, payload: dict):
+                encoded = json.dumps(payload).encode("utf-8")
+                try:
+                    self.send_response(status)
+                    self.send_header("Content-Type", "application/json")
+                    self.send_header("Content-Length", str(len(encoded)))
+                    self.end_headers()
+                    self.wfile.write(encoded)
+                except (BrokenPipeError, ConnectionResetError):
+                    # The client gave up, e.g. after its timeout or when a hedged duplicate won
+                    pass
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+def main():
+    from datasets import SHAPES, generate_dataset
+
+    parser = argparse.ArgumentParser(description="Local fake of the OpenAI chat completions API")
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--shape", default="two_column", choices=SHAPES, help="Dataset whose answers are served")
+    parser.add_argument("--latency", type=float, default=0.5)
+    parser.add_argument("--tail-rate", type=float, default=0.0)
+    parser.add_argument("--tail-latency", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--error-status", type=int, default=503)
+    arguments = parser.parse_args()
+
+    answers = {response_model.__name__: answer.model_dump(mode="json")
+               for response_model, answer in generate_dataset(arguments.shape, 10).answers.items()}
+    settings = FakeServerSettings(arguments.latency, arguments.tail_rate, arguments.tail_latency,
+                                  arguments.error_rate, arguments.error_status)
+    server = FakeOpenAIServer(answers, settings, arguments.port)
+    print(f"Serving fake OpenAI answers for '{arguments.shape}' on {server.base_url}")
+    server._server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,267 @@
+"""
+Concurrent load test of the FastAPI endpoints.
+
+Every virtual user repeatedly runs one session: POST /validate-data, POST /powerpoint, GET /pdf/{name} and
+GET /powerpoint/{name}. LLM answers come from a replay cassette, PDF conversion is stubbed and Drive uploads go to a
+local folder, so the test runs without network access. The concurrency sweep reports throughput, error rates and
+tail latency per level and the knee after which more users no longer add throughput.
+
+In-process (default), the app is driven through httpx's ASGI transport:
+
+    python benchmarks/load_test.py --concurrency 1 2 4 8 16 --duration 30 --llm-latency 1.5
+
+Over localhost, record the cassette first and start the server in replay mode:
+
+    python benchmarks/load_test.py --record-cassette /tmp/cassette.jsonl
+    LLM_TRANSPORT=replay LLM_CASSETTE_PATH=/tmp/cassette.jsonl LLM_REPLAY_LATENCY=1.5 PDF_CONVERTER=stub \\
+        ARTIFACT_STORAGE=local fastapi run app/main.py --port 8000
+    python benchmarks/load_test.py --url http://localhost:8000 --cassette /tmp/cassette.jsonl
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import sys
+import tempfile
+import time
+from io import StringIO
+
+import httpx
+import numpy as np
+import pandas as pd
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+APP_DIR = os.path.join(os.path.dirname(BENCHMARK_DIR), "app")
+RESULTS_DIR = os.path.join(BENCHMARK_DIR, "results")
+
+sys.path.insert(0, APP_DIR)
+WORK_DIR = tempfile.mkdtemp(prefix="slideai_load_")
+os.environ.setdefault("OPENAI_API_KEY", "load-test")
+os.environ.setdefault("PDF_CONVERTER", "stub")
+os.environ.setdefault("ARTIFACT_STORAGE", "local")
+os.environ.setdefault("LOCAL_STORAGE_DIR", os.path.join(WORK_DIR, "storage"))
+
+import openai_adapter  # noqa: E402
+import ppt_service  # noqa: E402
+from datasets import SHAPES, generate_dataset  # noqa: E402
+from fake_llm import FakeOpenAIClient  # noqa: E402
+
+ENDPOINTS = ["validate-data", "powerpoint", "pdf", "powerpoint-download"]
+
+# A level counts as the knee when it adds less than this much throughput over the previous level
+KNEE_THRESHOLD = 1.1
+
+
+def build_payloads(shapes: list[str], rows: int) -> list[dict]:
+    payloads = []
+    for shape in shapes:
+        dataset = generate_dataset(shape, rows)
+        payloads.append({
+            "shape": shape,
+            "data": dataset.dataframe.to_json(),
+            "chart_core_message": dataset.chart_core_message,
+            "answers": dataset.answers,
+        })
+    return payloads
+
+
+def record_cassette(payloads: list[dict], cassette_path: str):
+    """Runs the pipeline once per payload against the fake LLM and records every answer."""
+    fake_client = FakeOpenAIClient()
+    openai_adapter.client = fake_client
+    openai_adapter.set_transport(openai_adapter.RecordingTransport(cassette_path))
+
+    if os.path.exists(cassette_path):
+        os.remove(cassette_path)
+
+    for payload in payloads:
+        fake_client.answers = payload["answers"]
+        # Parse exactly like /powerpoint does so that the recorded prompts match the replayed ones
+        df = pd.read_json(StringIO(payload["data"]))
+        response = ppt_service.create_chart(df, {}, payload["chart_core_message"], "cassette")
+        for extension in ("pptx", "pdf"):
+            path = f"{response.presentation_name}.{extension}"
+            if os.path.exists(path):
+                os.remove(path)
+
+
+async def run_session(client: httpx.AsyncClient, payload: dict, attempts: dict, latencies: dict, errors: dict):
+    async def timed(endpoint, request):
+        attempts[endpoint] += 1
+        start = time.perf_counter()
+        try:
+            response = await request
+        except Exception as exception:
+            errors[endpoint].append(type(exception).__name__)
+            return None
+        latencies[endpoint].append(time.perf_counter() - start)
+        if response.status_code >= 400:
+            errors[endpoint].append(str(response.status_code))
+            return None
+        return response
+
+    await timed("validate-data", client.post("/validate-data", json={"data": payload["data"]}))
+
+    response = await timed("powerpoint", client.post("/powerpoint", data={
+        "data": payload["data"],
+        "chart_core_message": payload["chart_core_message"],
+    }))
+    if response is None:
+        return False
+
+    presentation_name = response.json()["presentation_name"]
+    await timed("pdf", client.get(f"/pdf/{presentation_name}"))
+    await timed("powerpoint-download", client.get(f"/powerpoint/{presentation_name}"))
+    return True
+
+
+async def run_level(client: httpx.AsyncClient, payloads: list[dict], concurrency: int, duration: float) -> dict:
+    attempts = {endpoint: 0 for endpoint in ENDPOINTS}
+    latencies = {endpoint: [] for endpoint in ENDPOINTS}
+    errors = {endpoint: [] for endpoint in ENDPOINTS}
+    completed_sessions = 0
+    deadline = time.perf_counter() + duration
+
+    async def virtual_user(user_index: int):
+        nonlocal completed_sessions
+        session_index = user_index
+        while time.perf_counter() < deadline:
+            if await run_session(client, payloads[session_index % len(payloads)], attempts, latencies, errors):
+                completed_sessions += 1
+            session_index += concurrency
+
+    start = time.perf_counter()
+    await asyncio.gather(*(virtual_user(index) for index in range(concurrency)))
+    elapsed = time.perf_counter() - start
+
+    requests = sum(attempts.values())
+    failed = sum(len(values) for values in errors.values())
+
+    return {
+        "concurrency": concurrency,
+        "elapsed_seconds": elapsed,
+        "sessions": completed_sessions,
+        "sessions_per_second": completed_sessions / elapsed,
+        "requests": requests,
+        "error_rate": failed / requests if requests else 0,
+        "endpoints": {
+            endpoint: {
+                **_summarize(latencies[endpoint]),
+                "errors": len(errors[endpoint]),
+                "error_kinds": sorted(set(errors[endpoint])),
+            }
+            for endpoint in ENDPOINTS
+        },
+    }
+
+
+def _summarize(durations: list[float]) -> dict:
+    if not durations:
+        return {"count": 0}
+
+    values = np.array(durations)
+    return {
+        "count": len(durations),
+        "p50": float(np.percentile(values, 50)),
+        "p95": float(np.percentile(values, 95)),
+        "p99": float(np.percentile(values, 99)),
+        "max": float(values.max()),
+    }
+
+
+def find_knee(levels: list[dict]):
+    for previous, current in zip(levels, levels[1:]):
+        if current["sessions_per_second"] < previous["sessions_per_second"] * KNEE_THRESHOLD:
+            return previous["concurrency"]
+    return None
+
+
+def print_report(levels: list[dict], knee):
+    print(f"{'users':>6}{'sessions/s':>12}{'errors':>9}{'ppt p50':>10}{'ppt p95':>10}{'ppt p99':>10}"
+          f"{'pdf p95':>10}")
+    for level in levels:
+        powerpoint = level["endpoints"]["powerpoint"]
+        pdf = level["endpoints"]["pdf"]
+        print(f"{level['concurrency']:>6}{level['sessions_per_second']:>12.2f}{level['error_rate']:>9.1%}"
+              f"{powerpoint.get('p50', float('nan')):>9.2f}s{powerpoint.get('p95', float('nan')):>9.2f}s"
+              f"{powerpoint.get('p99', float('nan')):>9.2f}s{pdf.get('p95', float('nan')):>9.2f}s")
+
+    if knee is None:
+        print("\nThroughput still grew at the highest concurrency level, no knee found")
+    else:
+        print(f"\nThroughput knee at {knee} concurrent users")
+
+
+async def run_sweep(arguments, payloads: list[dict]) -> list[dict]:
+    timeout = httpx.Timeout(arguments.timeout)
+
+    if arguments.url:
+        client = httpx.AsyncClient(base_url=arguments.url, timeout=timeout)
+    else:
+        import main
+        client = httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://load-test",
+                                   timeout=timeout)
+
+    levels = []
+    async with client:
+        for concurrency in arguments.concurrency:
+            print(f"Running {concurrency} concurrent users for {arguments.duration}s ...", flush=True)
+            levels.append(await run_level(client, payloads, concurrency, arguments.duration))
+    return levels
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent load test of the FastAPI endpoints")
+    parser.add_argument("--url", help="Base URL of a running server, the app runs in-process if omitted")
+    parser.add_argument("--concurrency", nargs="+", type=int, default=[1, 2, 4, 8, 16])
+    parser.add_argument("--duration", type=float, default=20, help="Seconds per concurrency level")
+    parser.add_argument("--shapes", nargs="+", default=SHAPES, choices=SHAPES)
+    parser.add_argument("--rows", type=int, default=50)
+    parser.add_argument("--cassette", default=os.path.join(WORK_DIR, "cassette.jsonl"))
+    parser.add_argument("--record-cassette", metavar="PATH", help="Only record the cassette to PATH and exit")
+    parser.add_argument("--llm-latency", default="1.0", help="Replayed seconds per LLM call")
+    parser.add_argument("--llm-error-rate", type=float, default=0.0)
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--output", help="Where to write the JSON results")
+    arguments = parser.parse_args()
+
+    payloads = build_payloads(arguments.shapes, arguments.rows)
+    cassette_path = os.path.abspath(arguments.cassette)
+
+    # The app writes its artifacts to the working directory
+    working_directory = os.getcwd()
+    os.chdir(WORK_DIR)
+    try:
+        if arguments.record_cassette:
+            record_cassette(payloads, os.path.abspath(os.path.join(working_directory, arguments.record_cassette)))
+            return
+
+        if not arguments.url:
+            record_cassette(payloads, cassette_path)
+            openai_adapter.set_transport(openai_adapter.ReplayTransport(
+                cassette_path, arguments.llm_latency, arguments.llm_error_rate
+            ))
+
+        levels = asyncio.run(run_sweep(arguments, payloads))
+    finally:
+        os.chdir(working_directory)
+
+    knee = find_knee(levels)
+    print_report(levels, knee)
+
+    created_at = datetime.datetime.now()
+    output = arguments.output or os.path.join(RESULTS_DIR, f"load_{created_at.strftime('%Y-%m-%d_%H-%M-%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as output_file:
+        json.dump({
+            "created_at": created_at.isoformat(timespec="seconds"),
+            "settings": vars(arguments),
+            "knee_concurrency": knee,
+            "levels": levels,
+        }, output_file, indent=2)
+    print(f"Results written to {output}")
+
+
+if __name__ == "__main__":
+    main()
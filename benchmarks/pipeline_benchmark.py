@@ -0,0 +1,299 @@
+"""
+Offline end-to-end benchmark of the deck generation pipeline.
+
+Runs JSON ingestion and ppt_service.create_chart against synthetic datasets while a deterministic fake
+replaces the OpenAI client, so no network access or API key is needed.
+
+    python benchmarks/pipeline_benchmark.py --rows 10 1000 100000 --llm-latency 0.5
+    python benchmarks/pipeline_benchmark.py --compare benchmarks/results/<earlier run>.json
+
+Peak memory is measured per stage in a separate run. Budgets and a growth limit against an earlier run turn it into
+assertions, the benchmark exits with status 1 when one is exceeded:
+
+    python benchmarks/pipeline_benchmark.py --memory-budget total=200 prepare_data=50 create_bubble_chart=20
+    python benchmarks/pipeline_benchmark.py --compare benchmarks/results/<earlier run>.json --max-memory-growth 0.2
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+import uuid
+from io import StringIO
+
+import numpy as np
+import pandas as pd
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+APP_DIR = os.path.join(os.path.dirname(BENCHMARK_DIR), "app")
+RESULTS_DIR = os.path.join(BENCHMARK_DIR, "results")
+
+sys.path.insert(0, APP_DIR)
+os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+if "--convert-pdf" not in sys.argv:
+    os.environ["PDF_CONVERTER"] = "stub"
+
+import metrics  # noqa: E402
+import openai_adapter  # noqa: E402
+import ppt_service  # noqa: E402
+from datasets import SHAPES, generate_dataset  # noqa: E402
+from fake_llm import FakeOpenAIClient  # noqa: E402
+
+# Growth below this is noise and never fails --max-memory-growth, small stages vary by a few allocator pages
+MEMORY_GROWTH_FLOOR_BYTES = 1024 * 1024
+
+
+def run_scenario(shape: str, rows: int, iterations: int, warmup: int, fake_client: FakeOpenAIClient,
+                 memory_mode: str = "tracemalloc") -> dict:
+    dataset = generate_dataset(shape, rows)
+    payload = dataset.dataframe.to_json()
+    fake_client.answers = dataset.answers
+    calls_before = fake_client.calls
+
+    def run_once():
+        metrics.start_request()
+        start = time.perf_counter()
+        with metrics.stage("read_json"):
+            df = pd.read_json(StringIO(payload))
+        response = ppt_service.create_chart(
+            df=df,
+            header_cell_formats={},
+            chart_core_message=dataset.chart_core_message,
+            uuid=uuid.uuid4().hex
+        )
+        duration = time.perf_counter() - start
+        _remove_artifacts(response.presentation_name)
+        return duration, metrics.get_stage_timings()
+
+    errors = []
+    for _ in range(warmup):
+        try:
+            run_once()
+        except Exception as exception:
+            errors.append(str(exception))
+
+    totals = []
+    stages = {}
+    for _ in range(iterations):
+        try:
+            duration, stage_timings = run_once()
+        except Exception as exception:
+            errors.append(str(exception))
+            continue
+
+        totals.append(duration)
+        per_iteration = {}
+        for name, stage_duration in stage_timings:
+            per_iteration[name] = per_iteration.get(name, 0) + stage_duration
+        for name, stage_duration in per_iteration.items():
+            stages.setdefault(name, []).append(stage_duration)
+
+    # Memory is measured in a separate run so tracemalloc and the sampling do not distort the timings
+    peak_memory_bytes = None
+    stage_memory = {}
+    metrics.STAGE_MEMORY = memory_mode
+    try:
+        memory_record = metrics.start_memory_record()
+        run_once()
+        peak_memory_bytes, _ = metrics.finish_memory_record(memory_record)
+        for name, peak, net in metrics.get_stage_memory():
+            summary = stage_memory.setdefault(name, {"peak": 0, "net": 0})
+            summary["peak"] = max(summary["peak"], peak)
+            summary["net"] += net
+    except Exception as exception:
+        errors.append(str(exception))
+    finally:
+        metrics.STAGE_MEMORY = "off"
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+    return {
+        "shape": shape,
+        "rows": rows,
+        "iterations": len(totals),
+        "errors": len(errors),
+        "error_messages": sorted(set(errors))[:5],
+        "total": _summarize(totals),
+        "stages": {name: _summarize(durations) for name, durations in stages.items()},
+        "decks_per_second": len(totals) / sum(totals) if totals else 0,
+        "peak_memory_bytes": peak_memory_bytes,
+        "stage_memory": stage_memory,
+        "llm_calls_per_deck": (fake_client.calls - calls_before) / max(iterations + warmup + 1, 1),
+    }
+
+
+def _summarize(durations: list[float]) -> dict:
+    if not durations:
+        return {}
+
+    values = np.array(durations)
+    return {
+        "mean": float(values.mean()),
+        "p50": float(np.percentile(values, 50)),
+        "p95": float(np.percentile(values, 95)),
+        "p99": float(np.percentile(values, 99)),
+        "max": float(values.max()),
+    }
+
+
+def _remove_artifacts(presentation_name: str):
+    for extension in ("pptx", "pdf"):
+        path = f"{presentation_name}.{extension}"
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def print_report(results: dict):
+    print(f"{'shape':<12}{'rows':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'decks/s':>10}{'peak MB':>10}"
+          f"{'errors':>8}")
+    for scenario in results["scenarios"]:
+        total = scenario["total"]
+        peak = scenario["peak_memory_bytes"]
+        print(f"{scenario['shape']:<12}{scenario['rows']:>10}"
+              f"{total.get('p50', float('nan')) * 1000:>10.1f}{total.get('p95', float('nan')) * 1000:>10.1f}"
+              f"{total.get('p99', float('nan')) * 1000:>10.1f}{scenario['decks_per_second']:>10.2f}"
+              f"{(peak or 0) / 1e6:>10.1f}{scenario['errors']:>8}")
+
+        slowest = sorted(scenario["stages"].items(), key=lambda item: item[1]["p50"], reverse=True)[:5]
+        for name, summary in slowest:
+            print(f"    {name:<40}{summary['p50'] * 1000:>10.1f} ms p50")
+
+        largest = sorted(scenario.get("stage_memory", {}).items(), key=lambda item: item[1]["peak"], reverse=True)[:5]
+        for name, memory in largest:
+            print(f"    {name:<40}{memory['peak'] / 1e6:>10.1f} MB peak{memory['net'] / 1e6:>10.1f} MB net")
+
+
+def print_comparison(baseline: dict, results: dict):
+    baseline_scenarios = {(scenario["shape"], scenario["rows"]): scenario for scenario in baseline["scenarios"]}
+
+    print(f"\nCompared to run from {baseline['created_at']}:")
+    for scenario in results["scenarios"]:
+        previous = baseline_scenarios.get((scenario["shape"], scenario["rows"]))
+        if not previous or not previous["total"] or not scenario["total"]:
+            continue
+        for key in ("p50", "p95"):
+            change = scenario["total"][key] / previous["total"][key] - 1
+            print(f"{scenario['shape']:<12}{scenario['rows']:>10} {key}: "
+                  f"{previous['total'][key] * 1000:.1f} ms -> {scenario['total'][key] * 1000:.1f} ms "
+                  f"({change:+.1%})")
+
+
+def _scenario_memory(scenario: dict) -> dict:
+    # {stage: peak bytes}, the whole deck is the "total" stage
+    memory = {name: summary["peak"] for name, summary in scenario.get("stage_memory", {}).items()}
+    if scenario["peak_memory_bytes"] is not None:
+        memory["total"] = scenario["peak_memory_bytes"]
+    return memory
+
+
+def check_memory(results: dict, budgets: dict, baseline: dict = None, max_growth: float = None) -> list[str]:
+    """Returns a message per stage over its budget (in MB) or grown by more than max_growth since the baseline."""
+    baseline_scenarios = {(scenario["shape"], scenario["rows"]): scenario
+                          for scenario in (baseline or {}).get("scenarios", [])}
+    violations = []
+    for scenario in results["scenarios"]:
+        label = f"{scenario['shape']} {scenario['rows']} rows"
+        memory = _scenario_memory(scenario)
+        for name, budget_mb in budgets.items():
+            if name in memory and memory[name] > budget_mb * 1e6:
+                violations.append(f"{label}: {name} peaked at {memory[name] / 1e6:.1f} MB, budget {budget_mb:g} MB")
+
+        previous = baseline_scenarios.get((scenario["shape"], scenario["rows"]))
+        if max_growth is None or previous is None:
+            continue
+        for name, previous_peak in _scenario_memory(previous).items():
+            peak = memory.get(name)
+            if peak is not None and peak - previous_peak > max(previous_peak * max_growth, MEMORY_GROWTH_FLOOR_BYTES):
+                violations.append(f"{label}: {name} peaked at {peak / 1e6:.1f} MB, "
+                                  f"{previous_peak / 1e6:.1f} MB before ({peak / max(previous_peak, 1) - 1:+.0%})")
+    return violations
+
+
+def _parse_budgets(values: list[str]) -> dict:
+    budgets = {}
+    for value in values:
+        name, separator, megabytes = value.partition("=")
+        if not separator:
+            raise argparse.ArgumentTypeError(f"Memory budgets are given as STAGE=MB, got {value}")
+        budgets[name] = float(megabytes)
+    return budgets
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmark of the deck generation pipeline")
+    parser.add_argument("--shapes", nargs="+", default=SHAPES, choices=SHAPES)
+    parser.add_argument("--rows", nargs="+", type=int, default=[10, 1_000, 100_000])
+    parser.add_argument("--iterations", type=int, default=5)
+    parser.add_argument("--warmup", type=int, default=1)
+    parser.add_argument("--llm-latency", type=float, default=0.0, help="Seconds added to every fake LLM call")
+    parser.add_argument("--llm-jitter", type=float, default=0.0, help="Random extra seconds per fake LLM call")
+    parser.add_argument("--convert-pdf", action="store_true", help="Run the real LibreOffice conversion")
+    parser.add_argument("--output", help="Where to write the JSON results")
+    parser.add_argument("--compare", help="Earlier JSON results to compare against")
+    parser.add_argument("--memory-mode", default="tracemalloc", choices=["tracemalloc", "rss"],
+                        help="How the memory run measures the stages, see STAGE_MEMORY")
+    parser.add_argument("--memory-budget", nargs="+", default=[], metavar="STAGE=MB",
+                        help="Fails the run when a stage peaks above its budget, total is the whole deck")
+    parser.add_argument("--max-memory-growth", type=float,
+                        help="Fails the run when a stage peaks more than this fraction above the --compare run")
+    arguments = parser.parse_args()
+    budgets = _parse_budgets(arguments.memory_budget)
+
+    fake_client = FakeOpenAIClient(latency_seconds=arguments.llm_latency, jitter_seconds=arguments.llm_jitter)
+    openai_adapter.client = fake_client
+
+    created_at = datetime.datetime.now()
+    results = {
+        "created_at": created_at.isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "settings": vars(arguments),
+        "scenarios": [],
+    }
+
+    working_directory = os.getcwd()
+    with tempfile.TemporaryDirectory() as temporary_directory:
+        # create_chart writes its artifacts to the working directory
+        os.chdir(temporary_directory)
+        try:
+            for shape in arguments.shapes:
+                for rows in arguments.rows:
+                    print(f"Running {shape} with {rows} rows ...", flush=True)
+                    results["scenarios"].append(
+                        run_scenario(shape, rows, arguments.iterations, arguments.warmup, fake_client,
+                                     arguments.memory_mode)
+                    )
+        finally:
+            os.chdir(working_directory)
+
+    results["max_rss_bytes"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+    output = arguments.output or os.path.join(RESULTS_DIR, f"pipeline_{created_at.strftime('%Y-%m-%d_%H-%M-%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as output_file:
+        json.dump(results, output_file, indent=2)
+
+    print_report(results)
+    print(f"\nResults written to {output}")
+
+    baseline = None
+    if arguments.compare:
+        with open(arguments.compare) as baseline_file:
+            baseline = json.load(baseline_file)
+        print_comparison(baseline, results)
+
+    violations = check_memory(results, budgets, baseline, arguments.max_memory_growth)
+    if violations:
+        print("\nMemory regressions:")
+        for violation in violations:
+            print(f"    {violation}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+"""
+Exercises the OpenAI adapter's deadlines, retries, hedging and circuit breaker against a local fake server.
+
+The real openai client talks HTTP to benchmarks/fake_openai_server.py. Each scenario decides the charts of one
+dataset repeatedly, once with the plain transport and once with ResilientTransport, and reports latency, failed
+decks, retries, hedges and decks decided by the degraded heuristic.
+
+    python benchmarks/resilience_test.py --decks 40 --latency 0.2 --tail-rate 0.03 --tail-latency 5
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+APP_DIR = os.path.join(os.path.dirname(BENCHMARK_DIR), "app")
+
+sys.path.insert(0, APP_DIR)
+os.environ.setdefault("OPENAI_API_KEY", "resilience-test")
+
+import openai  # noqa: E402
+
+import admission  # noqa: E402
+import metrics  # noqa: E402
+import openai_adapter  # noqa: E402
+import ppt_service  # noqa: E402
+from datasets import SHAPES, generate_dataset  # noqa: E402
+from fake_openai_server import FakeOpenAIServer, FakeServerSettings  # noqa: E402
+
+
+def counter_total(counter) -> float:
+    return sum(sample.value for metric in counter.collect() for sample in metric.samples
+               if sample.name.endswith("_total"))
+
+
+def run_scenario(name: str, transport, server: FakeOpenAIServer, dataset, decks: int, deadline: float,
+                 warmup: int = 0) -> dict:
+    openai_adapter.set_transport(transport)
+    # Warm-up decks fill the latency history that the hedging delay is computed from
+    for _ in range(warmup):
+        # A fresh deadline per deck, the previous scenario's one has run out
+        metrics.start_request()
+        admission.start_deadline(deadline)
+        try:
+            ppt_service.decide_charts(dataset.dataframe.copy(), {}, dataset.chart_core_message)
+        except Exception:
+            pass
+
+    retries_before = counter_total(openai_adapter.LLM_RETRIES)
+    hedges_before = counter_total(openai_adapter.LLM_HEDGES)
+    degraded_before = counter_total(metrics.DEGRADED_DECISIONS)
+    requests_before = server.requests
+
+    durations = []
+    failures = 0
+    for _ in range(decks):
+        metrics.start_request()
+        admission.start_deadline(deadline)
+        start = time.perf_counter()
+        try:
+            decisions = ppt_service.decide_charts(dataset.dataframe.copy(), {}, dataset.chart_core_message)
+            if not decisions.chart_types:
+                failures += 1
+        except Exception:
+            failures += 1
+        durations.append(time.perf_counter() - start)
+
+    values = np.array(durations)
+    return {
+        "scenario": name,
+        "p50": float(np.percentile(values, 50)),
+        "p95": float(np.percentile(values, 95)),
+        "p99": float(np.percentile(values, 99)),
+        "failed_decks": failures,
+        "degraded_decks": counter_total(metrics.DEGRADED_DECISIONS) - degraded_before,
+        "retries": counter_total(openai_adapter.LLM_RETRIES) - retries_before,
+        "hedges": counter_total(openai_adapter.LLM_HEDGES) - hedges_before,
+        "upstream_requests": server.requests - requests_before,
+    }
+
+
+def check_probe_after_deadline(server_settings: FakeServerSettings, deadline: float) -> bool:
+    """A half-open probe cut short by the request deadline must not keep the breaker open, the next call probes."""
+    from models import SelectedChartType
+
+    cooldown_seconds = 0.2
+    breaker = openai_adapter.CircuitBreaker(failure_threshold=1, cooldown_seconds=cooldown_seconds)
+    transport = openai_adapter.ResilientTransport(openai_adapter.LiveTransport(), breaker)
+    error_rate = server_settings.error_rate
+
+    def call(call_deadline: float):
+        admission.start_deadline(call_deadline)
+        try:
+            transport.parse(openai_adapter.LARGE_MODEL, "probe", SelectedChartType)
+            return None
+        except Exception as exception:
+            return type(exception).__name__
+
+    try:
+        server_settings.error_rate = 1.0
+        call(deadline)
+        opened = breaker.is_open()
+        time.sleep(cooldown_seconds)
+        server_settings.error_rate = 0.0
+        probe_error = call(0)
+        next_error = call(deadline)
+    finally:
+        server_settings.error_rate = error_rate
+
+    passed = opened and probe_error == "DeadlineExceededError" and next_error is None and not breaker.is_open()
+    print(f"Probe after deadline: {'ok' if passed else 'FAILED'} (opened {opened}, probe {probe_error}, "
+          f"next call {next_error or 'answered'})")
+    return passed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Resilience test of the OpenAI adapter against a local fake server")
+    parser.add_argument("--shape", default="two_column", choices=SHAPES)
+    parser.add_argument("--decks", type=int, default=40)
+    parser.add_argument("--latency", type=float, default=0.2)
+    parser.add_argument("--tail-rate", type=float, default=0.03)
+    parser.add_argument("--tail-latency", type=float, default=5.0)
+    parser.add_argument("--error-rate", type=float, default=0.1)
+    parser.add_argument("--deadline", type=float, default=20, help="Request deadline per deck in seconds")
+    parser.add_argument("--warmup", type=int, default=20, help="Unmeasured decks before each scenario")
+    arguments = parser.parse_args()
+
+    dataset = generate_dataset(arguments.shape, 20)
+    answers = {response_model.__name__: answer.model_dump(mode="json")
+               for response_model, answer in dataset.answers.items()}
+    settings = FakeServerSettings(arguments.latency, arguments.tail_rate, arguments.tail_latency,
+                                  arguments.error_rate)
+    server = FakeOpenAIServer(answers, settings).start()
+    openai_adapter.client = openai.OpenAI(base_url=server.base_url, api_key="fake", max_retries=0)
+
+    metrics.start_request()
+    probe_released = check_probe_after_deadline(settings, arguments.deadline)
+
+    # The breaker is closed while the upstream is only partly unhealthy, tripping it is a scenario of its own
+    resilient = openai_adapter.ResilientTransport(openai_adapter.LiveTransport())
+    results = [
+        run_scenario("plain", openai_adapter.LiveTransport(), server, dataset, arguments.decks, arguments.deadline,
+                     arguments.warmup),
+        run_scenario("resilient", resilient, server, dataset, arguments.decks, arguments.deadline, arguments.warmup),
+    ]
+
+    settings.error_rate = 1.0
+    results.append(run_scenario("outage", openai_adapter.ResilientTransport(openai_adapter.LiveTransport()), server,
+                                dataset, max(arguments.decks // 4, 5), arguments.deadline))
+    server.stop()
+
+    print(f"{'scenario':<12}{'p50 s':>8}{'p95 s':>8}{'p99 s':>8}{'failed':>8}{'degraded':>10}{'retries':>9}"
+          f"{'hedges':>8}{'requests':>10}")
+    for result in results:
+        print(f"{result['scenario']:<12}{result['p50']:>8.2f}{result['p95']:>8.2f}{result['p99']:>8.2f}"
+              f"{result['failed_decks']:>8}{result['degraded_decks']:>10.0f}{result['retries']:>9.0f}"
+              f"{result['hedges']:>8.0f}{result['upstream_requests']:>10}")
+
+    if not probe_released:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
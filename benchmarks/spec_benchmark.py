@@ -0,0 +1,130 @@
+"""
+Throughput of /powerpoint/from-spec, which renders decks from caller-given chart types and data mappings.
+
+Builds the spec of each synthetic dataset from the answers a well-behaved LLM would give and posts it through the
+FastAPI app with several concurrent clients. No LLM is called, so the result is the CPU cost of a deck: ingestion,
+data preparation, chart rendering and saving (the PDF conversion is stubbed unless --convert-pdf is given).
+
+    python benchmarks/spec_benchmark.py --rows 10 1000 --decks 200 --clients 4
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+APP_DIR = os.path.join(os.path.dirname(BENCHMARK_DIR), "app")
+
+sys.path.insert(0, APP_DIR)
+os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+os.environ.setdefault("ARTIFACT_STORAGE", "local")
+# Replayed answers need no connections, the spec path makes no LLM calls anyway
+os.environ.setdefault("LLM_TRANSPORT", "replay")
+os.environ.setdefault("LLM_CASSETTE_PATH", os.devnull)
+if "--convert-pdf" not in sys.argv:
+    os.environ["PDF_CONVERTER"] = "stub"
+
+from fastapi.testclient import TestClient  # noqa: E402
+
+import main  # noqa: E402
+from datasets import SHAPES, generate_dataset  # noqa: E402
+from models import SelectedChartType, TwoColumnDataStructure, MultiColumnDataStructure, LongFormatDataStructure, \
+    BubbleChartDataStructure  # noqa: E402
+
+SPEC_FIELDS = {
+    MultiColumnDataStructure: "multi_column_data",
+    LongFormatDataStructure: "long_format_data",
+    TwoColumnDataStructure: "two_column_data",
+    BubbleChartDataStructure: "bubble_data",
+}
+
+
+def build_spec(dataset) -> dict:
+    selected_chart_type = dataset.answers[SelectedChartType]
+    spec = {
+        "data": dataset.dataframe.to_json(),
+        "chart_core_message": dataset.chart_core_message,
+        "chart_types": selected_chart_type.chart_types,
+        "last_line_includes_sum": selected_chart_type.last_line_includes_sum,
+    }
+    for response_model, answer in dataset.answers.items():
+        if response_model in SPEC_FIELDS:
+            spec[SPEC_FIELDS[response_model]] = answer.model_dump(mode="json")
+    # The long format mapping replaces the multi column one, as in the LLM path
+    if "long_format_data" in spec:
+        spec.pop("multi_column_data", None)
+    return spec
+
+
+def run_scenario(client: TestClient, shape: str, rows: int, decks: int, clients: int) -> dict:
+    spec = build_spec(generate_dataset(shape, rows))
+    durations = []
+    failures = []
+
+    def create_deck():
+        start = time.perf_counter()
+        response = client.post("/powerpoint/from-spec", json=spec)
+        if response.status_code != 200:
+            failures.append(f"{response.status_code} {response.text[:200]}")
+            return
+        durations.append(time.perf_counter() - start)
+        for extension in ("pptx", "pdf"):
+            path = f"{response.json()['presentation_name']}.{extension}"
+            if os.path.exists(path):
+                os.remove(path)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as executor:
+        for _ in range(decks):
+            executor.submit(create_deck)
+    elapsed = time.perf_counter() - start
+
+    values = np.array(durations or [0]) * 1000
+    return {
+        "shape": shape,
+        "rows": rows,
+        "p50_ms": float(np.percentile(values, 50)),
+        "p95_ms": float(np.percentile(values, 95)),
+        "decks_per_minute": len(durations) / elapsed * 60,
+        "failures": len(failures),
+        "failure_messages": sorted(set(failures))[:3],
+    }
+
+
+def main_benchmark():
+    parser = argparse.ArgumentParser(description="Throughput of decks rendered from explicit chart specs")
+    parser.add_argument("--shapes", nargs="+", default=SHAPES, choices=SHAPES)
+    parser.add_argument("--rows", nargs="+", type=int, default=[10, 1_000])
+    parser.add_argument("--decks", type=int, default=100, help="Decks per scenario")
+    parser.add_argument("--clients", type=int, default=4, help="Concurrent requests")
+    parser.add_argument("--convert-pdf", action="store_true", help="Run the real LibreOffice conversion")
+    arguments = parser.parse_args()
+
+    working_directory = os.getcwd()
+    results = []
+    with tempfile.TemporaryDirectory() as temporary_directory:
+        # Decks are written to the working directory
+        os.chdir(temporary_directory)
+        try:
+            with TestClient(main.app) as client:
+                for shape in arguments.shapes:
+                    for rows in arguments.rows:
+                        print(f"Running {shape} with {rows} rows ...", flush=True)
+                        results.append(run_scenario(client, shape, rows, arguments.decks, arguments.clients))
+        finally:
+            os.chdir(working_directory)
+
+    print(f"{'shape':<12}{'rows':>10}{'p50 ms':>10}{'p95 ms':>10}{'decks/min':>12}{'failures':>10}")
+    for result in results:
+        print(f"{result['shape']:<12}{result['rows']:>10}{result['p50_ms']:>10.1f}{result['p95_ms']:>10.1f}"
+              f"{result['decks_per_minute']:>12.0f}{result['failures']:>10}")
+        for message in result["failure_messages"]:
+            print(f"    {message}")
+
+
+if __name__ == "__main__":
+    main_benchmark()
@@ -0,0 +1,146 @@
+"""
+Peak memory and duration of the long-format pivot and the groupby sum, with the table read as a whole and streamed.
+
+Writes a BI-style export (one row per sale, 24 periods x 12 countries x 8 channels, so the charts stay small however
+many rows there are) as Parquet or CSV, then prepares the slides of both paths in a fresh process per run. Peak memory
+is the highest resident set sampled during the run minus the one before it, which covers pyarrow's allocations too.
+
+    python benchmarks/streaming_aggregation.py --rows 100000 1000000 5000000 --format parquet
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+import pyarrow
+import pyarrow.parquet
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+APP_DIR = os.path.join(os.path.dirname(BENCHMARK_DIR), "app")
+
+sys.path.insert(0, APP_DIR)
+os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+
+MODES = ["full", "streamed"]
+WRITE_CHUNK_ROWS = 500_000
+RSS_SAMPLE_INTERVAL_SECONDS = 0.002
+
+
+def write_export(path: str, data_format: str, rows: int):
+    # Written chunk by chunk, so the benchmark itself never holds the whole table either
+    random = np.random.default_rng(0)
+    countries = np.array([f"Country {index + 1}" for index in range(12)])
+    channels = np.array([f"Channel {index + 1}" for index in range(8)])
+    writer = None
+    for start in range(0, rows, WRITE_CHUNK_ROWS):
+        size = min(WRITE_CHUNK_ROWS, rows - start)
+        chunk = pd.DataFrame({
+            "Period": random.integers(0, 24, size) + 202401,
+            "Country": countries[random.integers(0, len(countries), size)],
+            "Channel": channels[random.integers(0, len(channels), size)],
+            "Units": random.integers(1, 100, size),
+            "Revenue": random.uniform(10, 10_000, size).round(2),
+        })
+        if data_format == "csv":
+            chunk.to_csv(path, mode="a" if start else "w", header=not start, index=False)
+        else:
+            table = pyarrow.Table.from_pandas(chunk, preserve_index=False)
+            writer = writer or pyarrow.parquet.ParquetWriter(path, table.schema)
+            writer.write_table(table)
+    if writer is not None:
+        writer.close()
+
+
+def decisions():
+    from models import ChartDecisions, SelectedChartType, LongFormatDataStructure, TwoColumnDataStructure, ChartType
+
+    chart_types = [ChartType.COLUMN_CLUSTERED.value, ChartType.COLUMN.value]
+    return ChartDecisions(
+        selected_chart_type=SelectedChartType(reason_for_selected_chart_types="benchmark", chart_types=chart_types,
+                                              is_in_long_format=True, last_line_includes_sum=False),
+        chart_types=chart_types,
+        last_line_includes_sum=False,
+        long_format_data=LongFormatDataStructure(explain_column_selection="benchmark", index="Period",
+                                                 columns="Country", values="Revenue", title="Revenue", unit="EUR",
+                                                 has_natural_sorting_order=True),
+        two_column_data=TwoColumnDataStructure(category="Channel", value="Units", axis_label="Units",
+                                               axis_unit="none", has_natural_sorting_order=False),
+    )
+
+
+def run_child(path: str, data_format: str, mode: str):
+    import data_ingestion
+    import metrics
+    import ppt_service
+
+    chart_decisions = decisions()
+    # The maximum resident set of the process is dominated by the imports, the current one is sampled instead
+    baseline_bytes = metrics.current_rss_bytes()
+    peak_bytes = [baseline_bytes]
+    finished = threading.Event()
+
+    def sample_rss():
+        while not finished.wait(RSS_SAMPLE_INTERVAL_SECONDS):
+            peak_bytes[0] = max(peak_bytes[0], metrics.current_rss_bytes())
+
+    sampler = threading.Thread(target=sample_rss, daemon=True)
+    sampler.start()
+    start = time.perf_counter()
+    if mode == "full":
+        df = data_ingestion.read_dataframe(path, data_format)
+        data_ingestion.compact_dataframe(df)
+        slide_specs = ppt_service.prepare_slide_specs(df, chart_decisions)
+    else:
+        # A threshold of one byte streams every file
+        data_ingestion.STREAMING_AGGREGATION_MIN_BYTES = 1
+        table = data_ingestion.open_chunked_table(path, data_format)
+        slide_specs = ppt_service.prepare_slide_specs(table, chart_decisions)
+    duration = time.perf_counter() - start
+    finished.set()
+    sampler.join()
+    peak_bytes[0] = max(peak_bytes[0], metrics.current_rss_bytes())
+
+    print(json.dumps({
+        "seconds": duration,
+        "peak_mb": (peak_bytes[0] - baseline_bytes) / 1024 / 1024,
+        "output_cells": sum(slide_spec.dataframe.size for slide_spec in slide_specs),
+        "checksum": float(sum(slide_spec.dataframe.select_dtypes("number").sum().sum() for slide_spec in slide_specs)),
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Memory of aggregating long exports, read whole or streamed")
+    parser.add_argument("--rows", nargs="+", type=int, default=[100_000, 1_000_000, 5_000_000])
+    parser.add_argument("--format", default="parquet", choices=["parquet", "csv"])
+    arguments = parser.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory() as temporary_directory:
+        for rows in arguments.rows:
+            path = os.path.join(temporary_directory, f"export_{rows}.{arguments.format}")
+            print(f"Writing {rows} rows ...", flush=True)
+            write_export(path, arguments.format, rows)
+            file_mb = os.path.getsize(path) / 1024 / 1024
+            for mode in MODES:
+                output = subprocess.run([sys.executable, __file__, "--child", path, arguments.format, mode],
+                                        check=True, capture_output=True, text=True).stdout
+                results.append({"rows": rows, "file_mb": file_mb, "mode": mode,
+                                **json.loads(output.strip().splitlines()[-1])})
+
+    print(f"{'rows':>10}{'file MB':>10}{'mode':>10}{'seconds':>10}{'peak MB':>10}{'cells':>8}{'checksum':>20}")
+    for result in results:
+        print(f"{result['rows']:>10}{result['file_mb']:>10.1f}{result['mode']:>10}{result['seconds']:>10.2f}"
+              f"{result['peak_mb']:>10.1f}{result['output_cells']:>8}{result['checksum']:>20.2f}")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 5 and sys.argv[1] == "--child":
+        run_child(*sys.argv[2:])
+    else:
+        main()
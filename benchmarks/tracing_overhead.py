@@ -0,0 +1,137 @@
+"""
+Measures what LLM call tracing adds to each call, with tracing off, sampled, fully on and with an overflowing queue.
+
+The real openai client calls benchmarks/fake_openai_server.py without latency, so the duration of a call is mostly
+client and tracing work. The exporter is replaced by one that serializes the events like the Langfuse exporter but
+sends nothing. --langfuse-wrapper adds the previous in-process langfuse.openai tracing for comparison, it needs
+LANGFUSE_PUBLIC_KEY and LANGFUSE_SECRET_KEY and is measured last because importing it patches the openai client.
+
+    python benchmarks/tracing_overhead.py --calls 500
+"""
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+APP_DIR = os.path.join(os.path.dirname(BENCHMARK_DIR), "app")
+
+sys.path.insert(0, APP_DIR)
+os.environ.setdefault("OPENAI_API_KEY", "tracing-benchmark")
+os.environ.setdefault("LLM_RESILIENCE", "off")
+
+import openai  # noqa: E402
+
+import metrics  # noqa: E402
+import openai_adapter  # noqa: E402
+import tracing  # noqa: E402
+from datasets import SHAPES, generate_dataset  # noqa: E402
+from fake_openai_server import FakeOpenAIServer  # noqa: E402
+
+
+def counter_value(counter, **labels) -> float:
+    return counter.labels(**labels)._value.get()
+
+
+def serializing_exporter(delay_seconds: float = 0):
+    def export(batch):
+        for event in batch:
+            tracing._serialize_output(event.output)
+        if delay_seconds:
+            time.sleep(delay_seconds)
+
+    return export
+
+
+def measure(name: str, calls: int, message: str, response_model) -> dict:
+    durations = []
+    for _ in range(calls):
+        # A new request per call, so sampling decides per call as it would per request
+        metrics.start_request()
+        start = time.perf_counter()
+        openai_adapter._query_openai(message, response_model)
+        durations.append(time.perf_counter() - start)
+
+    # tracemalloc slows every allocation down, memory is measured in a separate, untimed pass
+    tracemalloc.start()
+    for _ in range(max(calls // 5, 1)):
+        metrics.start_request()
+        openai_adapter._query_openai(message, response_model)
+    _, peak_bytes = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    values = np.array(durations) * 1000
+    return {"mode": name, "mean_ms": values.mean(), "p50_ms": np.percentile(values, 50),
+            "p99_ms": np.percentile(values, 99), "peak_mb": peak_bytes / 1024 / 1024}
+
+
+def run_tracing_mode(name: str, calls: int, message: str, response_model, sample_rate: float,
+                     queue_size: int = tracing.LLM_TRACE_QUEUE_SIZE, export_delay_seconds: float = 0) -> dict:
+    tracing.LLM_TRACING = "on" if sample_rate > 0 else "off"
+    tracing.LLM_TRACE_SAMPLE_RATE = sample_rate
+    tracing.start(serializing_exporter(export_delay_seconds), queue_size)
+
+    outcomes = ("sampled_out", "queued", "dropped")
+    before = {outcome: counter_value(tracing.TRACE_EVENTS, outcome=outcome) for outcome in outcomes}
+    result = measure(name, calls, message, response_model)
+    for outcome in outcomes:
+        result[outcome] = counter_value(tracing.TRACE_EVENTS, outcome=outcome) - before[outcome]
+
+    tracing.stop()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-call overhead of LLM tracing")
+    parser.add_argument("--shape", default="wide", choices=SHAPES)
+    parser.add_argument("--rows", type=int, default=50, help="Rows of the table in the prompt")
+    parser.add_argument("--calls", type=int, default=500)
+    parser.add_argument("--sample-rate", type=float, default=0.1)
+    parser.add_argument("--langfuse-wrapper", action="store_true")
+    arguments = parser.parse_args()
+
+    dataset = generate_dataset(arguments.shape, arguments.rows)
+    response_model, answer = next(iter(dataset.answers.items()))
+    server = FakeOpenAIServer({response_model.__name__: answer.model_dump(mode="json")}).start()
+    openai_adapter.client = openai.OpenAI(base_url=server.base_url, api_key="fake", max_retries=0)
+    message = dataset.dataframe.to_csv(index=False)
+
+    # Warms up the connection and the client's response model parsing
+    tracing.LLM_TRACING = "off"
+    measure("warmup", 20, message, response_model)
+
+    results = [
+        run_tracing_mode("off", arguments.calls, message, response_model, 0),
+        run_tracing_mode(f"sampled {arguments.sample_rate:g}", arguments.calls, message, response_model,
+                         arguments.sample_rate),
+        run_tracing_mode("on", arguments.calls, message, response_model, 1),
+        # An exporter slower than the calls fills the queue, the calls must not slow down with it
+        run_tracing_mode("overflow", arguments.calls, message, response_model, 1, queue_size=10,
+                         export_delay_seconds=5),
+    ]
+
+    if arguments.langfuse_wrapper:
+        from langfuse.openai import openai as langfuse_openai
+
+        tracing.LLM_TRACING = "off"
+        openai_adapter.client = langfuse_openai.OpenAI(base_url=server.base_url, api_key="fake", max_retries=0)
+        results.append(measure("langfuse.openai", arguments.calls, message, response_model))
+        langfuse_openai.flush_langfuse()
+
+    server.stop()
+
+    baseline = results[0]["mean_ms"]
+    print(f"{'mode':<18}{'mean ms':>9}{'p50 ms':>9}{'p99 ms':>9}{'overhead us':>13}{'peak MB':>9}"
+          f"{'sampled out':>13}{'queued':>8}{'dropped':>9}")
+    for result in results:
+        print(f"{result['mode']:<18}{result['mean_ms']:>9.3f}{result['p50_ms']:>9.3f}{result['p99_ms']:>9.3f}"
+              f"{(result['mean_ms'] - baseline) * 1000:>13.0f}{result['peak_mb']:>9.2f}"
+              f"{result.get('sampled_out', 0):>13.0f}{result.get('queued', 0):>8.0f}"
+              f"{result.get('dropped', 0):>9.0f}")
+
+
+if __name__ == "__main__":
+    main()